@@ -0,0 +1,402 @@
+"""
+Benchmarks for the Matrix hot paths, reporting operations per second and
+peak memory for each operation at each board size.
+
+Usage:
+    python benchmarks.py                          # Run and print a table.
+    python benchmarks.py --sizes 10 100 1000 4000 # Full sweep, takes minutes.
+    python benchmarks.py --filter slice life      # Only names containing these.
+    python benchmarks.py --save baseline.json     # Store results as baseline.
+    python benchmarks.py --compare baseline.json  # Flag regressions, exit 1 if any.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+from types import GeneratorType
+
+from matrix import Matrix, BoundedCursor
+from life import Life
+from tic_tac_toe import LineTracker
+
+DEFAULT_SIZES = [10, 100, 1000]
+
+# List of (name, setup) pairs. `setup(n)` receives the board side length and
+# returns the function to be timed, so preparing inputs is not measured. A
+# setup that needs cleaning up can instead yield the function once, and is
+# resumed after measuring.
+BENCHMARKS = []
+
+def benchmark(name):
+    """ Registers the decorated setup function under `name`. """
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+def numbers(n):
+    return Matrix(n, n, range(n * n))
+
+@benchmark('create_empty')
+def _(n):
+    return lambda: Matrix(n, n)
+
+@benchmark('create_data')
+def _(n):
+    data = list(range(n * n))
+    return lambda: Matrix(n, n, data)
+
+@benchmark('create_lists')
+def _(n):
+    rows = numbers(n).rows
+    return lambda: Matrix(rows)
+
+@benchmark('create_from_rows')
+def _(n):
+    rows = numbers(n).rows
+    return lambda: Matrix.from_rows(rows)
+
+@benchmark('create_from_flat_owned')
+def _(n):
+    data = list(range(n * n))
+    return lambda: Matrix.from_flat(data, n, copy=False)
+
+@benchmark('create_full')
+def _(n):
+    return lambda: Matrix.full(n, n, 0)
+
+@benchmark('create_fromfunction')
+def _(n):
+    return lambda: Matrix.fromfunction(max, n, n)
+
+@benchmark('copy')
+def _(n):
+    m = numbers(n)
+    return m.copy
+
+@benchmark('create_matrix')
+def _(n):
+    m = numbers(n)
+    return lambda: Matrix(m)
+
+@benchmark('create_typed')
+def _(n):
+    data = list(range(n * n))
+    return lambda: Matrix(n, n, data, dtype='q')
+
+@benchmark('get_int')
+def _(n):
+    m = numbers(n)
+    indices = range(0, n * n, max(1, n * n // 1000))
+    def run():
+        for i in indices:
+            m[i]
+    return run
+
+@benchmark('get_tuple')
+def _(n):
+    m = numbers(n)
+    indices = [divmod(i, n) for i in range(0, n * n, max(1, n * n // 1000))]
+    def run():
+        for index in indices:
+            m[index]
+    return run
+
+@benchmark('index')
+def _(n):
+    m = numbers(n)
+    return lambda: m.index(n * n - 1)
+
+@benchmark('index_indexed')
+def _(n):
+    m = Matrix(n, n, range(n * n), indexed=True)
+    return lambda: m.index(n * n - 1)
+
+@benchmark('slice_get')
+def _(n):
+    m = numbers(n)
+    start, stop = (n // 4, n // 4), (3 * n // 4, 3 * n // 4)
+    return lambda: m[start:stop]
+
+@benchmark('slice_set')
+def _(n):
+    m = numbers(n)
+    start, stop = (n // 4, n // 4), (3 * n // 4, 3 * n // 4)
+    patch = m[start:stop]
+    def run():
+        m[start:stop] = patch
+    return run
+
+@benchmark('map')
+def _(n):
+    m = numbers(n)
+    return lambda: m.map(abs)
+
+@benchmark('indexmap')
+def _(n):
+    m = numbers(n)
+    return lambda: m.indexmap(lambda index, value: index[0] + value)
+
+@benchmark('map_chain')
+def _(n):
+    m = numbers(n)
+    return lambda: m.map(abs).map(abs).map(abs)
+
+@benchmark('lazy_map_chain')
+def _(n):
+    m = numbers(n)
+    return lambda: m.lazy().map(abs).map(abs).map(abs).collect()
+
+@benchmark('add_scalar')
+def _(n):
+    m = numbers(n)
+    return lambda: m + 1
+
+@benchmark('add_matrix')
+def _(n):
+    m = numbers(n)
+    return lambda: m + m
+
+@benchmark('sum_cols')
+def _(n):
+    m = numbers(n)
+    return lambda: m.sum(axis=0)
+
+@benchmark('mask_set')
+def _(n):
+    m = numbers(n)
+    def run():
+        m[m.eq(0)] = 0
+    return run
+
+@benchmark('rows')
+def _(n):
+    m = numbers(n)
+    return lambda: m.rows
+
+@benchmark('cols')
+def _(n):
+    m = numbers(n)
+    return lambda: m.cols
+
+@benchmark('diagonals')
+def _(n):
+    m = numbers(n)
+    return lambda: m.diagonals
+
+@benchmark('lines')
+def _(n):
+    m = numbers(n)
+    return lambda: sum(1 for line in m.lines(5))
+
+@benchmark('neighbors')
+def _(n):
+    m = numbers(n)
+    indices = [divmod(i, n) for i in range(0, n * n, max(1, n * n // 1000))]
+    def run():
+        for row, col in indices:
+            sum(m.neighbors(row, col))
+    return run
+
+@benchmark('rect_sum_slice')
+def _(n):
+    m = numbers(n)
+    return lambda: sum(m[(n // 4, n // 4):(3 * n // 4, 3 * n // 4)])
+
+@benchmark('rect_sum_table')
+def _(n):
+    m = numbers(n)
+    m.rect_index = 'table'
+    return lambda: m.rect_sum(n // 4, n // 4, 3 * n // 4, 3 * n // 4)
+
+@benchmark('rect_sum_fenwick_write')
+def _(n):
+    m = numbers(n)
+    m.rect_index = 'fenwick'
+    def run():
+        m[n // 2, n // 2] += 1
+        m.rect_sum(n // 4, n // 4, 3 * n // 4, 3 * n // 4)
+    return run
+
+@benchmark('windows')
+def _(n):
+    m = numbers(n)
+    return lambda: sum(1 for window in m.windows(3, 3, 0))
+
+@benchmark('addrow_removerow')
+def _(n):
+    m = numbers(n)
+    row = list(range(n))
+    def run():
+        m.addrow(m.height, row)
+        m.removerow(-1)
+    return run
+
+@benchmark('addcol_removecol')
+def _(n):
+    m = numbers(n)
+    col = list(range(n))
+    def run():
+        m.addcol(m.width, col)
+        m.removecol(-1)
+    return run
+
+@benchmark('addcol_removecol_permuted')
+def _(n):
+    m = Matrix(n, n, range(n * n), backend='permuted')
+    col = list(range(n))
+    def run():
+        m.addcol(0, col)
+        m.removecol(-1)
+    return run
+
+@benchmark('repr')
+def _(n):
+    m = numbers(n)
+    return lambda: repr(m)
+
+@benchmark('repr_cached')
+def _(n):
+    m = numbers(n)
+    m.render_cached = True
+    def run():
+        m[0, 0] += 1
+        repr(m)
+    return run
+
+@benchmark('cursor_display_cached')
+def _(n):
+    m = numbers(n)
+    m.render_cached = True
+    cursor = BoundedCursor(m)
+    def run():
+        cursor.move(0, 1)
+        cursor.display
+    return run
+
+@benchmark('life_step')
+def _(n):
+    random.seed(0)
+    life = Life(n, 0.5)
+    return life.step
+
+@benchmark('life_step_workers')
+def _(n):
+    random.seed(0)
+    with Life(n, 0.5, workers=2) as life:
+        yield life.step
+
+@benchmark('tic_tac_toe_win_check')
+def _(n):
+    board = Matrix(n, n, default='')
+    tracker = LineTracker(board, win_size=min(n, 5))
+    for col in range(min(n, 5) - 1):
+        board[n // 2, col] = 'x'
+    cells = [divmod(i, n) for i in range(0, n * n, max(1, n * n // 1000))]
+    def run():
+        for row, col in cells:
+            tracker.play(row, col, 'x')
+            tracker.undo()
+    return run
+
+def measure(setup, n, min_time):
+    """
+    Returns (ops per second, peak bytes) for the function built by
+    `setup(n)`, calling it repeatedly for at least `min_time` seconds.
+    """
+    fn = setup(n)
+    cleanup = None
+    if isinstance(fn, GeneratorType):
+        cleanup, fn = fn, next(fn)
+    try:
+        # Untimed first call, so lazily built caches don't count.
+        fn()
+        runs, start = 0, perf_counter()
+        while True:
+            fn()
+            runs += 1
+            elapsed = perf_counter() - start
+            if elapsed >= min_time:
+                break
+
+        # Measured apart from the timing, because tracing slows allocations down.
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        if cleanup is not None:
+            next(cleanup, None)
+    return runs / elapsed, peak
+
+def run(sizes, filters=(), min_time=0.2):
+    """ Runs the selected benchmarks, printing and returning the results. """
+    results = {}
+    for name, setup in BENCHMARKS:
+        if filters and not any(f in name for f in filters):
+            continue
+        for n in sizes:
+            ops, peak = measure(setup, n, min_time)
+            key = '{}@{}'.format(name, n)
+            results[key] = {'ops': ops, 'peak': peak}
+            print('{:<32} {:>14.2f} ops/s {:>12} bytes'.format(key, ops, peak))
+            sys.stdout.flush()
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Prints results against the baseline ones, flagging speed drops and
+    memory growth larger than `threshold` (a fraction). Returns the number of
+    regressions.
+    """
+    regressions = 0
+    for key in sorted(set(results) & set(baseline)):
+        new, old = results[key], baseline[key]
+        speed = new['ops'] / old['ops']
+        memory = new['peak'] / float(old['peak'] or 1)
+        flags = []
+        if speed < 1 - threshold:
+            flags.append('SLOWER')
+        if memory > 1 + threshold and new['peak'] - old['peak'] > 4096:
+            flags.append('MORE MEMORY')
+        regressions += bool(flags)
+        print('{:<32} speed x{:<8.2f} memory x{:<8.2f} {}'.format(key, speed, memory, ' '.join(flags)))
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks Matrix operations.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='board side lengths (default: %(default)s)')
+    parser.add_argument('--filter', nargs='+', default=(),
+                        help='only run benchmarks whose names contain one of these')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to repeat each benchmark for (default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE', help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fraction of change reported as regression (default: %(default)s)')
+    args = parser.parse_args(args)
+
+    results = run(args.sizes, args.filter, args.min_time)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print('\nCompared to {}:'.format(args.compare))
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,20 +5,71 @@ rules on the number of neighbors.
 
 Uses True for alive cells and False for dead cells.
 """
-from matrix import Matrix
+from matrix import Matrix, BitMatrix
 from random import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from weakref import WeakValueDictionary
 
 class Life(object):
-    def __init__(self, size=20, probability_alive=0.8):
-        """ Creates a new board with given size and random live cells. """
+    def __init__(self, size=20, probability_alive=0.8, boundary='clip', backend=None, sparse=False, workers=None):
+        """
+        Creates a new board with given size and random live cells. `boundary`
+        is 'clip' for a board surrounded by dead cells, or 'wrap' for a board
+        whose edges touch the opposite side. `backend='numpy'` stores the
+        board in a NumPy array, if available, and `backend='bits'` in a
+        BitMatrix, stepping whole rows at once with bitwise operations.
+
+        With `sparse=True` each step only re-evaluates cells next to a cell
+        that changed in the previous generation, and updates the board in
+        place. This is much faster for mostly dead or stable boards. The
+        board then tracks its changes, so cells edited in place between steps
+        are re-evaluated too.
+
+        With `workers`, a number of processes or a `concurrent.futures`
+        Executor, each full step is split in bands computed in parallel. A
+        pool started for a number of processes is shut down by `close`, or
+        on leaving a `with` block.
+        """
         # The Matrix method `map` calls fn(cell_value) for every cell and builds
         # a new matrix with the results.
-        self.board = Matrix(size, size).map(lambda i: random() > probability_alive)
+        self.board = Matrix(size, size, backend=backend).map(lambda i: random() > probability_alive)
+        self.boundary = boundary
+        self.sparse = sparse
+        # Keep a single pool, instead of starting processes every step.
+        self._owns_workers = isinstance(workers, int)
+        self.workers = ProcessPoolExecutor(workers) if self._owns_workers else workers
         self.generation = 0
+        # Number of cells evaluated in each generation.
+        self.active_counts = []
+        # Cells that changed in the last step of sparse mode, only valid for
+        # `_tracked_board`. Set to None by `invalidate`, so the next step
+        # re-evaluates every cell.
+        self.changed = None
+        self._tracked_board = None
+        self._tracked_shape = None
 
-    def step_cell(self, pos, current):
+    def close(self):
+        """
+        Shuts down the process pool started for `workers`, if any. Executors
+        given by the caller are left running.
+        """
+        if self._owns_workers:
+            self.workers.shutdown()
+            self.workers = None
+            self._owns_workers = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def rule(alive, neighbors):
         """
-        Returns the new state of a given cell. Rules from wikipedia:
+        Returns the new state of a cell given its state and number of live
+        neighbors. Rules from wikipedia:
 
         - Any live cell with fewer than two live neighbors dies, as if caused
         by under-population.
@@ -28,28 +79,353 @@ class Life(object):
         overcrowding.
         - Any dead cell with exactly three live neighbors becomes a live cell,
         as if by reproduction.
-        """        
+
+        Written with bitwise operators so it also works on whole NumPy arrays.
+        """
+        return (neighbors == 3) | ((neighbors == 2) & alive)
+
+    def step_cell(self, pos, current):
+        """
+        Returns the new state of a given cell, looking at its neighbors one by
+        one. Much slower than `step`, which updates the whole board at once.
+        Only supports the 'clip' boundary.
+        """
         # Sum converts True/False to 1/0, so summing neighbors gives us the
         # number of neighbors alive.
         neighbors = sum(self.board.neighbors(*pos))
-        return current if neighbors == 2 else 2 <= neighbors <= 3
+        return self.rule(current, neighbors)
+
+    def invalidate(self):
+        """
+        Makes the next step re-evaluate every cell. Only needed in sparse
+        mode, after changes that don't go through the board's items, such as
+        changing `boundary` or writing to the board's storage directly.
+        Replacing the board or assigning its items is detected automatically.
+        """
+        self.changed = None
 
     def step(self):
-        """ Updates every cell and increments generation counter. """
-        # The method indexmap calls fn(pos, cell_value) and builds a new matrix
-        # with the results.
-        self.board = self.board.indexmap(self.step_cell)
+        """
+        Updates every cell and increments generation counter.
+
+        In sparse mode, only the cells around those changed by the last step
+        or assigned since are re-evaluated. Call `invalidate` first after
+        changing the board in other ways.
+        """
+        board = self.board
+        if (self.sparse and self.changed is not None and board is self._tracked_board
+                and (board.height, board.width) == self._tracked_shape):
+            self._step_sparse()
+        else:
+            # The method neighbor_counts sums the neighbors of every cell at
+            # once, and with `fn` calls fn(cell_value, count) for each cell.
+            # With workers, each process does both for its own band of the
+            # board in shared memory.
+            old = self.board
+            if isinstance(old, BitMatrix):
+                self.board = self._step_words(old)
+            else:
+                self.board = old.neighbor_counts(boundary=self.boundary, workers=self.workers, fn=self.rule)
+            self.active_counts.append(len(old))
+            if self.sparse:
+                width = old.width
+                self.changed = set(divmod(i, width) for i, (before, after)
+                                   in enumerate(zip(old, self.board)) if before != after)
+                self._tracked_board = self.board
+                self._tracked_shape = (self.board.height, self.board.width)
+                self.board.track_changes = True
         self.generation += 1
 
+    def _step_words(self, board):
+        """
+        Returns the next generation of a BitMatrix, applying `rule` to every
+        cell of a row at once on the bits of the neighbor counts.
+        """
+        words = []
+        for alive, (ones, twos, fours, eights) in zip(board.words, board.neighbor_planes(boundary=self.boundary)):
+            # Count is 3, or count is 2 and the cell is alive.
+            words.append(twos & ~fours & ~eights & (ones | alive))
+        return BitMatrix.from_words(words, board.width)
+
+    def _neighbor_positions(self, row, col):
+        """
+        Yields the positions around (row, col), taking the boundary into
+        account. On tiny wrapping boards the same cell may appear twice, the
+        same way it is counted twice by `neighbor_counts`.
+        """
+        height, width = self.board.height, self.board.width
+        wrap = self.boundary == 'wrap'
+        for i in (row - 1, row, row + 1):
+            for j in (col - 1, col, col + 1):
+                if i == row and j == col:
+                    continue
+                if wrap:
+                    yield i % height, j % width
+                elif 0 <= i < height and 0 <= j < width:
+                    yield i, j
+
+    def _step_sparse(self):
+        """
+        Re-evaluates only the cells that changed last generation or were
+        assigned since, and their neighbors, since every other cell is
+        guaranteed to stay the same.
+        """
+        board = self.board
+        changed = self.changed | board.changes()
+        candidates = set(changed)
+        for row, col in changed:
+            candidates.update(self._neighbor_positions(row, col))
+
+        changes = []
+        for row, col in candidates:
+            alive = board[row, col]
+            neighbors = sum(board[i, j] for i, j in self._neighbor_positions(row, col))
+            state = self.rule(alive, neighbors)
+            if state != alive:
+                changes.append(((row, col), state))
+
+        # Only write after evaluating every cell, so all use the old state.
+        for position, state in changes:
+            board[position] = state
+        board.clear_changes()
+        self.changed = set(position for position, state in changes)
+        self.active_counts.append(len(candidates))
+
     def show(self):
         """ Prints current generation and board. """
         print('Generation {}\n'.format(self.generation))
         print(self.board.map(lambda i: 'x' if i else '.'))
 
-# Run without interaction.
-import time
-life = Life()
-while True:
-    life.show()
-    time.sleep(0.2)
-    life.step()
+class _Node(object):
+    """
+    Square of 2**level by 2**level cells. Level 0 nodes are single cells,
+    other levels are made of four children of the level below. Nodes are
+    immutable and shared: there is a single node for each distinct pattern.
+    """
+    __slots__ = ('nw', 'ne', 'sw', 'se', 'level', 'population', '__weakref__')
+
+    def __init__(self, nw, ne, sw, se, level, population):
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.level = level
+        self.population = population
+
+class HashLife(object):
+    """
+    Game of Life using the Hashlife algorithm: the board is a quadtree where
+    identical sub-squares are the same node, and the future of each node is
+    memoized. Repetitive patterns (still lifes, oscillators, gliders, empty
+    space) are computed once, so advancing 2**k generations takes time
+    proportional to the number of distinct patterns seen, not to k or to the
+    board area.
+
+    Unlike Life, the board is an unbounded plane of dead cells: patterns may
+    grow past the edges of the imported matrix. Memoized results are kept in
+    an LRU cache of `cache_size` entries.
+
+    Usage:
+    hashlife = HashLife(Life(100).board)
+    hashlife.advance(20) # 2**20 generations.
+    print(hashlife.to_matrix())
+    """
+    def __init__(self, board, cache_size=2**20):
+        """ Imports the live cells of a Matrix, placing (0, 0) at the origin. """
+        self.cache_size = cache_size
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0
+        self._nodes = WeakValueDictionary()
+        self._cache = OrderedDict()
+        self._dead = _Node(None, None, None, None, 0, 0)
+        self._alive = _Node(None, None, None, None, 0, 1)
+        self._empty = [self._dead]
+
+        self.height, self.width = board.height, board.width
+        level = 1
+        while (1 << level) < max(self.height, self.width):
+            level += 1
+        self.root = self._build(board.rows, level, 0, 0)
+        # Plane coordinates of the top-left cell of the root.
+        self.top = self.left = 0
+
+    def _join(self, nw, ne, sw, se):
+        """ Returns the single node with the given children. """
+        key = (nw, ne, sw, se)
+        node = self._nodes.get(key)
+        if node is None:
+            population = nw.population + ne.population + sw.population + se.population
+            node = _Node(nw, ne, sw, se, nw.level + 1, population)
+            self._nodes[key] = node
+        return node
+
+    def _empty_node(self, level):
+        """ Returns the node of given level with only dead cells. """
+        while len(self._empty) <= level:
+            smaller = self._empty[-1]
+            self._empty.append(self._join(smaller, smaller, smaller, smaller))
+        return self._empty[level]
+
+    def _build(self, rows, level, top, left):
+        """ Builds the node for the square of `rows` starting at (top, left). """
+        if top >= self.height or left >= self.width:
+            return self._empty_node(level)
+        if level == 0:
+            return self._alive if rows[top][left] else self._dead
+        half = 1 << (level - 1)
+        return self._join(self._build(rows, level - 1, top, left),
+                          self._build(rows, level - 1, top, left + half),
+                          self._build(rows, level - 1, top + half, left),
+                          self._build(rows, level - 1, top + half, left + half))
+
+    def _expand(self):
+        """ Doubles the root size, keeping the current root in the center. """
+        root = self.root
+        empty = self._empty_node(root.level - 1)
+        self.root = self._join(self._join(empty, empty, empty, root.nw),
+                               self._join(empty, empty, root.ne, empty),
+                               self._join(empty, root.sw, empty, empty),
+                               self._join(root.se, empty, empty, empty))
+        offset = 1 << (root.level - 1)
+        self.top -= offset
+        self.left -= offset
+
+    def _step_4x4(self, node):
+        """ Returns the center 2x2 of a level 2 node after one generation. """
+        cells = [[node.nw.nw, node.nw.ne, node.ne.nw, node.ne.ne],
+                 [node.nw.sw, node.nw.se, node.ne.sw, node.ne.se],
+                 [node.sw.nw, node.sw.ne, node.se.nw, node.se.ne],
+                 [node.sw.sw, node.sw.se, node.se.sw, node.se.se]]
+        cells = [[cell.population for cell in row] for row in cells]
+        result = []
+        for row in (1, 2):
+            for col in (1, 2):
+                neighbors = sum(cells[i][j] for i in (row - 1, row, row + 1)
+                                for j in (col - 1, col, col + 1)) - cells[row][col]
+                result.append(self._alive if Life.rule(cells[row][col], neighbors) else self._dead)
+        return self._join(*result)
+
+    def _successor(self, node, j):
+        """
+        Returns the center half of `node` (one level below) after 2**j
+        generations, with j <= node.level - 2.
+        """
+        if node.population == 0:
+            return self._empty_node(node.level - 1)
+
+        key = (node, j)
+        result = self._cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+        self.misses += 1
+
+        if node.level == 2:
+            result = self._step_4x4(node)
+        else:
+            join, successor = self._join, self._successor
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            # Nine overlapping sub-squares of level-1, each advanced 2**j
+            # generations (or half of it, see below).
+            c1 = successor(nw, j)
+            c2 = successor(join(nw.ne, ne.nw, nw.se, ne.sw), j)
+            c3 = successor(ne, j)
+            c4 = successor(join(nw.sw, nw.se, sw.nw, sw.ne), j)
+            c5 = successor(join(nw.se, ne.sw, sw.ne, se.nw), j)
+            c6 = successor(join(ne.sw, ne.se, se.nw, se.ne), j)
+            c7 = successor(sw, j)
+            c8 = successor(join(sw.ne, se.nw, sw.se, se.sw), j)
+            c9 = successor(se, j)
+            if j < node.level - 2:
+                # Already advanced 2**j generations: just take the centers.
+                result = join(join(c1.se, c2.sw, c4.ne, c5.nw),
+                              join(c2.se, c3.sw, c5.ne, c6.nw),
+                              join(c4.se, c5.sw, c7.ne, c8.nw),
+                              join(c5.se, c6.sw, c8.ne, c9.nw))
+            else:
+                # Each half advanced 2**(j-1) generations, twice.
+                result = join(successor(join(c1, c2, c4, c5), j - 1),
+                              successor(join(c2, c3, c5, c6), j - 1),
+                              successor(join(c4, c5, c7, c8), j - 1),
+                              successor(join(c5, c6, c8, c9), j - 1))
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def _is_padded(self):
+        """
+        Returns True if all live cells are inside the center quarter of the
+        root, leaving room for the pattern to grow.
+        """
+        root = self.root
+        if root.level < 3:
+            return False
+        inner = (root.nw.se.se.population + root.ne.sw.sw.population +
+                 root.sw.ne.ne.population + root.se.nw.nw.population)
+        return inner == root.population
+
+    def advance(self, k=0):
+        """ Advances 2**k generations at once. """
+        while self.root.level < k + 3 or not self._is_padded():
+            self._expand()
+        offset = 1 << (self.root.level - 2)
+        self.root = self._successor(self.root, k)
+        self.top += offset
+        self.left += offset
+        self.generation += 1 << k
+
+    def step(self, generations=1):
+        """ Advances any number of generations, as a sum of powers of two. """
+        k = 0
+        while generations:
+            if generations & 1:
+                self.advance(k)
+            generations >>= 1
+            k += 1
+
+    @property
+    def population(self):
+        """ Number of live cells in the whole plane. """
+        return self.root.population
+
+    @property
+    def stats(self):
+        """ Returns cache statistics, for tuning `cache_size`. """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'cached': len(self._cache), 'nodes': len(self._nodes)}
+
+    def to_matrix(self, top=0, left=0, height=None, width=None):
+        """
+        Returns a Matrix of True/False with the cells of the plane starting at
+        (top, left), by default the same region that was imported.
+        """
+        height = self.height if height is None else height
+        width = self.width if width is None else width
+        board = Matrix(height, width, default=False)
+        self._export(board, self.root, self.top - top, self.left - left)
+        return board
+
+    def _export(self, board, node, top, left):
+        """ Marks the live cells of `node`, at (top, left) of `board`. """
+        size = 1 << node.level
+        if (not node.population or top >= board.height or left >= board.width or
+                top + size <= 0 or left + size <= 0):
+            return
+        if node.level == 0:
+            board[top, left] = True
+            return
+        half = size >> 1
+        self._export(board, node.nw, top, left)
+        self._export(board, node.ne, top, left + half)
+        self._export(board, node.sw, top + half, left)
+        self._export(board, node.se, top + half, left + half)
+
+if __name__ == '__main__':
+    # Run without interaction.
+    import time
+    life = Life()
+    while True:
+        life.show()
+        time.sleep(0.2)
+        life.step()
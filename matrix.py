@@ -1,6 +1,204 @@
 """
 Package for a 2D pythonic Matrix data type.
 """
+from array import array, typecodes
+from bisect import bisect_left, insort
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from itertools import accumulate, chain, compress, islice, product, repeat, starmap
+import operator
+from operator import add, mul
+import mmap
+import os
+import struct
+import sys
+import zlib
+from time import perf_counter
+from types import GeneratorType
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    SharedMemory = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# NumPy dtype kinds that can be vectorized: bool, int, uint, float, complex.
+_NUMERIC_KINDS = 'biufc'
+
+# Binary header of saved matrices: magic, format version, array typecode,
+# byte order ('<' or '>'), item size in bytes, flags, height, width and size
+# in bytes of the payload that follows, the items in row-major order.
+_MAGIC = b'MTRX'
+_HEADER = struct.Struct('<4sBccBB7xQQQ')
+_BYTEORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+# Header flags: payload compressed with zlib, items loaded back into a list
+# instead of a typed array, and items loaded back as booleans.
+_COMPRESSED, _UNTYPED, _BOOLEAN = 1, 2, 4
+
+def _pack_header(height, width, dtype, flags=0, size=None):
+    if size is None:
+        size = height * width * array(dtype).itemsize
+    return _HEADER.pack(_MAGIC, 1, dtype.encode('ascii'), _BYTEORDER, array(dtype).itemsize,
+                        flags, height, width, size)
+
+def _unpack_header(header):
+    """
+    Returns (height, width, dtype, flags, size) from a header, checking it's
+    usable.
+    """
+    if len(header) < _HEADER.size:
+        raise ValueError('Truncated matrix header.')
+    magic, version, dtype, byteorder, itemsize, flags, height, width, size = _HEADER.unpack(header[:_HEADER.size])
+    if magic != _MAGIC or version != 1:
+        raise ValueError('Not a matrix file.')
+    dtype = dtype.decode('ascii')
+    if byteorder != _BYTEORDER or dtype not in typecodes or array(dtype).itemsize != itemsize:
+        raise ValueError('Matrix of type {!r} was saved on an incompatible platform.'.format(dtype))
+    return height, width, dtype, flags, size
+
+def _unpack_values(payload, dtype, flags, length):
+    """ Returns the storage and dtype for a (decompressed) payload. """
+    values = array(dtype)
+    values.frombytes(payload)
+    if len(values) != length:
+        raise ValueError('Expected {} values, got {}.'.format(length, len(values)))
+    if flags & _BOOLEAN:
+        return list(map(bool, values)), None
+    elif flags & _UNTYPED:
+        return values.tolist(), None
+    return values, dtype
+
+def _tolist(values):
+    """ Converts a slice of storage (list or typed array) to a list. """
+    return values if isinstance(values, list) else values.tolist()
+
+@lru_cache(maxsize=64)
+def _diagonal_starts(height, width, direction):
+    """
+    Returns (row, col, length) of the first item of each diagonal of a
+    height x width matrix, for direction +1 (down and right) or -1 (down and
+    left), starting along the top row.
+    """
+    if not height or not width:
+        return ()
+    if direction == 1:
+        starts = [(0, col) for col in range(width)] + [(row, 0) for row in range(1, height)]
+        return tuple((row, col, min(height - row, width - col)) for row, col in starts)
+    else:
+        starts = [(0, col) for col in range(width)] + [(row, width - 1) for row in range(1, height)]
+        return tuple((row, col, min(height - row, col + 1)) for row, col in starts)
+
+def _check_kernel(kernel):
+    """ Returns `kernel` as a list of lists, checking its sides are odd. """
+    kernel = kernel.rows if isinstance(kernel, Matrix) else kernel
+    if len(kernel) % 2 == 0 or len(kernel[0]) % 2 == 0:
+        raise ValueError('Kernel sides must be odd, got {}x{}.'.format(len(kernel), len(kernel[0])))
+    return kernel
+
+def _float_sums(dtype, kernel, fill):
+    """
+    Returns True if a convolution gives floats, because of a float typecode,
+    weight or fill, in which case every sum starts from 0.0.
+    """
+    return dtype in ('f', 'd') or any(isinstance(w, float) for w in chain(chain.from_iterable(kernel), [fill]))
+
+def _convolve_rows(get_row, height, width, first, last, kernel, boundary, fill, zero=0):
+    """
+    Returns the flat convolution of rows `first` to `last` of a matrix, where
+    `get_row(i)` returns the i'th row as a list and every sum starts from
+    `zero`. See `Matrix.convolve`.
+    """
+    if boundary not in ('clip', 'wrap', 'constant'):
+        raise ValueError('Unknown boundary {!r}.'.format(boundary))
+    pad_rows, pad_cols = len(kernel) // 2, len(kernel[0]) // 2
+    fill = 0 if boundary == 'clip' else fill
+    if boundary == 'wrap':
+        columns = [col % width for col in range(-pad_cols, width + pad_cols)]
+    side = [fill] * pad_cols
+
+    # Rows `first - pad_rows` to `last + pad_rows`, extended on both sides.
+    padded = []
+    for i in range(first - pad_rows, last + pad_rows):
+        if boundary == 'wrap':
+            row = get_row(i % height)
+            padded.append([row[col] for col in columns])
+        elif 0 <= i < height:
+            padded.append(side + get_row(i) + side)
+        else:
+            padded.append([fill] * (width + 2 * pad_cols))
+
+    values = []
+    for row in range(last - first):
+        total = [zero] * width
+        for i, weights in enumerate(kernel):
+            source = padded[row + i]
+            for j, weight in enumerate(weights):
+                if not weight:
+                    continue
+                shifted = source[j:j + width]
+                if weight != 1:
+                    shifted = map(mul, repeat(weight), shifted)
+                total = list(map(add, total, shifted))
+        values.extend(total)
+    return values
+
+def _bands(height, workers):
+    """ Splits `height` rows into one (first, last) band per worker. """
+    count = workers if isinstance(workers, int) else os.cpu_count() or 1
+    count = max(1, min(count, height))
+    return [(height * i // count, height * (i + 1) // count) for i in range(count)]
+
+def _parallel(workers, task, jobs):
+    """
+    Runs `task(*job)` for each job, with `workers` being either a number of
+    processes or an existing Executor. Returns the results in order.
+    """
+    if isinstance(workers, Executor):
+        return list(workers.map(task, *zip(*jobs)))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(task, *zip(*jobs)))
+
+def _map_task(fn, *bands):
+    return list(map(fn, *bands))
+
+def _indexmap_task(fn, first, width, band):
+    return [fn(divmod(i, width), value) for i, value in enumerate(band, first * width)]
+
+def _convolve_task(source, typecode, height, width, first, last, kernel, boundary, fill, target, target_typecode, fn):
+    """
+    Convolves rows `first` to `last` of the matrix in shared memory block
+    `source`, writing the result to the same rows of block `target`. With
+    `fn`, returns instead `fn(item, sum)` for each item of the band.
+    """
+    source = SharedMemory(source)
+    try:
+        values = source.buf[:height * width * struct.calcsize(typecode)].cast(typecode)
+        get_row = lambda i: values[i * width:(i + 1) * width].tolist()
+        zero = 0.0 if target_typecode == 'd' else 0
+        sums = _convolve_rows(get_row, height, width, first, last, kernel, boundary, fill, zero)
+        if fn is not None:
+            band = values[first * width:last * width].tolist()
+            values.release()
+            return list(map(fn, band, sums))
+        result = array(target_typecode, sums)
+        view = memoryview(result).cast('B')
+        start = first * width * result.itemsize
+        target = SharedMemory(target)
+        try:
+            target.buf[start:start + len(view)] = view
+        finally:
+            # Views must be released before the blocks can be closed.
+            values.release()
+            view.release()
+            target.close()
+    finally:
+        source.close()
 
 class Matrix(object):
     """
@@ -8,46 +206,138 @@ class Matrix(object):
     few helper functions. All operations mutate the matrix in place, except
     `map` and `indexmap`.
 
+    Items are kept in a single flat list in row-major order, so the item at
+    (row, col) lives at offset `row * width + col`. Passing an `array` typecode
+    as `dtype` (e.g. 'i' or 'd') stores the items in a typed `array.array`
+    instead, which is much more compact for numeric data.
+
+    With `backend='numpy'` numeric matrices are stored in a NumPy array and
+    most operations are vectorized (see NumpyMatrix). If NumPy is not
+    installed, or the items are not numbers, a regular Matrix is used.
+    `backend='bits'` packs boolean matrices into one integer per row (see
+    BitMatrix). `backend='sparse'` only stores the items different from
+    `default` (see SparseMatrix). `backend='permuted'` makes inserting,
+    removing and reordering rows and columns cheap (see PermutedMatrix).
+
     Usage:
     m = Matrix(2, 3)
     m[5] = 10
     m[(0,0):(2,2)] = m[(1,1):(2,2)]
     """
-    def __init__(self, height=0, width=0, data=None, default=None):
+    # Storage offset of the item at (0, 0). Only views start elsewhere.
+    _origin = 0
+    # Objects notified of writes, see `_observe`.
+    _observers = ()
+    # Map of items to positions, see `indexed`.
+    _value_index = None
+    # Strings of items and rendered lines, see `render_cached`.
+    _render_cache = None
+    # Positions changed since the last checkpoint, see `track_changes`.
+    _change_tracker = None
+    # Summed-area tables or Fenwick trees, see `rect_index`.
+    _rect_index = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls is Matrix and kwargs.get('backend') == 'numpy' and numpy is not None:
+            cls = NumpyMatrix
+        elif cls is Matrix and kwargs.get('backend') == 'bits':
+            cls = BitMatrix
+        elif cls is Matrix and kwargs.get('backend') == 'sparse':
+            cls = SparseMatrix
+        elif cls is Matrix and kwargs.get('backend') == 'permuted':
+            cls = PermutedMatrix
+        return super(Matrix, cls).__new__(cls)
+
+    def __init__(self, height=0, width=0, data=None, default=None, dtype=None, backend=None, indexed=False):
         """
         Matrix() -> 0 by 0 matrix.
         Matrix(2, 3) -> empty matrix with 2 rows and 3 columns filled with None.
         Matrix([[1, 2], [3, 4]]) -> 2 by 2 matrix with given values.
+        Matrix(2, 3, dtype='i') -> 2 by 3 matrix of C ints, filled with 0.
+        Matrix(3, 3, range(9), indexed=True) -> constant time `index`, `in`.
+        Matrix(2, 3, backend='numpy') -> 2 by 3 NumPy-backed matrix of zeros.
 
         Matrices given are copied, not shared.
         """
+        if backend not in (None, 'numpy', 'bits', 'sparse', 'permuted'):
+            raise ValueError('Unknown backend {!r}.'.format(backend))
+        if backend == 'numpy' and not (isinstance(dtype, str) and dtype in typecodes):
+            # Falling back from NumPy, which accepts more dtypes than `array`.
+            dtype = None
+        if default is None and (dtype is not None or backend == 'numpy'):
+            default = 0
+
         if height and width and not data:
             # Matrix(15, 15)
-            self.m = [[default] * width for row in range(height)]
+            values = Matrix._storage([default], dtype) * (height * width)
         elif not height and not width and not data:
             # Matrix()
-            self.m = []
+            values = Matrix._storage([], dtype)
         elif height and width and data:
             # Matrix(10, 15, range(10 * 15))
-            iterator = iter(data)
-            self.m = [[next(iterator) for i in range(width)] for j in range(height)]
+            values = Matrix._storage(islice(data, height * width), dtype)
+            if len(values) != height * width:
+                raise ValueError('Expected {} values, got {}.'.format(height * width, len(values)))
         elif height and not width and not data:
             # Matrix([[1, 2], [3, 4]])
             data, height = height, None
             if isinstance(data, Matrix):
                 height = data.height
                 width = data.width
-                self.m = [[data[j, i] for i in range(width)] for j in range(height)]
+                if dtype is None and isinstance(data.dtype, str):
+                    dtype = data.dtype
+                values = Matrix._storage(data, dtype)
             else:
                 assert isinstance(data, list) and isinstance(data[0], list)
                 height = len(data)
                 width = len(data[0])
-                self.m = [[data[j][i] for i in range(width)] for j in range(height)]
+                if any(len(row) != width for row in data):
+                    raise ValueError('All rows must have the same length.')
+                values = Matrix._storage(chain.from_iterable(data), dtype)
         else:
             raise ValueError('Unknown constructor combination.')
 
+        self._data = values
+        self.dtype = dtype
         self.height = height
         self.width = width
+        if indexed:
+            self.indexed = True
+
+    @staticmethod
+    def _storage(values, dtype):
+        """
+        Returns a new flat storage with the given values: a list, or a typed
+        array if `dtype` is given.
+        """
+        return list(values) if dtype is None else array(dtype, values)
+
+    @staticmethod
+    def _is_storage(values, dtype):
+        """ True if `values` is already the kind of storage `_storage` builds. """
+        return isinstance(values, list) if dtype is None else isinstance(values, array) and values.typecode == dtype
+
+    @classmethod
+    def _wrap(cls, values, height, width, dtype=None):
+        """
+        Builds a matrix around an existing flat storage, without copying it.
+        """
+        result = cls.__new__(cls)
+        result._data = values
+        result.dtype = dtype
+        result.height = height
+        result.width = width
+        return result
+
+    @property
+    def _stride(self):
+        """ Distance in storage between the starts of consecutive rows. """
+        return self.width
+
+    @property
+    def _blank(self):
+        """ Value used to fill new cells when none is given. """
+        return None if self.dtype is None else 0
 
     def __bool__(self):
         """
@@ -55,26 +345,339 @@ class Matrix(object):
         """
         return self.height != 0 and self.width != 0
 
+    def _indexed_positions(self, value):
+        """
+        Returns the sorted flat positions of `value` from the value index, or
+        None if the matrix is not indexed or the index can't answer.
+        """
+        value_index = self._value_index
+        if value_index is None or value_index.unhashable:
+            return None
+        try:
+            return value_index.positions.get(value, ())
+        except TypeError:
+            return None
+
     def index(self, value):
         """
         Returns the (row, col) of the first occurrence of `value` or None.
         """
-        for row, col in self.indices():
-            if self[row, col] == value:
-                return (row, col)
+        positions = self._indexed_positions(value)
+        if positions is not None:
+            if not positions:
+                raise KeyError('Value {} not found in matrix.'.format(value))
+            return divmod(positions[0], self.width)
+        for row in range(self.height):
+            try:
+                return (row, self.row(row).index(value))
+            except ValueError:
+                pass
         raise KeyError('Value {} not found in matrix.'.format(value))
 
+    def index_all(self, value):
+        """ Returns the (row, col) of every occurrence of `value`, in order. """
+        positions = self._indexed_positions(value)
+        if positions is not None:
+            return [divmod(position, self.width) for position in positions]
+        return [(row, col) for row in range(self.height)
+                for col, item in enumerate(self.row(row)) if item == value]
+
+    def count(self, value):
+        """ Returns the number of occurrences of `value`. """
+        positions = self._indexed_positions(value)
+        if positions is not None:
+            return len(positions)
+        return sum(self.row(row).count(value) for row in range(self.height))
+
+    @property
+    def indexed(self):
+        """
+        True if the matrix keeps a map of each (hashable) item to its
+        positions, making `index`, `index_all`, `count` and `in` take
+        constant time. Can be assigned to build or drop the map, which is
+        updated on every write, and costs memory for every item.
+
+        Writes through views, or through other matrices sharing this
+        storage, are not seen by the map.
+        """
+        return self._value_index is not None
+
+    @indexed.setter
+    def indexed(self, enabled):
+        if enabled and self._value_index is None:
+            self._value_index = _ValueIndex(self)
+            self._observe(self._value_index)
+        elif not enabled and self._value_index is not None:
+            self._unobserve(self._value_index)
+            del self._value_index
+
+    @property
+    def render_cached(self):
+        """
+        True if the matrix keeps the string of every item and each rendered
+        line, updated on every write, so `repr`, `write_to` and cursor
+        displays of a mostly unchanged matrix only format the changed rows.
+        Can be assigned to enable or disable it. See `indexed` about views.
+        """
+        return self._render_cache is not None
+
+    @render_cached.setter
+    def render_cached(self, enabled):
+        if enabled and self._render_cache is None:
+            self._render_cache = _RenderCache(self)
+            self._observe(self._render_cache)
+        elif not enabled and self._render_cache is not None:
+            self._unobserve(self._render_cache)
+            del self._render_cache
+
+    @property
+    def track_changes(self):
+        """
+        True if the matrix records which items changed since the last
+        `clear_changes`, for `changes`. Can be assigned to start or stop
+        recording. See `indexed` about views.
+        """
+        return self._change_tracker is not None
+
+    @track_changes.setter
+    def track_changes(self, enabled):
+        if enabled and self._change_tracker is None:
+            self._change_tracker = _ChangeTracker()
+            self._observe(self._change_tracker)
+        elif not enabled and self._change_tracker is not None:
+            self._unobserve(self._change_tracker)
+            del self._change_tracker
+
+    @property
+    def rect_index(self):
+        """
+        How `integral` and the `rect_sum`, `rect_count` and `rect_mean`
+        queries are answered. None (the default) computes them from the items
+        every time. 'table' keeps summed-area tables, rebuilt on the first
+        query after a write, making queries constant time. 'fenwick' keeps
+        Fenwick trees instead, updated on every single-item write, with
+        writes and queries taking O(log(height) * log(width)): better when
+        writes and queries alternate. Either keeps one table or tree for sums
+        and one per value counted. See `indexed` about views.
+        """
+        return None if self._rect_index is None else self._rect_index.mode
+
+    @rect_index.setter
+    def rect_index(self, mode):
+        if mode not in (None, 'table', 'fenwick'):
+            raise ValueError("Expected None, 'table' or 'fenwick', got {!r}.".format(mode))
+        if self._rect_index is not None:
+            self._unobserve(self._rect_index)
+            del self._rect_index
+        if mode is not None:
+            self._rect_index = _RectIndex(mode)
+            self._observe(self._rect_index)
+
+    def integral(self):
+        """
+        Returns the summed-area table of the matrix: a (height + 1) by
+        (width + 1) matrix where the item at (row, col) is the sum of all
+        items above and left of (row, col) in this matrix. With `rect_index`
+        the table is cached until the next write, and must not be modified.
+        """
+        if self._rect_index is not None:
+            return self._rect_index.table(self, None)
+        return _summed_area(self, None)
+
+    def _rect(self, row0, col0, row1, col1):
+        """
+        Normalizes rectangle bounds like a 2D slice (None for the edges,
+        negative from the end, clipped to the matrix).
+        """
+        row0, row1, _ = slice(row0, row1).indices(self.height)
+        col0, col1, _ = slice(col0, col1).indices(self.width)
+        return row0, col0, max(row0, row1), max(col0, col1)
+
+    def _rect_total(self, key, row0, col0, row1, col1):
+        """ Sum of items (`key` None) or count of items equal to key[0]. """
+        row0, col0, row1, col1 = self._rect(row0, col0, row1, col1)
+        if self._rect_index is not None:
+            return self._rect_index.total(self, key, row0, col0, row1, col1)
+        rows = (self.row(row)[col0:col1] for row in range(row0, row1))
+        if key is None:
+            return sum(sum(row) for row in rows)
+        return sum(row.count(key[0]) for row in rows)
+
+    def rect_sum(self, row0=None, col0=None, row1=None, col1=None):
+        """
+        Returns the sum of the items in the rectangle from (row0, col0) to
+        (row1, col1), exclusive, like `m[(row0, col0):(row1, col1)]`. Takes
+        constant time with `rect_index`.
+        """
+        return self._rect_total(None, row0, col0, row1, col1)
+
+    def rect_count(self, value, row0=None, col0=None, row1=None, col1=None):
+        """
+        Returns the number of items equal to `value` in the rectangle, see
+        `rect_sum`.
+        """
+        return self._rect_total((value,), row0, col0, row1, col1)
+
+    def rect_mean(self, row0=None, col0=None, row1=None, col1=None):
+        """ Returns the mean of the items in the rectangle, see `rect_sum`. """
+        row0, col0, row1, col1 = self._rect(row0, col0, row1, col1)
+        area = (row1 - row0) * (col1 - col0)
+        if not area:
+            raise ValueError('Mean of an empty rectangle.')
+        return self._rect_total(None, row0, col0, row1, col1) / area
+
+    def changes(self, rectangles=False):
+        """
+        Returns the set of (row, col) positions whose items changed since
+        tracking started or the last `clear_changes`. Items moved by row or
+        column insertion and removal count as changed; removed positions are
+        not reported.
+
+        With `rectangles`, returns instead a list of ((row0, col0), (row1,
+        col1)) rectangles covering the changes, as in `m[(row0, col0):(row1,
+        col1)]`. Runs of changed items are merged along rows, then equal
+        runs in consecutive rows are merged. Rectangles from moved rows and
+        columns may overlap others.
+        """
+        tracker = self._change_tracker
+        if tracker is None:
+            raise ValueError('Changes are not tracked, set `track_changes` first.')
+        if not rectangles:
+            cells = set(tracker.cells)
+            cells.update((row, col) for row in tracker.rows for col in range(self.width))
+            cells.update((row, col) for col in tracker.cols for row in range(self.height))
+            return cells
+
+        result = []
+        for first, last in _runs(sorted(tracker.rows)):
+            result.append(((first, 0), (last + 1, self.width)))
+        for first, last in _runs(sorted(tracker.cols)):
+            result.append(((0, first), (self.height, last + 1)))
+
+        # Horizontal runs of the remaining cells, by row.
+        runs = {}
+        for row, col in sorted(tracker.cells):
+            if row not in tracker.rows and col not in tracker.cols:
+                runs.setdefault(row, []).append(col)
+        # Rectangles still growing downwards, by (col0, col1).
+        open_rectangles = {}
+        for row in sorted(runs):
+            spans = [(first, last + 1) for first, last in _runs(runs[row])]
+            for span in list(open_rectangles):
+                if span not in spans or open_rectangles[span][1] != row:
+                    row0, row1 = open_rectangles.pop(span)
+                    result.append(((row0, span[0]), (row1, span[1])))
+            for span in spans:
+                row0 = open_rectangles[span][0] if span in open_rectangles else row
+                open_rectangles[span] = (row0, row + 1)
+        for span, (row0, row1) in open_rectangles.items():
+            result.append(((row0, span[0]), (row1, span[1])))
+        return result
+
+    def clear_changes(self):
+        """ Forgets the changes recorded so far, starting a new checkpoint. """
+        if self._change_tracker is None:
+            raise ValueError('Changes are not tracked, set `track_changes` first.')
+        self._change_tracker.clear()
+
+    def _observe(self, observer):
+        """
+        Makes `observer` be notified of every change to this matrix, through
+        `observer.cell_changed(matrix, row, col, old, new)` for each item
+        written and `observer.shape_changed(matrix, operation, i)` after
+        `addrow`, `addcol`, `removerow` or `removecol` (the operation name)
+        at normalized index `i`.
+
+        The matrix's class is swapped for a subclass doing the notifications,
+        and swapped back when the last observer is removed, so matrices
+        without observers pay nothing.
+        """
+        if not self._observers:
+            self.__class__ = _observed_class(type(self))
+            self._observers = []
+        self._observers.append(observer)
+
+    def _unobserve(self, observer):
+        """ Stops notifying `observer`. """
+        self._observers.remove(observer)
+        if not self._observers:
+            del self._observers
+            self.__class__ = self.__class__._unobserved
+
+    def _write_positions(self, index):
+        """ Returns the (row, col) positions written by `self[index] = ...`. """
+        if isinstance(index, tuple) and len(index) == 2:
+            return [self._position(*index)]
+        elif isinstance(index, int):
+            if not -len(self) <= index < len(self):
+                raise IndexError('Index {} out of range.'.format(index))
+            return [divmod(index % len(self), self.width)]
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                return [divmod(i, self.width) for i in range(*index.indices(len(self)))]
+            (row0, col0), (row1, col1) = self._expand_slice(index)
+            return [(row, col) for row in range(row0, row1) for col in range(col0, col1)]
+        elif isinstance(index, Matrix):
+            self._check_shape(index)
+            return [divmod(i, self.width) for i in compress(range(len(self)), index)]
+        return []
+
+    def _rowstart(self, n):
+        """
+        Returns the storage offset of the first item in the n'th row,
+        supporting negative indices.
+        """
+        if n < 0:
+            n += self.height
+        if not 0 <= n < self.height:
+            raise IndexError('Row {} out of range.'.format(n))
+        return n * self.width
+
+    def _offset(self, row, col):
+        """
+        Returns the storage offset of the item at (row, col), supporting
+        negative indices.
+        """
+        if col < 0:
+            col += self.width
+        if not 0 <= col < self.width:
+            raise IndexError('Column {} out of range.'.format(col))
+        return self._rowstart(row) + col
+
+    def _position(self, row, col):
+        """ Normalizes (row, col), supporting negative indices. """
+        if row < 0:
+            row += self.height
+        if col < 0:
+            col += self.width
+        if not (0 <= row < self.height and 0 <= col < self.width):
+            raise IndexError('Index {} out of range.'.format((row, col)))
+        return row, col
+
+    def _unflatten(self, index):
+        """ Converts a flat item index, possibly negative, into (row, col). """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Index {} out of range.'.format(index))
+        return divmod(index, self.width)
+
     def row(self, n):
         """
         Returns the n'th row.
         """
-        return list(self.m[n])
+        start = self._rowstart(n)
+        return _tolist(self._data[start:start + self.width])
 
     def col(self, n):
         """
         Returns the n'th column.
         """
-        return [row[n] for row in self.m]
+        if not self.height:
+            return []
+        start = self._offset(0, n)
+        stop = start + (self.height - 1) * self._stride + 1
+        return _tolist(self._data[start:stop:self._stride])
 
     def diagonal(self, row, col, direction=+1):
         """
@@ -84,18 +687,29 @@ class Matrix(object):
         # Moves (row, col) to beginning of diagonal.
         if direction == 1:
             distance_to_start = min(row, col)
+            length = min(self.height - row, self.width - col) + distance_to_start
         else:
             distance_to_start = min(row, self.width - col - 1)
+            length = min(self.height - row, col + 1) + distance_to_start
         col -= direction * distance_to_start
-        row -= distance_to_start 
+        row -= distance_to_start
 
-        # Advance (row, col) until we reach the end of the matrix.
-        result = []
-        while row < self.height and 0 <= col < self.width:
-            result.append(self[row, col])
-            col += direction
-            row += 1
-        return result
+        # Each step down the diagonal moves `stride + direction` items forward.
+        start = self._offset(row, col)
+        step = self._stride + direction
+        return [self._data[start + i * step] for i in range(length)]
+
+    def _cell_diagonal(self, row, col, direction=+1):
+        """
+        `diagonal` for backends that read items one by one with `_get(row,
+        col)` instead of keeping them in `_data`.
+        """
+        row, col = self._position(row, col)
+        distance_to_start = min(row, col) if direction == 1 else min(row, self.width - col - 1)
+        col -= direction * distance_to_start
+        row -= distance_to_start
+        length = min(self.height - row, self.width - col if direction == 1 else col + 1)
+        return [self._get(row + i, col + i * direction) for i in range(length)]
 
     @property
     def rows(self):
@@ -113,17 +727,166 @@ class Matrix(object):
         Returns a list containing all diagonals, both left to right and right
         to left.
         """
-        return ([self.diagonal(0, i) for i in range(self.width)] +
-                [self.diagonal(i, 0) for i in range(1, self.height)] +
-                [self.diagonal(0, i, -1) for i in range(self.height)] +
-                [self.diagonal(i, self.width - 1, -1) for i in range(self.height)])
+        return list(self.iter_diagonals(1)) + list(self.iter_diagonals(-1))
+
+    def iter_rows(self, chunk=None):
+        """
+        Yields each row as a list, without building them all at once. With
+        `chunk`, yields lists of up to `chunk` rows instead.
+        """
+        if chunk is None:
+            for i in range(self.height):
+                yield self.row(i)
+            return
+        if chunk < 1:
+            raise ValueError('Chunk size must be positive, got {}.'.format(chunk))
+        for first in range(0, self.height, chunk):
+            yield [self.row(i) for i in range(first, min(first + chunk, self.height))]
+
+    def iter_tiles(self, tile_height, tile_width, overlap=0):
+        """
+        Yields ((row, col), tile) for tiles of `tile_height` by `tile_width`
+        items covering the matrix in row-major order, where `tile` is a new
+        Matrix whose item (0, 0) is at (row, col). Tiles on the bottom and
+        right edges may be smaller. With `overlap`, each tile also includes up
+        to `overlap` items past each of its sides, so a stencil reaching that
+        far can be computed for every item of the tile proper.
+
+        Only the rows of one band of tiles are read and kept at a time.
+        """
+        if tile_height < 1 or tile_width < 1 or overlap < 0:
+            raise ValueError('Invalid tiles of {}x{} overlapping {}.'.format(tile_height, tile_width, overlap))
+        dtype = self.dtype if isinstance(self.dtype, str) else None
+        for top in range(0, self.height, tile_height):
+            row0 = max(0, top - overlap)
+            band = [self.row(i) for i in range(row0, min(self.height, top + tile_height + overlap))]
+            for left in range(0, self.width, tile_width):
+                col0, col1 = max(0, left - overlap), min(self.width, left + tile_width + overlap)
+                yield (row0, col0), Matrix.from_rows([row[col0:col1] for row in band], dtype)
+
+    def windows(self, height, width, fill=None):
+        """
+        Yields ((row, col), window) for every item in row-major order, where
+        `window` is a list of `height` lists of `width` items centered on
+        (row, col). Both sides must be odd, and items outside the matrix are
+        `fill`. Each row is read once and kept in a sliding buffer of `height`
+        rows, so memory doesn't grow with the matrix.
+
+        Usage (3x3 median filter):
+        medians = (sorted(chain(*window))[4] for position, window in m.windows(3, 3, 0))
+        Matrix.from_flat(medians, m.width)
+        """
+        if height % 2 == 0 or width % 2 == 0:
+            raise ValueError('Window sides must be odd, got {}x{}.'.format(height, width))
+        pad_rows, padding = height // 2, [fill] * (width // 2)
+        blank = [fill] * (self.width + 2 * len(padding))
+        rows = (padding + row + padding for row in self.iter_rows())
+        buffer = [blank] * pad_rows + list(islice(rows, pad_rows + 1))
+        buffer += [blank] * (height - len(buffer))
+        for row in range(self.height):
+            for col in range(self.width):
+                yield (row, col), [line[col:col + width] for line in buffer]
+            buffer = buffer[1:] + [next(rows, blank)]
+
+    def iter_cols(self):
+        """ Yields each column as a list, without building them all at once. """
+        for i in range(self.width):
+            yield self.col(i)
+
+    def iter_diagonals(self, direction=+1):
+        """
+        Yields each diagonal as a list, left to right for direction +1 or
+        right to left for -1, in the same order as `diagonals`.
+        """
+        for row, col, length in _diagonal_starts(self.height, self.width, direction):
+            yield self._line(row, col, 1, direction, length)
+
+    def line(self, start, direction, length):
+        """
+        Returns `length` items starting at `start` (row, col) and moving by
+        `direction` (drow, dcol) each step, such as (0, 1) along a row or
+        (1, -1) down an anti-diagonal. The whole line must be in range.
+        """
+        row, col = self._position(*start)
+        drow, dcol = direction
+        if length > 1 and drow == dcol == 0:
+            raise ValueError('Direction must move, got {}.'.format(direction))
+        end_row, end_col = row + drow * (length - 1), col + dcol * (length - 1)
+        if length < 0 or length and not (0 <= end_row < self.height and 0 <= end_col < self.width):
+            raise IndexError('Line of {} items from {} going {} out of range.'.format(length, start, direction))
+        return self._line(row, col, drow, dcol, length)
+
+    def lines(self, k):
+        """
+        Yields (start, direction, items) for every run of `k` consecutive
+        items along rows, columns, diagonals and anti-diagonals, in this
+        order. Each line is read once and its runs sliced from it, so this is
+        the fast way to scan a board for k in a row.
+
+        Usage:
+        for start, direction, items in board.lines(5):
+            if items[0] != '' and items.count(items[0]) == 5:
+                print(items[0], 'wins at', start, direction)
+        """
+        if k < 1:
+            raise ValueError('Line length must be positive, got {}.'.format(k))
+        for row, values in enumerate(self.iter_rows()):
+            for col in range(len(values) - k + 1):
+                yield (row, col), (0, 1), values[col:col + k]
+        for col, values in enumerate(self.iter_cols()):
+            for row in range(len(values) - k + 1):
+                yield (row, col), (1, 0), values[row:row + k]
+        for direction in (1, -1):
+            starts = _diagonal_starts(self.height, self.width, direction)
+            for (row, col, length), values in zip(starts, self.iter_diagonals(direction)):
+                for i in range(length - k + 1):
+                    yield (row + i, col + i * direction), (1, direction), values[i:i + k]
+
+    def _line(self, row, col, drow, dcol, length):
+        """
+        Returns `length` items from the non-negative (row, col) in steps of
+        (drow, dcol), all known to be in range, as one extended slice of the
+        storage.
+        """
+        if length <= 1:
+            return [self._data[self._offset(row, col)]] if length else []
+        start = self._offset(row, col)
+        step = drow * self._stride + dcol
+        stop = start + step * (length - 1) + (1 if step > 0 else -1)
+        return _tolist(self._data[start:stop if stop >= 0 else None:step])
+
+    def _cell_line(self, row, col, drow, dcol, length):
+        """ `_line` for backends that read items with `_get(row, col)`. """
+        return [self._get(row + i * drow, col + i * dcol) for i in range(length)]
+
+    def _values(self, values, length, fill=False):
+        """
+        Converts `values` to storage of the right type, checking its length.
+        With `fill`, for new rows and columns, missing values are replaced by
+        `length` copies of the blank value.
+        """
+        values = self._storage(values if values is not None else (), self.dtype)
+        if fill and not len(values):
+            return self._storage([self._blank] * length, self.dtype)
+        if len(values) != length:
+            raise ValueError('Expected {} values, got {}.'.format(length, len(values)))
+        return values
+
+    @staticmethod
+    def _insertion_point(i, length):
+        """ Normalizes an insertion index the same way `list.insert` does. """
+        if i < 0:
+            i = max(0, i + length)
+        return min(i, length)
 
     def addrow(self, i, values=None):
         """
         Adds a row at the i'th position, optionally passing the list of values
         to fill the new row (defaults to all None).
         """
-        self.m.insert(i, list(values or [None] * self.width))
+        values = self._values(values, self.width, fill=True)
+        start = self._insertion_point(i, self.height) * self.width
+        self._data[start:start] = values
         self.height += 1
 
     def addcol(self, i, values=None):
@@ -131,22 +894,292 @@ class Matrix(object):
         Adds a column at the i'th position, optionally passing the list of
         values to fill the new column (defaults to all None).
         """
-        values = list(values or [None] * self.height)
-        for row, line in enumerate(self.m):
-            line.insert(i, values[row])
+        values = self._values(values, self.height, fill=True)
+        i = self._insertion_point(i, self.width)
+        old, width = self._data, self.width
+        data = old[0:0]
+        for row in range(self.height):
+            start = row * width
+            data.extend(old[start:start + i])
+            data.append(values[row])
+            data.extend(old[start + i:start + width])
+        self._data = data
         self.width += 1
 
     def removerow(self, i):
         """ Removes the i'th row. """
-        self.m.pop(i)
+        start = self._rowstart(i)
+        del self._data[start:start + self.width]
         self.height -= 1
 
     def removecol(self, i):
         """ Removes the i'th column. """
-        for row in self.m:
-            row.pop(i)
+        if i < 0:
+            i += self.width
+        if not 0 <= i < self.width:
+            raise IndexError('Column {} out of range.'.format(i))
+        del self._data[i::self.width]
         self.width -= 1
 
+    def swaprows(self, i, j):
+        """ Swaps the i'th and j'th rows. """
+        i, j = self._normalized(i, self.height), self._normalized(j, self.height)
+        first, second = self.row(i), self.row(j)
+        self[(i, 0):(i + 1, self.width)] = [second]
+        self[(j, 0):(j + 1, self.width)] = [first]
+
+    def swapcols(self, i, j):
+        """ Swaps the i'th and j'th columns. """
+        i, j = self._normalized(i, self.width), self._normalized(j, self.width)
+        first, second = self.col(i), self.col(j)
+        self[(0, i):(self.height, i + 1)] = [[value] for value in second]
+        self[(0, j):(self.height, j + 1)] = [[value] for value in first]
+
+    def permute_rows(self, order):
+        """
+        Reorders the rows so that the new k'th row is the old `order[k]`'th.
+        `order` must contain each row index once.
+
+        m.permute_rows([2, 0, 1]) -> last row becomes the first.
+        """
+        order = self._check_permutation(order, self.height)
+        rows = self.rows
+        self[:] = [rows[k] for k in order]
+
+    def permute_cols(self, order):
+        """
+        Reorders the columns so that the new k'th column is the old
+        `order[k]`'th. `order` must contain each column index once.
+        """
+        order = self._check_permutation(order, self.width)
+        self[:] = [[row[k] for k in order] for row in self.rows]
+
+    @staticmethod
+    def _normalized(i, length):
+        """ Normalizes a (possibly negative) index, raising IndexError. """
+        if not -length <= i < length:
+            raise IndexError('Index {} out of range.'.format(i))
+        return i % length
+
+    @staticmethod
+    def _check_permutation(order, length):
+        order = list(order)
+        if sorted(order) != list(range(length)):
+            raise ValueError('Expected a permutation of range({}), got {}.'.format(length, order))
+        return order
+
+    def compact(self):
+        """
+        Rebuilds the storage without indirections or unused space. Does
+        nothing on matrices that are always compact, such as this one; see
+        PermutedMatrix.
+        """
+
+    def view(self, start=None, stop=None):
+        """
+        Returns a MatrixView of the rectangle from `start` to `stop`, with the
+        same meaning as the 2D slice `m[start:stop]`. Unlike slicing, the
+        view shares this matrix's storage, so no items are copied and writes
+        to the view are visible in this matrix.
+
+        m.view((1, 1), (3, 3)) -> 2 by 2 window starting at (1, 1).
+        """
+        return MatrixView(self, start, stop)
+
+    def lazy(self):
+        """
+        Returns a LazyMatrix over this matrix, where `map` and `indexmap` calls
+        are recorded instead of applied, and later run together in a single
+        pass with no intermediate matrices.
+
+        m.lazy().map(f).indexmap(g).collect() -> same as m.map(f).indexmap(g)
+        """
+        return LazyMatrix(self)
+
+    @staticmethod
+    def open_mmap(path, height=None, width=None, dtype=None):
+        """
+        Returns a MmapMatrix stored in the file at `path`, which is created
+        with the given shape and `array` typecode (default 'q') and filled
+        with zeros if it doesn't exist yet.
+
+        Matrix.open_mmap('board.bin', 100000, 100000, 'b') -> 10 GB of int8s.
+        Matrix.open_mmap('board.bin') -> reopens it with the saved shape.
+        """
+        return MmapMatrix(path, height, width, dtype)
+
+    def copy(self):
+        """ Returns a new matrix with the same items. """
+        return Matrix._wrap(self._data[:], self.height, self.width, self.dtype)
+
+    @classmethod
+    def _build(cls, values, height, width, dtype=None):
+        """
+        Returns a matrix of this class with the flat storage `values`. A plain
+        Matrix adopts it, other classes convert it.
+        """
+        result = Matrix._wrap(values, height, width, dtype)
+        return result if cls is Matrix else cls(result, dtype=dtype)
+
+    @classmethod
+    def from_flat(cls, values, width, dtype=None, copy=True):
+        """
+        Returns a matrix with the items of `values`, in row-major order, cut
+        in rows of `width` items. With `copy` False, a list (or an `array` of
+        typecode `dtype`) becomes the storage of the new matrix as is, and
+        must not be modified elsewhere.
+
+        Matrix.from_flat(range(6), 3) -> 2 by 3 matrix.
+        """
+        if copy or not Matrix._is_storage(values, dtype):
+            values = Matrix._storage(values, dtype)
+        if width <= 0 and len(values) or width > 0 and len(values) % width:
+            raise ValueError('{} values do not fill rows of {} items.'.format(len(values), width))
+        return cls._build(values, len(values) // width if width > 0 else 0, max(width, 0), dtype)
+
+    @classmethod
+    def from_rows(cls, rows, dtype=None, copy=True):
+        """
+        Returns a matrix with the given rows, a list of equally long
+        sequences. The rows are concatenated in one pass. Flat storage can't
+        keep them apart, so `copy` False only avoids copying in classes
+        storing each row on its own (PermutedMatrix).
+
+        Matrix.from_rows([[1, 2], [3, 4]]) -> 2 by 2 matrix.
+        """
+        width = len(rows[0]) if rows else 0
+        if any(len(row) != width for row in rows):
+            raise ValueError('All rows must have the same length.')
+        return cls._build(Matrix._storage(chain.from_iterable(rows), dtype), len(rows), width, dtype)
+
+    @classmethod
+    def fromfunction(cls, fn, height, width, dtype=None):
+        """
+        Returns a matrix where the item at (row, col) is `fn(row, col)`.
+
+        Matrix.fromfunction(lambda row, col: row == col, 3, 3) -> identity.
+        """
+        values = Matrix._storage(starmap(fn, product(range(height), range(width))), dtype)
+        return cls._build(values, height, width, dtype)
+
+    @classmethod
+    def full(cls, height, width, value, dtype=None):
+        """ Returns a matrix with every item equal to `value`. """
+        return cls._build(Matrix._storage([value], dtype) * (height * width), height, width, dtype)
+
+    @classmethod
+    def from_buffer(cls, buffer, dtype, width):
+        """
+        Returns a matrix of `array` typecode `dtype` with a copy of the
+        machine values in a bytes-like object, such as `bytes`, a `mmap` or
+        the buffer of another array, cut in rows of `width` items.
+        """
+        values = array(dtype)
+        values.frombytes(buffer)
+        return cls.from_flat(values, width, dtype, copy=False)
+
+    @staticmethod
+    def from_numpy(ndarray, copy=True):
+        """
+        Returns a NumPy-backed matrix with the items of a 2D array. The array is
+        copied unless `copy` is False, in which case the matrix shares it.
+
+        Matrix.from_numpy(numpy.eye(3)) -> 3 by 3 identity matrix.
+        """
+        if ndarray.ndim != 2:
+            raise ValueError('Expected a 2D array, got {} dimensions.'.format(ndarray.ndim))
+        if ndarray.dtype.kind not in _NUMERIC_KINDS:
+            height, width = ndarray.shape
+            return Matrix._wrap(ndarray.ravel().tolist(), height, width)
+        return NumpyMatrix._from_array(ndarray.copy() if copy else ndarray)
+
+    def to_numpy(self, dtype=None):
+        """ Returns a new 2D NumPy array with the items of this matrix. """
+        if numpy is None:
+            raise ImportError('NumPy is required for to_numpy.')
+        return numpy.array(list(self), dtype=dtype).reshape(self.height, self.width)
+
+    def _payload(self):
+        """
+        Returns (dtype, flags, bytes) with the items packed for `dumps`.
+        Untyped matrices are packed as booleans, 64 bit ints or doubles,
+        whichever fits all items. Items that wouldn't load back as they are,
+        like booleans mixed with numbers, raise TypeError.
+        """
+        if isinstance(self.dtype, str):
+            if isinstance(self._data, (array, memoryview)) and len(self._data) == len(self):
+                return self.dtype, 0, self._data.tobytes()
+            return self.dtype, 0, array(self.dtype, self).tobytes()
+        items = list(self)
+        if all(type(item) is bool for item in items):
+            return 'B', _BOOLEAN, array('B', items).tobytes()
+        wrong = next((item for item in items if not isinstance(item, (int, float))), None)
+        if wrong is not None:
+            raise TypeError('Only numbers can be saved, got {!r}.'.format(wrong))
+        if any(type(item) is bool for item in items):
+            raise TypeError('Booleans can only be saved with other booleans.')
+        if all(isinstance(item, int) for item in items):
+            limit = 2 ** 63
+            wrong = next((item for item in items if not -limit <= item < limit), None)
+            if wrong is not None:
+                raise TypeError('Integer {} does not fit in 64 bits.'.format(wrong))
+            return 'q', _UNTYPED, array('q', items).tobytes()
+        wrong = next((item for item in items if isinstance(item, int) and abs(item) > 2 ** 53), None)
+        if wrong is not None:
+            raise TypeError('Integer {} cannot be saved exactly as a double.'.format(wrong))
+        return 'd', _UNTYPED, array('d', items).tobytes()
+
+    def dumps(self, compress=False):
+        """
+        Returns the matrix as bytes: a header with shape and type followed by
+        the packed items, compressed with zlib if `compress` is True (or a
+        zlib level from 1 to 9). Items must be numbers or booleans.
+
+        Matrix.loads(m.dumps()) == m -> True
+        """
+        dtype, flags, payload = self._payload()
+        if compress:
+            payload = zlib.compress(payload, 6 if compress is True else compress)
+            flags |= _COMPRESSED
+        return _pack_header(self.height, self.width, dtype, flags, len(payload)) + payload
+
+    @staticmethod
+    def loads(data):
+        """
+        Returns a new matrix from bytes created by `dumps`. Extra bytes after
+        the matrix are ignored.
+        """
+        height, width, dtype, flags, size = _unpack_header(data)
+        payload = data[_HEADER.size:_HEADER.size + size]
+        if len(payload) != size:
+            raise ValueError('Truncated matrix data.')
+        if flags & _COMPRESSED:
+            payload = zlib.decompress(payload)
+        values, dtype = _unpack_values(payload, dtype, flags, height * width)
+        return Matrix._wrap(values, height, width, dtype)
+
+    def save(self, file, compress=False):
+        """
+        Writes the matrix to a path or binary file object, in the format of
+        `dumps`. Several matrices may be saved one after the other in the
+        same file and loaded back in order.
+        """
+        data = self.dumps(compress)
+        if isinstance(file, str):
+            with open(file, 'wb') as f:
+                f.write(data)
+        else:
+            file.write(data)
+
+    @staticmethod
+    def load(file):
+        """ Reads a matrix saved by `save` from a path or binary file object. """
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                return Matrix.load(f)
+        header = file.read(_HEADER.size)
+        return Matrix.loads(header + file.read(_unpack_header(header)[4]))
+
     def indices(self):
         """
         Lists all indices (indexes), e.g. (0, 0), (0, 1), (0, 2), (1, 0)...
@@ -155,30 +1188,59 @@ class Matrix(object):
             for col in range(self.width):
                 yield (row, col)
 
-    def map(self, fn):
+    def _check_shape(self, other):
+        """ Raises ValueError if `other` doesn't have the same shape. """
+        if (other.height, other.width) != (self.height, self.width):
+            raise ValueError('Expected a {}x{} matrix, got {}x{}.'.format(
+                self.height, self.width, other.height, other.width))
+
+    def _band_values(self, first, last):
+        """ Returns the items of rows `first` to `last` as a flat list. """
+        return [value for row in range(first, last) for value in self.row(row)]
+
+    def map(self, fn, *others, workers=None):
         """
         Applies `fn` to each item and stores the returned values in a new
-        matrix.
-    
+        matrix. Like the builtin `map`, more matrices of the same shape may be
+        given, and `fn` receives one item from each.
+
+        With `workers`, a number of processes or a `concurrent.futures`
+        Executor, the rows are split in bands processed in parallel. `fn` must
+        then be picklable, e.g. a module level function.
+
         fn("first") -> "new_first"
+        fn("first", "other_first") -> "new_first"
         """
-        result = Matrix(self.height, self.width)
-        for row, col in self.indices():
-            result[row, col] = fn(self[row, col])
-        return result
+        for other in others:
+            self._check_shape(other)
+        if not workers:
+            return Matrix._wrap(list(map(fn, self, *others)), self.height, self.width)
 
-    def indexmap(self, fn):
+        jobs = [[fn] + [matrix._band_values(first, last) for matrix in (self,) + others]
+                for first, last in _bands(self.height, workers)]
+        values = []
+        for band in _parallel(workers, _map_task, jobs):
+            values.extend(band)
+        return Matrix._wrap(values, self.height, self.width)
+
+    def indexmap(self, fn, workers=None):
         """
         Applies `fn` to each index and the corresponding item, and stores
-        the returned values in a new matrix.
+        the returned values in a new matrix. See `map` for `workers`.
 
         fn((0, 0), "first") -> "new_first"
         """
-        result = Matrix(self)
-        for row, col in self.indices():
-            index = (row, col)
-            result[index] = fn(index, self[index])
-        return result
+        if workers:
+            jobs = [(fn, first, self.width, self._band_values(first, last))
+                    for first, last in _bands(self.height, workers)]
+            values = []
+            for band in _parallel(workers, _indexmap_task, jobs):
+                values.extend(band)
+        else:
+            values = []
+            for row in range(self.height):
+                values.extend(fn((row, col), value) for col, value in enumerate(self.row(row)))
+        return Matrix._wrap(values, self.height, self.width)
 
     def neighbors(self, row, col, include_diagonals=True):
         """
@@ -211,11 +1273,126 @@ class Matrix(object):
         . . . . .
         . . . . .
         """
+        data = self._data
+        for i in range(max(0, row - 1), min(row + 2, self.height)):
+            start = self._rowstart(i)
+            for j in range(max(0, col - 1), min(col + 2, self.width)):
+                is_diagonal = (row - i != 0) and (col - j != 0)
+                if (i != row or j != col) and (include_diagonals or not is_diagonal):
+                    yield data[start + j]
+
+    def _cell_neighbors(self, row, col, include_diagonals=True):
+        """ `neighbors` for backends that read items with `_get(row, col)`. """
         for i in range(max(0, row - 1), min(row + 2, self.height)):
             for j in range(max(0, col - 1), min(col + 2, self.width)):
                 is_diagonal = (row - i != 0) and (col - j != 0)
-                if (i, j) != (row, col) and (include_diagonals or not is_diagonal):
-                    yield self[i, j]
+                if (i != row or j != col) and (include_diagonals or not is_diagonal):
+                    yield self._get(i, j)
+
+    def neighbor_counts(self, include_diagonals=True, boundary='clip', workers=None, fn=None):
+        """
+        Returns a new matrix with the sum of the `neighbors` of each item,
+        computed for the whole matrix at once. With boolean items this is the
+        number of True neighbors. See `convolve` for `boundary`, `workers`
+        and `fn`.
+        """
+        if include_diagonals:
+            kernel = [[1, 1, 1], [1, 0, 1], [1, 1, 1]]
+        else:
+            kernel = [[0, 1, 0], [1, 0, 1], [0, 1, 0]]
+        return self.convolve(kernel, boundary, workers=workers, fn=fn)
+
+    def convolve(self, kernel, boundary='clip', fill=0, workers=None, fn=None):
+        """
+        Returns a new matrix where each item is the sum of its neighborhood
+        weighted by `kernel`, a matrix or list of lists with odd sides centered
+        on the item. The whole result is computed row by row, by adding
+        shifted copies of the input rows, instead of cell by cell. The
+        kernel is not flipped, so `kernel[0][0]` weights the top-left neighbor.
+
+        `boundary` decides what is outside the matrix: 'clip' ignores those
+        positions, 'wrap' takes them from the opposite side (as in a torus)
+        and 'constant' uses `fill`.
+
+        With `workers`, a number of processes or a `concurrent.futures`
+        Executor, the rows are split in bands processed in parallel. Numeric
+        items are copied once to shared memory, where each process reads its
+        band plus the neighboring (halo) rows it needs, so the matrix itself is
+        never pickled. Items that don't fit a typed array are convolved
+        serially.
+
+        The sums are floats if the matrix dtype, a weight or `fill` is a
+        float, and otherwise whatever adding the items gives.
+
+        With `fn`, the result has `fn(item, sum)` for each item instead, as
+        in `self.map(fn, self.convolve(kernel))`. With `workers` it's applied
+        by the same processes, so only the result is sent back.
+
+        m.convolve([[1, 1, 1],
+                    [1, 0, 1],
+                    [1, 1, 1]]) -> number of live neighbors of each cell.
+        """
+        kernel = _check_kernel(kernel)
+        floats = _float_sums(self.dtype, kernel, fill)
+        if workers and SharedMemory is not None and self:
+            items = self._shared_items()
+            if items is not None:
+                return self._convolve_parallel(items, kernel, boundary, fill, floats, workers, fn)
+        values = _convolve_rows(self.row, self.height, self.width, 0, self.height, kernel, boundary, fill,
+                                0.0 if floats else 0)
+        if fn is not None:
+            values = list(map(fn, self, values))
+        return Matrix._wrap(values, self.height, self.width)
+
+    def _shared_items(self):
+        """
+        Returns the items as a flat memoryview whose format keeps their type,
+        '?' for booleans or else the dtype, to be copied to shared memory. Or
+        None if they don't fit one.
+        """
+        if self.dtype is None and all(type(value) is bool for value in self):
+            return memoryview(bytes(self)).cast('?')
+        try:
+            return memoryview(array(self.dtype or 'q', self))
+        except (TypeError, OverflowError):
+            # Items a typed array can't hold, such as None, floats in a list
+            # or huge integers.
+            return None
+
+    def _convolve_parallel(self, items, kernel, boundary, fill, floats, workers, fn):
+        """
+        Convolves `items`, from `_shared_items`, in bands through shared
+        memory. See `convolve`.
+        """
+        if boundary not in ('clip', 'wrap', 'constant'):
+            raise ValueError('Unknown boundary {!r}.'.format(boundary))
+        target_typecode = 'd' if floats else 'q'
+        size = len(self) * array(target_typecode).itemsize
+
+        source = SharedMemory(create=True, size=max(1, items.nbytes))
+        # The results of `fn` are sent back instead of written to memory.
+        target = SharedMemory(create=True, size=max(1, size)) if fn is None else None
+        try:
+            view = items.cast('B')
+            source.buf[:len(view)] = view
+            view.release()
+            jobs = [(source.name, items.format, self.height, self.width, first, last,
+                     kernel, boundary, fill, target and target.name, target_typecode, fn)
+                    for first, last in _bands(self.height, workers)]
+            bands = _parallel(workers, _convolve_task, jobs)
+            if target is None:
+                values = list(chain.from_iterable(bands))
+            else:
+                result = target.buf[:size].cast(target_typecode)
+                values = result.tolist()
+                result.release()
+        finally:
+            source.close()
+            source.unlink()
+            if target is not None:
+                target.close()
+                target.unlink()
+        return Matrix._wrap(values, self.height, self.width)
 
     def __len__(self):
         """
@@ -226,127 +1403,2200 @@ class Matrix(object):
 
     def __iter__(self):
         """ Iterate through every item, in accordance to len(matrix). """
-        for row, col in self.indices():
-            yield self.m[row][col]
+        return iter(self._data)
 
-    def __in__(self, item):
+    def __contains__(self, item):
         """ Searches for an item. """
-        for v in self:
-            if v == item:
-                return True
+        positions = self._indexed_positions(item)
+        if positions is not None:
+            return bool(positions)
+        return any(item in self.row(row) for row in range(self.height))
+
+    def _expand_slice(self, index):
+        """
+        Returns (start, stop) from the given slice, filling with expected
+        values when not present and supporting negative indices.
+        """
+        start = list(index.start or (0, 0))
+        stop = list(index.stop or (self.height, self.width))
+
+        if start[0] < 0: start[0] += self.height
+        if start[1] < 0: start[1] += self.width
+        if stop[0] < 0: stop[0] += self.height
+        if stop[1] < 0: stop[1] += self.width
+
+        return (start[0], start[1]), (stop[0], stop[1])
+
+    def _write_slice(self, index):
+        """
+        Like `_expand_slice`, but raises IndexError if the rectangle doesn't
+        fit in the matrix, instead of letting rows run into the next ones.
+        """
+        (row0, col0), (row1, col1) = self._expand_slice(index)
+        if not (0 <= row0 and 0 <= col0 and row1 <= self.height and col1 <= self.width):
+            raise IndexError('Slice {}:{} out of range.'.format((row0, col0), (row1, col1)))
+        return (row0, col0), (row1, col1)
+
+    def row_col_to_index(self, row, col):
+        return row * self.width + col
+
+    def index_to_row_col(self, index):
+        return index // self.width, index % self.width
+
+    def getdefault(self, row, col, default):
+        if row < 0 or col < 0 or row >= self.height or col >= self.width:
+            return default
+        return self[row, col]
+
+    def __getitem__(self, index):
+        """
+        Reads values from the matrix. Index can be a int (returning the i'th
+        item), a (row, col) tuple or a slice object of the those. Thus it may
+        return a single value or a new matrix. A boolean matrix of the same
+        shape as index returns the list of items where it is true.
+        """
+        if isinstance(index, tuple):
+            if len(index) == 2:
+                row, col = index
+                return self._data[self._offset(row, col)]
+            elif len(index) == 3:
+                raise TypeError("You probably typed m[0,0:2,2] instead of m[(0,0):(2,2)].")
+        elif isinstance(index, int):
+            return self._data[index]
+        elif isinstance(index, slice):
+            t = index.start or index.stop
+            if isinstance(t, int):
+                return _tolist(self._data[index])
+            else:
+                (row0, col0), (row1, col1) = self._write_slice(index)
+                height = max(0, row1 - row0)
+                width = max(0, col1 - col0)
+                if not height or not width:
+                    return Matrix(dtype=self.dtype)
+
+                values = Matrix._storage([], self.dtype)
+                for row in range(row0, row1):
+                    start = self._offset(row, col0)
+                    values.extend(self._data[start:start + width])
+                return Matrix._wrap(values, height, width, self.dtype)
+        elif isinstance(index, Matrix):
+            # Boolean mask, e.g. m[m > 0].
+            self._check_shape(index)
+            return list(compress(self, index))
+        else:
+            raise TypeError("Invalid index type " + str(index))
+
+    def __setitem__(self, index, values):
+        """
+        Writes values to the the matrix. Index can be a int (returning the i'th
+        item), a (row, col) tuple or a slice object of the those. `values` must
+        be a single value or a matrix depending on the type of index used.
+        A boolean matrix of the same shape as index selects the items where
+        it is true, see `_set_masked`: m[m < 0] = 0
+        """
+        if isinstance(index, tuple):
+            if len(index) == 2:
+                row, col = index
+                self._data[self._offset(row, col)] = values
+            elif len(index) == 3:
+                raise TypeError("You probably typed m[0,0:2,2] instead of m[(0,0):(2,2)].")
+        elif isinstance(index, int):
+            self._data[index] = values
+        elif isinstance(index, slice):
+            t = index.start or index.stop
+            if isinstance(t, int):
+                length = len(range(*index.indices(len(self))))
+                self._data[index] = self._values(values, length)
+            else:
+                (row0, col0), (row1, col1) = self._write_slice(index)
+                width = col1 - col0
+                rows = range(row1 - row0)
+                if (rows and isinstance(values, Matrix) and values._data is self._data and
+                        values._origin < self._offset(row0, col0)):
+                    # Overlapping view of our own storage: copy bottom-up so
+                    # source rows are read before being overwritten.
+                    rows = reversed(rows)
+                for row in rows:
+                    line = values.row(row) if isinstance(values, Matrix) else values[row]
+                    start = self._offset(row0 + row, col0)
+                    self._data[start:start + width] = self._values(line[:width], width)
+        elif isinstance(index, Matrix):
+            self._set_masked(index, values)
+        else:
+            raise TypeError("Invalid index type " + str(index))
+
+    def _set_flat(self, index, values):
+        """
+        Writes to a flat int index, or a slice of them, for backends that
+        write items one by one with `_set(row, col, value)`.
+        """
+        if isinstance(index, int):
+            row, col = self._unflatten(index)
+            self._set(row, col, values)
+            return
+        positions = range(*index.indices(len(self)))
+        if len(values) != len(positions):
+            raise ValueError('Expected {} values, got {}.'.format(len(positions), len(values)))
+        for position, value in zip(positions, values):
+            row, col = self._unflatten(position)
+            self._set(row, col, value)
+
+    def _set_masked(self, mask, values):
+        """
+        Writes `values` to the items where `mask` is true, as whole rows. A
+        list gives one value per item selected, in row-major order, anything
+        else is written to all of them.
+        """
+        self._check_shape(mask)
+        if isinstance(values, list):
+            selected = sum(map(bool, mask))
+            if len(values) != selected:
+                raise ValueError('Expected {} values, got {}.'.format(selected, len(values)))
+            values = iter(values)
+        else:
+            values = repeat(values)
+        # Called from `__setitem__`, so observers are notified by the caller.
+        setitem = getattr(type(self), '_unobserved', type(self)).__setitem__
+        for row, keep in enumerate(mask.iter_rows()):
+            if any(keep):
+                line = self.row(row)
+                for col in compress(range(self.width), keep):
+                    line[col] = next(values)
+                setitem(self, slice((row, 0), (row + 1, self.width)), [line])
+
+    def __repr__(self):
+        """
+        Returns a multi-line string representation of the matrix. Columns are
+        aligned based on the largest item.
+
+         1  2  3  4
+         5  6  7  8
+         9 10 11 12
+        13 14 15 16
+        """
+        return '\n'.join(self._render_lines()) + '\n'
+
+    def write_to(self, file, overlay=None):
+        """
+        Writes the same text as `repr` to a text file object, one line at a
+        time instead of building one string. Without `render_cached` every
+        item is converted to string twice, to find the column width first.
+        See `_render_lines` for `overlay`.
+        """
+        for line in self._render_lines(overlay, streaming=True):
+            file.write(line)
+            file.write('\n')
+
+    def _render_lines(self, overlay=None, streaming=False):
+        """
+        Yields the lines of `repr`, showing the strings in the `overlay`
+        dict, if given, instead of the items at its (row, col) keys. With
+        `streaming`, the strings of items are not all kept at once.
+        """
+        overlay_rows = {}
+        for (row, col), text in (overlay or {}).items():
+            row, col = self._position(row, col)
+            overlay_rows.setdefault(row, {})[col] = str(text)
+        cache = self._render_cache
+        if cache is not None:
+            cells = cache.cells
+            width = cache.width()
+        elif streaming:
+            cells = lambda row: [str(value) for value in self.row(row)]
+            width = max((len(str(value)) for value in self), default=0)
+        else:
+            all_cells = [[str(value) for value in self.row(row)] for row in range(self.height)]
+            cells = all_cells.__getitem__
+            width = max((len(cell) for line in all_cells for cell in line), default=0)
+        width = max([width] + [len(text) for texts in overlay_rows.values() for text in texts.values()])
+
+        for row in range(self.height):
+            if row in overlay_rows:
+                line = list(cells(row))
+                for col, text in overlay_rows[row].items():
+                    line[col] = text
+                yield ' '.join(cell.rjust(width) for cell in line)
+            elif cache is not None:
+                yield cache.line(row, width)
+            else:
+                yield ' '.join(cell.rjust(width) for cell in cells(row))
+
+    def __eq__(self, other):
+        """ Equality testing allows comparing to list of lists. """
+        if isinstance(other, Matrix):
+            return (self.height, self.width) == (other.height, other.width) and list(self) == list(other)
+        else:
+            return self.rows == other or list(self) == other
+
+    def _elementwise(self, other, operation, reflected=False):
+        """
+        Returns a new matrix with `operation(item, other_item)` for each item,
+        where `other` is a matrix (or list of lists) of the same shape, or a
+        single value used for every item. With `reflected` the operands are
+        swapped, for `__radd__` and friends.
+        """
+        if isinstance(other, list):
+            other = Matrix(other)
+        if not isinstance(other, Matrix):
+            return self._scalar(operation, other, reflected)
+        self._check_shape(other)
+        return other.map(operation, self) if reflected else self.map(operation, other)
+
+    def _scalar(self, operation, value, reflected):
+        """ `_elementwise` with a single value. """
+        values = repeat(value, len(self))
+        values = map(operation, values, self) if reflected else map(operation, self, values)
+        return Matrix._wrap(list(values), self.height, self.width)
+
+    def _inplace(self, other, operation):
+        """
+        Replaces every item with `operation(item, other_item)`, through
+        `__setitem__` so observers see the writes. Typed storage keeps its
+        typecode, so results must fit it.
+        """
+        self[:] = self._elementwise(other, operation)
+        return self
+
+    def __add__(self, other):
+        return self._elementwise(other, operator.add)
+
+    def __radd__(self, other):
+        return self._elementwise(other, operator.add, reflected=True)
+
+    def __iadd__(self, other):
+        return self._inplace(other, operator.add)
+
+    def __sub__(self, other):
+        return self._elementwise(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._elementwise(other, operator.sub, reflected=True)
+
+    def __isub__(self, other):
+        return self._inplace(other, operator.sub)
+
+    def __mul__(self, other):
+        return self._elementwise(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self._elementwise(other, operator.mul, reflected=True)
+
+    def __imul__(self, other):
+        return self._inplace(other, operator.mul)
+
+    def __truediv__(self, other):
+        return self._elementwise(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self._elementwise(other, operator.truediv, reflected=True)
+
+    def __itruediv__(self, other):
+        return self._inplace(other, operator.truediv)
+
+    def __floordiv__(self, other):
+        return self._elementwise(other, operator.floordiv)
+
+    def __rfloordiv__(self, other):
+        return self._elementwise(other, operator.floordiv, reflected=True)
+
+    def __ifloordiv__(self, other):
+        return self._inplace(other, operator.floordiv)
+
+    def __mod__(self, other):
+        return self._elementwise(other, operator.mod)
+
+    def __rmod__(self, other):
+        return self._elementwise(other, operator.mod, reflected=True)
+
+    def __imod__(self, other):
+        return self._inplace(other, operator.mod)
+
+    def __pow__(self, other):
+        return self._elementwise(other, operator.pow)
+
+    def __rpow__(self, other):
+        return self._elementwise(other, operator.pow, reflected=True)
+
+    def __ipow__(self, other):
+        return self._inplace(other, operator.pow)
+
+    def __and__(self, other):
+        return self._elementwise(other, operator.and_)
+
+    def __rand__(self, other):
+        return self._elementwise(other, operator.and_, reflected=True)
+
+    def __iand__(self, other):
+        return self._inplace(other, operator.and_)
+
+    def __or__(self, other):
+        return self._elementwise(other, operator.or_)
+
+    def __ror__(self, other):
+        return self._elementwise(other, operator.or_, reflected=True)
+
+    def __ior__(self, other):
+        return self._inplace(other, operator.or_)
+
+    def __xor__(self, other):
+        return self._elementwise(other, operator.xor)
+
+    def __rxor__(self, other):
+        return self._elementwise(other, operator.xor, reflected=True)
+
+    def __ixor__(self, other):
+        return self._inplace(other, operator.xor)
+
+    def __neg__(self):
+        return self.map(operator.neg)
+
+    def __abs__(self):
+        return self.map(abs)
+
+    # Comparisons return boolean masks, for indexing. `==` and `!=` compare
+    # whole matrices instead, use `eq` and `ne` for their masks.
+    def __lt__(self, other):
+        return self._elementwise(other, operator.lt)
+
+    def __le__(self, other):
+        return self._elementwise(other, operator.le)
+
+    def __gt__(self, other):
+        return self._elementwise(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._elementwise(other, operator.ge)
+
+    def eq(self, other):
+        """ Returns the mask of items equal to `other` (or its items). """
+        return self._elementwise(other, operator.eq)
+
+    def ne(self, other):
+        """ Returns the mask of items different from `other` (or its items). """
+        return self._elementwise(other, operator.ne)
+
+    def _reduce(self, axis, reduce):
+        """
+        Applies `reduce` (e.g. `sum`) to all items (`axis` None), to each
+        column (0) or to each row (1).
+        """
+        if axis is None:
+            return reduce(self)
+        elif axis == 0:
+            return [reduce(col) for col in self.iter_cols()]
+        elif axis == 1:
+            return [reduce(row) for row in self.iter_rows()]
+        raise ValueError('Axis must be None, 0 or 1, got {!r}.'.format(axis))
+
+    def sum(self, axis=None):
+        """
+        Returns the sum of all items, or with `axis` the list of sums of each
+        column (0) or row (1), like NumPy.
+        """
+        return self._reduce(axis, sum)
+
+    def min(self, axis=None):
+        """ Returns the smallest item, or of each column or row, see `sum`. """
+        return self._reduce(axis, min)
+
+    def max(self, axis=None):
+        """ Returns the largest item, or of each column or row, see `sum`. """
+        return self._reduce(axis, max)
+
+    def _arg(self, axis, best):
+        """ Position of the first `best` (min or max) item, see `argmax`. """
+        def position(values):
+            values = values if isinstance(values, list) else list(values)
+            return best(range(len(values)), key=values.__getitem__)
+        if axis is None:
+            return divmod(position(self), self.width)
+        elif axis == 0:
+            return [position(col) for col in self.iter_cols()]
+        elif axis == 1:
+            return [position(row) for row in self.iter_rows()]
+        raise ValueError('Axis must be None, 0 or 1, got {!r}.'.format(axis))
+
+    def argmax(self, axis=None):
+        """
+        Returns the (row, col) of the first largest item, or with `axis` the
+        row of the largest item of each column (0) or the column of the
+        largest item of each row (1).
+        """
+        return self._arg(axis, max)
+
+    def argmin(self, axis=None):
+        """ Like `argmax`, for the smallest items. """
+        return self._arg(axis, min)
+
+class _Observed(object):
+    """
+    Mixin placed in front of the class of matrices with observers, notifying
+    them of writes and structural edits. See `Matrix._observe`.
+    """
+    def __setitem__(self, index, values):
+        positions = self._write_positions(index)
+        old = [self[position] for position in positions]
+        super(_Observed, self).__setitem__(index, values)
+        for (row, col), before in zip(positions, old):
+            after = self[row, col]
+            if after is not before and (type(after) is not type(before) or after != before):
+                for observer in self._observers:
+                    observer.cell_changed(self, row, col, before, after)
+
+    def _notify_shape(self, operation, i):
+        for observer in self._observers:
+            observer.shape_changed(self, operation, i)
+
+    def addrow(self, i, values=None):
+        super(_Observed, self).addrow(i, values)
+        self._notify_shape('addrow', self._insertion_point(i, self.height - 1))
+
+    def addcol(self, i, values=None):
+        super(_Observed, self).addcol(i, values)
+        self._notify_shape('addcol', self._insertion_point(i, self.width - 1))
+
+    def removerow(self, i):
+        i = i + self.height if i < 0 else i
+        super(_Observed, self).removerow(i)
+        self._notify_shape('removerow', i)
+
+    def removecol(self, i):
+        i = i + self.width if i < 0 else i
+        super(_Observed, self).removecol(i)
+        self._notify_shape('removecol', i)
+
+    def view(self, start=None, stop=None):
+        raise TypeError('Writes through views would not be seen by the observers of this matrix.')
+
+    def __reduce__(self):
+        # Observed classes are created on demand, so pickle can't find them
+        # by name. Pickle the plain matrix instead, rebuilding the observers
+        # on load. Recorded changes are kept.
+        state = {name: value for name, value in self.__dict__.items() if name not in _OBSERVER_ATTRIBUTES}
+        return (_unpickle_observed, (self._unobserved, state, self.indexed, self.render_cached,
+                                     self._change_tracker, self.rect_index))
+
+# Instance attributes holding observers, rebuilt after unpickling.
+_OBSERVER_ATTRIBUTES = ('_observers', '_value_index', '_render_cache', '_change_tracker', '_rect_index')
+
+def _unpickle_observed(cls, state, indexed, render_cached, change_tracker, rect_index):
+    """ Rebuilds a matrix pickled by `_Observed.__reduce__`. """
+    matrix = cls.__new__(cls)
+    matrix.__dict__.update(state)
+    matrix.indexed = indexed
+    matrix.render_cached = render_cached
+    matrix.rect_index = rect_index
+    if change_tracker is not None:
+        matrix._change_tracker = change_tracker
+        matrix._observe(change_tracker)
+    return matrix
+
+# Observed subclass of each matrix class, created on demand.
+_observed_classes = {}
+
+def _observed_class(cls):
+    if cls not in _observed_classes:
+        observed = type(cls.__name__, (_Observed, cls), {'_unobserved': cls})
+        _observed_classes[cls] = observed
+    return _observed_classes[cls]
+
+class _ValueIndex(object):
+    """
+    Matrix observer mapping each hashable item to the sorted list of its flat
+    positions (row * width + col), so the first is always at hand. Unhashable
+    items are only counted, and while there are any the index isn't used.
+    """
+    def __init__(self, matrix):
+        self.rebuild(matrix)
+
+    def rebuild(self, matrix):
+        self.positions = {}
+        self.unhashable = 0
+        for position, value in enumerate(matrix):
+            self._add(value, position)
+
+    def _add(self, value, position):
+        try:
+            positions = self.positions.setdefault(value, [])
+        except TypeError:
+            self.unhashable += 1
+            return
+        if not positions or positions[-1] < position:
+            positions.append(position)
+        else:
+            insort(positions, position)
+
+    def _remove(self, value, position):
+        try:
+            positions = self.positions[value]
+        except TypeError:
+            self.unhashable -= 1
+            return
+        i = bisect_left(positions, position)
+        if i < len(positions) and positions[i] == position:
+            del positions[i]
+        if not positions:
+            del self.positions[value]
+
+    def cell_changed(self, matrix, row, col, old, new):
+        position = row * matrix.width + col
+        self._remove(old, position)
+        self._add(new, position)
+
+    def shape_changed(self, matrix, operation, i):
+        if operation == 'addrow' and i == matrix.height - 1:
+            # Appending a row doesn't move the existing items.
+            start = i * matrix.width
+            for col, value in enumerate(matrix.row(i)):
+                self._add(value, start + col)
+        else:
+            self.rebuild(matrix)
+
+class _RenderCache(object):
+    """
+    Matrix observer keeping the strings of items, the widest string of each
+    row and each rendered line, along with the column width it was rendered
+    for. Rows are converted lazily, and writes only reset their row.
+    """
+    def __init__(self, matrix):
+        self.shape_changed(matrix)
+
+    def shape_changed(self, matrix, operation=None, i=None):
+        self.matrix = matrix
+        self._cells = [None] * matrix.height
+        self._widths = [0] * matrix.height
+        self._lines = [None] * matrix.height
+
+    def cells(self, row):
+        cells = self._cells[row]
+        if cells is None:
+            cells = self._cells[row] = [str(value) for value in self.matrix.row(row)]
+            self._widths[row] = max(map(len, cells), default=0)
+        return cells
+
+    def width(self):
+        for row, cells in enumerate(self._cells):
+            if cells is None:
+                self.cells(row)
+        return max(self._widths, default=0)
+
+    def line(self, row, width):
+        line = self._lines[row]
+        if line is None or line[0] != width:
+            line = self._lines[row] = (width, ' '.join(cell.rjust(width) for cell in self.cells(row)))
+        return line[1]
+
+    def cell_changed(self, matrix, row, col, old, new):
+        cells = self._cells[row]
+        if cells is not None:
+            cells[col] = str(new)
+            self._widths[row] = max(map(len, cells))
+        self._lines[row] = None
+
+def _summed_area(matrix, key):
+    """
+    Returns the summed-area table of the items of `matrix` (`key` None) or of
+    whether they equal key[0], as a (height + 1) by (width + 1) Matrix.
+    """
+    width = matrix.width + 1
+    values = [0] * width
+    for row in matrix.iter_rows():
+        if key is not None:
+            row = [item == key[0] for item in row]
+        values.append(0)
+        values.extend(map(add, accumulate(row), values[-width:-1]))
+    return Matrix._wrap(values, matrix.height + 1, width)
+
+class _Fenwick(object):
+    """
+    2D Fenwick (binary indexed) tree of the items of a matrix, or of whether
+    they equal key[0], for prefix sums with O(log(height) * log(width))
+    updates and queries.
+    """
+    def __init__(self, matrix, key):
+        self.key = key
+        self.height, self.width = matrix.height, matrix.width
+        tree = [[0] * (self.width + 1)]
+        for row in matrix.iter_rows():
+            tree.append([0] + ([item == key[0] for item in row] if key is not None else row))
+        # Linear time construction: each node adds itself to its parent,
+        # first along rows, then along columns.
+        for row in tree:
+            for col in range(1, self.width + 1):
+                parent = col + (col & -col)
+                if parent <= self.width:
+                    row[parent] += row[col]
+        for i in range(1, self.height + 1):
+            parent = i + (i & -i)
+            if parent <= self.height:
+                tree[parent][:] = map(add, tree[parent], tree[i])
+        self.tree = tree
+
+    def update(self, row, col, old, new):
+        if self.key is None:
+            delta = new - old
+        else:
+            delta = (new == self.key[0]) - (old == self.key[0])
+        if not delta:
+            return
+        tree, i = self.tree, row + 1
+        while i <= self.height:
+            tree_row, j = tree[i], col + 1
+            while j <= self.width:
+                tree_row[j] += delta
+                j += j & -j
+            i += i & -i
+
+    def prefix(self, row, col):
+        """ Total of the items above and left of (row, col). """
+        total, tree = 0, self.tree
+        while row > 0:
+            tree_row, j = tree[row], col
+            while j > 0:
+                total += tree_row[j]
+                j -= j & -j
+            row -= row & -row
+        return total
+
+class _RectIndex(object):
+    """
+    Matrix observer keeping summed-area tables (mode 'table'), rebuilt after
+    writes, or Fenwick trees (mode 'fenwick'), updated on each write, by key:
+    None for sums of items, (value,) for counts of `value`.
+    """
+    def __init__(self, mode):
+        self.mode = mode
+        self.tables = {}
+        self.trees = {}
+
+    def table(self, matrix, key):
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = _summed_area(matrix, key)
+        return table
+
+    def total(self, matrix, key, row0, col0, row1, col1):
+        if self.mode == 'fenwick':
+            tree = self.trees.get(key)
+            if tree is None:
+                tree = self.trees[key] = _Fenwick(matrix, key)
+            prefix = tree.prefix
+        else:
+            table = self.table(matrix, key)
+            data, width = table._data, table.width
+            prefix = lambda row, col: data[row * width + col]
+        return prefix(row1, col1) - prefix(row0, col1) - prefix(row1, col0) + prefix(row0, col0)
+
+    def cell_changed(self, matrix, row, col, old, new):
+        self.tables.clear()
+        for key, tree in list(self.trees.items()):
+            try:
+                tree.update(row, col, old, new)
+            except TypeError:
+                # Not a number any more, sums fail when rebuilt instead.
+                del self.trees[key]
+
+    def shape_changed(self, matrix, operation, i):
+        self.tables.clear()
+        self.trees.clear()
+
+def _runs(numbers):
+    """ Returns (first, last) of each run of consecutive sorted numbers. """
+    result = []
+    for number in numbers:
+        if result and result[-1][1] == number - 1:
+            result[-1] = (result[-1][0], number)
+        else:
+            result.append((number, number))
+    return result
+
+class _ChangeTracker(object):
+    """
+    Matrix observer recording changed positions, plus whole rows and columns
+    whose items were moved by structural edits.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.cells = set()
+        self.rows = set()
+        self.cols = set()
+
+    def cell_changed(self, matrix, row, col, old, new):
+        self.cells.add((row, col))
+
+    def shape_changed(self, matrix, operation, i):
+        # Everything from `i` on moved, so changed lines from there on are
+        # subsumed by whole moved lines.
+        if operation in ('addrow', 'removerow'):
+            self.rows = {row for row in self.rows if row < i}
+            self.rows.update(range(i, matrix.height))
+            self.cells = {(row, col) for row, col in self.cells if row < i}
+        else:
+            self.cols = {col for col in self.cols if col < i}
+            self.cols.update(range(i, matrix.width))
+            self.cells = {(row, col) for row, col in self.cells if col < i}
+
+class MatrixView(Matrix):
+    """
+    Rectangular window into another matrix, sharing its storage through an
+    origin offset and row stride. Reads and writes go straight to the parent,
+    and views of views are views of the original storage. Use `copy` to get
+    an independent Matrix.
+
+    The shape of a view is fixed, and the view is no longer valid after its
+    parent's shape changes. Indices and slices are checked against the view's
+    own shape, so they never reach parent items outside the window.
+
+    Usage:
+    m = Matrix(4, 4, range(16))
+    v = m.view((1, 1), (3, 3))
+    v[0, 0] = -1 # Same as m[1, 1] = -1
+    """
+    _stride = 0
+
+    def __init__(self, parent, start=None, stop=None):
+        (row0, col0), (row1, col1) = parent._expand_slice(slice(start, stop))
+        if not (0 <= row0 <= row1 <= parent.height and 0 <= col0 <= col1 <= parent.width):
+            raise IndexError('View {}:{} out of range.'.format((row0, col0), (row1, col1)))
+
+        self._data = parent._data
+        self.dtype = parent.dtype
+        self.height = row1 - row0
+        self.width = col1 - col0
+        self._stride = parent._stride
+        self._origin = parent._rowstart(row0) + col0 if row0 < parent.height else 0
+
+    def _rowstart(self, n):
+        if n < 0:
+            n += self.height
+        if not 0 <= n < self.height:
+            raise IndexError('Row {} out of range.'.format(n))
+        return self._origin + n * self._stride
+
+    def _flat_offset(self, index):
+        """ Converts an absolute item index into the storage offset. """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Index {} out of range.'.format(index))
+        row, col = divmod(index, self.width)
+        return self._rowstart(row) + col
+
+    def copy(self):
+        """ Returns a new Matrix with the items of this view. """
+        return self[:]
+
+    def __iter__(self):
+        data, width = self._data, self.width
+        for row in range(self.height):
+            start = self._rowstart(row)
+            for value in data[start:start + width]:
+                yield value
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self._data[self._flat_offset(index)]
+        elif isinstance(index, slice) and isinstance(index.start or index.stop, int):
+            return list(self)[index]
+        return super(MatrixView, self).__getitem__(index)
+
+    def __setitem__(self, index, values):
+        if isinstance(index, int):
+            self._data[self._flat_offset(index)] = values
+        elif isinstance(index, slice) and isinstance(index.start or index.stop, int):
+            positions = range(*index.indices(len(self)))
+            if len(values) != len(positions):
+                raise ValueError('Expected {} values, got {}.'.format(len(positions), len(values)))
+            for position, value in zip(positions, values):
+                self._data[self._flat_offset(position)] = value
+        else:
+            super(MatrixView, self).__setitem__(index, values)
+
+    def _reshape_error(self, *args, **kwargs):
+        raise TypeError('The shape of a view cannot be changed.')
+
+    addrow = addcol = removerow = removecol = _reshape_error
+
+class LazyMatrix(object):
+    """
+    Chain of `map` and `indexmap` calls over a source matrix, evaluated row by
+    row only when the results are consumed. Each row goes through every step
+    before the next row is read, so no intermediate matrix is built, and
+    `index` stops at the first match.
+
+    Usage:
+    chain = m.lazy().map(abs).indexmap(lambda index, value: index[0] * value)
+    chain.index(12) # Only evaluates rows up to the first match.
+    for row in chain.iter_rows(): print(row)
+    chain.collect() # New Matrix with the results.
+
+    The source is read when the results are consumed, not when the calls are
+    made, so changes made to it in between are seen.
+    """
+    def __init__(self, source, steps=()):
+        self.source = source
+        self.height = source.height
+        self.width = source.width
+        # Tuples of ('map', fn, other_matrices) or ('indexmap', fn, ()).
+        self.steps = tuple(steps)
+
+    def map(self, fn, *others):
+        """ Records `Matrix.map(fn, *others)`, returning a new LazyMatrix. """
+        for other in others:
+            self.source._check_shape(other)
+        return LazyMatrix(self.source, self.steps + (('map', fn, others),))
+
+    def indexmap(self, fn):
+        """ Records `Matrix.indexmap(fn)`, returning a new LazyMatrix. """
+        return LazyMatrix(self.source, self.steps + (('indexmap', fn, ()),))
+
+    def row(self, n):
+        """ Returns the list of results for the n'th row. """
+        n = n + self.height if n < 0 else n
+        values = self.source.row(n)
+        for kind, fn, others in self.steps:
+            if kind == 'map':
+                values = list(map(fn, values, *(other.row(n) for other in others)))
+            else:
+                values = [fn((n, col), value) for col, value in enumerate(values)]
+        return values
+
+    def iter_rows(self, chunk=None):
+        """
+        Yields the list of results for each row, one row at a time, or lists
+        of up to `chunk` rows. See `Matrix.iter_rows`.
+        """
+        if chunk is None:
+            for n in range(self.height):
+                yield self.row(n)
+            return
+        if chunk < 1:
+            raise ValueError('Chunk size must be positive, got {}.'.format(chunk))
+        for first in range(0, self.height, chunk):
+            yield [self.row(n) for n in range(first, min(first + chunk, self.height))]
+
+    def __iter__(self):
+        for row in self.iter_rows():
+            for value in row:
+                yield value
+
+    def __len__(self):
+        return self.height * self.width
+
+    def index(self, value):
+        """
+        Returns the (row, col) of the first result equal to `value`,
+        evaluating no rows past it.
+        """
+        for n, row in enumerate(self.iter_rows()):
+            try:
+                return (n, row.index(value))
+            except ValueError:
+                pass
+        raise KeyError('Value {} not found in matrix.'.format(value))
+
+    def collect(self, dtype=None, out=None):
+        """
+        Evaluates all steps and returns the results as a new Matrix, with typed
+        storage if `dtype` is given. If an `out` matrix of the same shape is
+        given, the results are written to it row by row and `out` is
+        returned, so nothing the size of the whole matrix is kept in memory.
+        """
+        if out is not None:
+            self.source._check_shape(out)
+            for n, row in enumerate(self.iter_rows()):
+                out[(n, 0):(n + 1, self.width)] = [row]
+            return out
+        values = Matrix._storage([], dtype)
+        for row in self.iter_rows():
+            values.extend(row)
+        return Matrix._wrap(values, self.height, self.width, dtype)
+
+    def __repr__(self):
+        return '<LazyMatrix {}x{} with {} steps>'.format(self.height, self.width, len(self.steps))
+
+class MmapMatrix(Matrix):
+    """
+    Matrix of fixed-width numbers stored in a file and memory-mapped, so only
+    the pages being used are loaded and boards larger than memory can be
+    processed row by row. The file has the format of `Matrix.save`: a header
+    recording the shape and typecode, followed by the items in row-major
+    order. Uncompressed typed matrices saved that way can be opened too.
+
+    Writes go to the mapping, and are saved to the file by `flush` or
+    `close`. The shape is fixed. Results of `map`, slicing and other methods
+    returning new matrices are regular in-memory matrices. For boards that
+    don't fit in memory, stream with `m.lazy().map(fn).collect(out=other)`.
+
+    Usage:
+    with Matrix.open_mmap('board.bin', 1000, 1000, 'b') as m:
+        m[0, 0] = 1
+        m.flush()
+    """
+    # Typecodes that memoryview can cast to.
+    DTYPES = 'bBhHiIlLqQfd'
+
+    def __init__(self, path, height=None, width=None, dtype=None):
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                header = _unpack_header(f.read(_HEADER.size))
+            shape = header[:3]
+            if header[3] & _COMPRESSED or header[2] not in self.DTYPES:
+                raise ValueError('{} is compressed or of unsupported type.'.format(path))
+            if (height, width, dtype) != (height and shape[0], width and shape[1], dtype and shape[2]):
+                raise ValueError('{} holds a {}x{} matrix of {!r}.'.format(path, *shape))
+            height, width, dtype = shape
+            size = height * width * array(dtype).itemsize
+            if header[4] != size or os.path.getsize(path) < _HEADER.size + size:
+                raise ValueError('{} is truncated or its header is corrupted.'.format(path))
+        else:
+            if height is None or width is None:
+                raise ValueError('Height and width are needed to create {}.'.format(path))
+            dtype = dtype or 'q'
+            if dtype not in self.DTYPES:
+                raise ValueError('Unsupported dtype {!r}, expected one of {!r}.'.format(dtype, self.DTYPES))
+            with open(path, 'wb') as f:
+                f.write(_pack_header(height, width, dtype))
+                f.truncate(_HEADER.size + height * width * array(dtype).itemsize)
+
+        self.path = path
+        self.dtype = dtype
+        self.height = height
+        self.width = width
+        self._file = open(path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        size = height * width * array(dtype).itemsize
+        self._items = memoryview(self._mmap)[_HEADER.size:_HEADER.size + size].cast(dtype)
+
+    def _check_open(self):
+        if self._items is None:
+            raise ValueError('Memory-mapped matrix {} is closed.'.format(self.path))
+
+    @property
+    def _data(self):
+        self._check_open()
+        return self._items
+
+    def flush(self):
+        """ Writes changes back to the file. """
+        self._check_open()
+        self._mmap.flush()
+
+    def close(self):
+        """
+        Flushes and closes the file. Views of this matrix become unusable,
+        and using the matrix afterwards raises ValueError.
+        """
+        if self._items is not None:
+            self._items.release()
+            self._items = None
+            self._mmap.close()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def copy(self):
+        """ Returns a new in-memory Matrix with the same items. """
+        values = array(self.dtype)
+        values.frombytes(self._data.cast('B'))
+        return Matrix._wrap(values, self.height, self.width, self.dtype)
+
+    def _reshape_error(self, *args, **kwargs):
+        raise TypeError('The shape of a memory-mapped matrix cannot be changed.')
+
+    addrow = addcol = removerow = removecol = _reshape_error
+
+class NumpyMatrix(Matrix):
+    """
+    Matrix stored in a 2D NumPy array, created with `backend='numpy'` or
+    `Matrix.from_numpy`. Items are read back as regular Python numbers, and
+    whole-matrix operations (`map`, `indexmap`, `rows`, `cols`, `diagonal`,
+    `index`, `==`) run as array operations.
+
+    Writing an item the array can't hold, such as a float into integers,
+    upcasts the array, and writing one that isn't a number turns the matrix
+    into a plain Matrix, so writes keep every value like a list would.
+
+    `map` and `indexmap` first call `fn` once with whole arrays, the same way
+    NumPy ufuncs work, so `fn` should be free of side effects. If that fails
+    or doesn't return an array of the right shape, `fn` is called once per
+    item instead. So results match the other backends, float errors such as
+    division by zero are raised, and results from integer or boolean arrays
+    are only kept if the same call on floats agrees, ruling out overflow and
+    boolean arithmetic. Otherwise `fn` is called again with arrays of Python
+    objects.
+
+    Usage:
+    m = Matrix(1000, 1000, backend='numpy')
+    m.map(lambda v: v * 2 + 1)
+    """
+    _view = False
+
+    def __init__(self, height=0, width=0, data=None, default=None, dtype=None, backend='numpy', indexed=False):
+        Matrix.__init__(self, height, width, data, default, None, backend)
+        values = numpy.array(self._data, dtype=dtype).reshape(self.height, self.width)
+        if values.dtype.kind not in _NUMERIC_KINDS:
+            # Arbitrary objects gain nothing from NumPy: stay a plain Matrix.
+            self.__class__ = Matrix
+        else:
+            self._data = values
+            self.dtype = values.dtype
+        self.indexed = indexed
+
+    @classmethod
+    def _from_array(cls, values, view=False):
+        """ Builds a matrix around an existing 2D array, without copying it. """
+        result = cls.__new__(cls)
+        result._data = values
+        result.dtype = values.dtype
+        result.height, result.width = values.shape
+        result._view = view
+        return result
+
+    @classmethod
+    def _adopt(cls, values, height, width):
+        """
+        Wraps a list or array of results in a NumpyMatrix if they are all
+        numbers, or in a plain Matrix otherwise.
+        """
+        if isinstance(values, numpy.ndarray) and values.dtype.kind == 'O':
+            values = values.ravel().tolist()
+        if isinstance(values, list):
+            if all(isinstance(v, (int, float, complex, numpy.number, numpy.bool_)) for v in values):
+                values = numpy.array(values)
+            else:
+                return Matrix._wrap(values, height, width)
+        if values.dtype.kind not in _NUMERIC_KINDS:
+            return Matrix._wrap(values.ravel().tolist(), height, width)
+        return cls._from_array(values.reshape(height, width))
+
+    @staticmethod
+    def _storage(values, dtype):
+        return numpy.array(list(values), dtype=dtype)
+
+    def _check_reshape(self):
+        if self._view:
+            raise TypeError('The shape of a view cannot be changed.')
+
+    def index(self, value):
+        try:
+            matches = numpy.flatnonzero(self._data == value)
+        except (TypeError, ValueError):
+            return Matrix.index(self, value)
+        if not len(matches):
+            raise KeyError('Value {} not found in matrix.'.format(value))
+        return divmod(int(matches[0]), self.width)
+
+    def row(self, n):
+        return self._data[n].tolist()
+
+    def col(self, n):
+        return self._data[:, n].tolist()
+
+    def diagonal(self, row, col, direction=+1):
+        if direction == 1:
+            return self._data.diagonal(col - row).tolist()
+        else:
+            return numpy.fliplr(self._data).diagonal(self.width - 1 - col - row).tolist()
+
+    def _line(self, row, col, drow, dcol, length):
+        steps = numpy.arange(length)
+        return self._data[row + drow * steps, col + dcol * steps].tolist()
+
+    @property
+    def rows(self):
+        return self._data.tolist()
+
+    @property
+    def cols(self):
+        return self._data.T.tolist()
+
+    def addrow(self, i, values=None):
+        self._check_reshape()
+        values = self._values(values, self.width, fill=True)
+        self._data = numpy.insert(self._data, self._insertion_point(i, self.height), values, axis=0)
+        self.height += 1
+
+    def addcol(self, i, values=None):
+        self._check_reshape()
+        values = self._values(values, self.height, fill=True)
+        self._data = numpy.insert(self._data, self._insertion_point(i, self.width), values, axis=1)
+        self.width += 1
+
+    def removerow(self, i):
+        self._check_reshape()
+        self._data = numpy.delete(self._data, i, axis=0)
+        self.height -= 1
+
+    def removecol(self, i):
+        self._check_reshape()
+        self._data = numpy.delete(self._data, i, axis=1)
+        self.width -= 1
+
+    def view(self, start=None, stop=None):
+        (row0, col0), (row1, col1) = self._expand_slice(slice(start, stop))
+        if not (0 <= row0 <= row1 <= self.height and 0 <= col0 <= col1 <= self.width):
+            raise IndexError('View {}:{} out of range.'.format((row0, col0), (row1, col1)))
+        return self._from_array(self._data[row0:row1, col0:col1], view=True)
+
+    def copy(self):
+        return self._from_array(self._data.copy())
+
+    def to_numpy(self, dtype=None):
+        return numpy.array(self._data, dtype=dtype)
+
+    def _scalar(self, operation, value, reflected):
+        # Checked like `map`, so booleans add up as integers and integers
+        # don't wrap around.
+        if reflected:
+            result = self._vectorized(lambda data: operation(value, data), self._data)
+        else:
+            result = self._vectorized(lambda data: operation(data, value), self._data)
+        if result is not None:
+            return result
+        return Matrix._scalar(self, operation, value, reflected)
+
+    def sum(self, axis=None):
+        return self._data.sum(axis=axis).tolist()
+
+    def min(self, axis=None):
+        return self._data.min(axis=axis).tolist()
+
+    def max(self, axis=None):
+        return self._data.max(axis=axis).tolist()
+
+    def argmax(self, axis=None):
+        if axis is None:
+            return divmod(int(self._data.argmax()), self.width)
+        return self._data.argmax(axis=axis).tolist()
+
+    def argmin(self, axis=None):
+        if axis is None:
+            return divmod(int(self._data.argmin()), self.width)
+        return self._data.argmin(axis=axis).tolist()
+
+    def _call(self, fn, args, dtype=None):
+        """
+        Returns `fn(*args)`, with integer and boolean arrays in `args` (or in
+        tuples in `args`) cast to `dtype` if given, or None if it fails,
+        raises a float error or doesn't return an array of the right shape.
+        """
+        if dtype is not None:
+            args = _cast_integers(args, dtype)
+        try:
+            with numpy.errstate(all='raise'):
+                result = fn(*args)
+        except Exception:
+            return None
+        if isinstance(result, numpy.ndarray) and result.shape == self._data.shape:
+            return result
+        return None
+
+    def _vectorized(self, fn, *args):
+        """
+        Returns `fn(*args)` called with whole arrays, as a matrix, or None if
+        that isn't possible. See the class docstring for how results are
+        checked against calling `fn` on each item.
+        """
+        result = self._call(fn, args)
+        if result is not None and _cast_integers(args, float) is not args:
+            # NumPy integers wrap around on overflow and booleans add as
+            # booleans. Floats do neither, and are exact below 2**53.
+            floats = self._call(fn, args, float)
+            if floats is None or not numpy.array_equal(result, floats):
+                result = None
+            elif floats.dtype.kind in 'fc' and not (numpy.abs(floats) < 2 ** 53).all():
+                result = None
+            if result is None:
+                result = self._call(fn, args, object)
+        if result is None:
+            return None
+        if numpy.shares_memory(result, self._data):
+            result = result.copy()
+        return self._adopt(result, self.height, self.width)
+
+    def map(self, fn, *others, workers=None):
+        # Already vectorized when possible, so `workers` is ignored.
+        for other in others:
+            self._check_shape(other)
+        arrays = [other._data if isinstance(other, NumpyMatrix) else other.to_numpy() for other in others]
+        result = self._vectorized(fn, self._data, *arrays)
+        if result is not None:
+            return result
+        return self._adopt(list(map(fn, self, *others)), self.height, self.width)
+
+    def indexmap(self, fn, workers=None):
+        result = self._vectorized(fn, tuple(numpy.indices(self._data.shape)), self._data)
+        if result is not None:
+            return result
+        values = [fn((row, col), value)
+                  for row, line in enumerate(self._data.tolist())
+                  for col, value in enumerate(line)]
+        return self._adopt(values, self.height, self.width)
+
+    def neighbors(self, row, col, include_diagonals=True):
+        top, left = max(0, row - 1), max(0, col - 1)
+        window = self._data[top:row + 2, left:col + 2].tolist()
+        for i, line in enumerate(window, top):
+            for j, value in enumerate(line, left):
+                if (i != row or j != col) and (include_diagonals or i == row or j == col):
+                    yield value
+
+    def convolve(self, kernel, boundary='clip', fill=0, workers=None, fn=None):
+        # Already vectorized, so `workers` is ignored.
+        kernel = numpy.array(kernel.rows if isinstance(kernel, Matrix) else kernel)
+        kernel_height, kernel_width = kernel.shape
+        if kernel_height % 2 == 0 or kernel_width % 2 == 0:
+            raise ValueError('Kernel sides must be odd, got {}x{}.'.format(kernel_height, kernel_width))
+        pad = ((kernel_height // 2,) * 2, (kernel_width // 2,) * 2)
+        if boundary == 'wrap':
+            padded = numpy.pad(self._data, pad, mode='wrap')
+        elif boundary in ('clip', 'constant'):
+            padded = numpy.pad(self._data, pad, mode='constant',
+                               constant_values=fill if boundary == 'constant' else 0)
+        else:
+            raise ValueError('Unknown boundary {!r}.'.format(boundary))
+
+        total = numpy.zeros(self._data.shape, dtype=numpy.result_type(self._data, kernel, 0))
+        for i, j in zip(*numpy.nonzero(kernel)):
+            total += kernel[i, j] * padded[i:i + self.height, j:j + self.width]
+        result = self._from_array(total)
+        return result if fn is None else self.map(fn, result)
+
+    def __iter__(self):
+        return iter(self._data.ravel().tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple) and len(index) == 2:
+            return self._data[index].item()
+        elif isinstance(index, int):
+            return self._data.flat[index].item()
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                return self._data.flat[index].tolist()
+            (row0, col0), (row1, col1) = self._write_slice(index)
+            return self._from_array(self._data[row0:row1, col0:col1].copy())
+        return Matrix.__getitem__(self, index)
+
+    def _fit(self, values):
+        """
+        Makes the array able to hold `values` the way a list would, upcasting
+        its dtype if needed. If NumPy can't hold them as numbers, the matrix
+        becomes a plain Matrix and False is returned. Views can't do either,
+        and raise TypeError instead.
+        """
+        if numpy.ndim(values) == 0:
+            dtype = numpy.min_scalar_type(values)
+        else:
+            dtype = numpy.asarray(values).dtype
+        if dtype.kind in _NUMERIC_KINDS:
+            dtype = numpy.result_type(self._data.dtype, dtype)
+            if dtype == self._data.dtype:
+                return True
+        if self._view:
+            raise TypeError('A view of {} items cannot hold {} items.'.format(self._data.dtype, dtype))
+        if dtype.kind in _NUMERIC_KINDS:
+            self._data = self._data.astype(dtype)
+            self.dtype = dtype
+            return True
+        self._data = self._data.ravel().tolist()
+        self.dtype = None
+        self.__class__ = _observed_class(Matrix) if isinstance(self, _Observed) else Matrix
         return False
 
-    def _expand_slice(self, index):
+    def __setitem__(self, index, values):
+        if isinstance(index, tuple) and len(index) == 2:
+            if self._fit(values):
+                self._data[self._position(*index)] = values
+            else:
+                Matrix.__setitem__(self, index, values)
+        elif isinstance(index, int):
+            if self._fit(values):
+                self._data.flat[index] = values
+            else:
+                Matrix.__setitem__(self, index, values)
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                length = len(range(*index.indices(len(self))))
+                values = list(values)
+                if len(values) != length:
+                    raise ValueError('Expected {} values, got {}.'.format(length, len(values)))
+                if self._fit(values):
+                    self._data.flat[index] = values
+                else:
+                    Matrix.__setitem__(self, index, values)
+                return
+            (row0, col0), (row1, col1) = self._write_slice(index)
+            height, width = row1 - row0, col1 - col0
+            if height <= 0 or width <= 0:
+                return
+            if isinstance(values, NumpyMatrix):
+                values = values._data
+                if values.shape[0] < height or values.shape[1] < width:
+                    raise ValueError('Expected {}x{} values, got {}x{}.'.format(height, width, *values.shape))
+                values = values[:height, :width]
+            else:
+                lines = []
+                for row in range(height):
+                    line = values.row(row) if isinstance(values, Matrix) else values[row]
+                    if len(line) < width:
+                        raise ValueError('Expected {} values, got {}.'.format(width, len(line)))
+                    lines.append(line[:width])
+                values = lines
+            if self._fit(values):
+                self._data[row0:row1, col0:col1] = values
+            else:
+                Matrix.__setitem__(self, index, values)
+        else:
+            Matrix.__setitem__(self, index, values)
+
+    def __eq__(self, other):
+        if isinstance(other, NumpyMatrix):
+            return self._data.shape == other._data.shape and bool((self._data == other._data).all())
+        return Matrix.__eq__(self, other)
+
+def _cast_integers(values, dtype):
+    """
+    Returns `values`, an array or a tuple of arrays and tuples, with the
+    integer and boolean arrays cast to `dtype`. Returns `values` itself if
+    there are none.
+    """
+    if isinstance(values, tuple):
+        cast = tuple(_cast_integers(value, dtype) for value in values)
+        return values if all(a is b for a, b in zip(cast, values)) else cast
+    return values.astype(dtype) if values.dtype.kind in 'biu' else values
+
+def _add_bits(planes, word):
+    """
+    Adds 1 to the counters of the cells set in `word`, where `planes[k]` has
+    the k'th bit of every counter. Works on all cells of a row at once.
+    """
+    for k, plane in enumerate(planes):
+        planes[k] = plane ^ word
+        word &= plane
+        if not word:
+            break
+
+class BitMatrix(Matrix):
+    """
+    Matrix of booleans packed into one Python integer (word) per row, where
+    bit `col` of word `row` is the item at (row, col). Uses one bit per item
+    instead of one pointer, and row operations such as `&`, `|`, `^`, `~`,
+    `popcount` and `neighbor_planes` work on whole rows at once.
+
+    Items are read back as True or False. Created with `backend='bits'`.
+
+    Usage:
+    m = Matrix(1000, 1000, backend='bits')
+    m[0, 0] = True
+    (m | ~m).popcount() # 1000000
+    """
+    def __init__(self, height=0, width=0, data=None, default=False, dtype=None, backend='bits', indexed=False):
+        Matrix.__init__(self, height, width, data, default, None, None)
+        rows = [self._data[i:i + self.width] for i in range(0, len(self._data), self.width)]
+        self._words = [self._pack(row) for row in rows]
+        self._data = None
+        self.indexed = indexed
+
+    @staticmethod
+    def _pack(values):
+        """ Packs a row of truthy/falsy values into a word. """
+        return int(''.join('1' if value else '0' for value in reversed(values)) or '0', 2)
+
+    @classmethod
+    def from_words(cls, words, width):
+        """
+        Returns a matrix with the given row words, e.g. from `words` or from
+        bitwise operations on them. Bits above `width` are discarded.
+        """
+        mask = (1 << width) - 1
+        result = cls.__new__(cls)
+        result._data = None
+        result._words = [word & mask for word in words]
+        result.dtype = None
+        result.height = len(words)
+        result.width = width
+        return result
+
+    @property
+    def words(self):
+        """ Returns a list with the word of each row. """
+        return list(self._words)
+
+    @property
+    def _mask(self):
+        return (1 << self.width) - 1
+
+    @classmethod
+    def _adopt(cls, matrix):
+        """ Returns `matrix` as a BitMatrix if all its items are booleans. """
+        if all(isinstance(value, bool) for value in matrix):
+            return cls.from_words([cls._pack(row) for row in matrix.rows], matrix.width)
+        return matrix
+
+    def _get(self, row, col):
+        return (self._words[row] >> col) & 1 == 1
+
+    _line = Matrix._cell_line
+
+    def _set(self, row, col, value):
+        if value:
+            self._words[row] |= 1 << col
+        else:
+            self._words[row] &= ~(1 << col)
+
+    def popcount(self):
+        """ Returns the number of True items. """
+        return sum(bin(word).count('1') for word in self._words)
+
+    def row(self, n):
+        word = self._words[n]
+        return [bit == '1' for bit in reversed(format(word, '0{}b'.format(self.width)))] if self.width else []
+
+    def col(self, n):
+        row, n = self._position(0, n) if self.height else (0, n)
+        return [(word >> n) & 1 == 1 for word in self._words]
+
+    diagonal = Matrix._cell_diagonal
+
+    def addrow(self, i, values=None):
+        values = list(values) if values else [False] * self.width
+        if len(values) != self.width:
+            raise ValueError('Expected {} values, got {}.'.format(self.width, len(values)))
+        self._words.insert(i, self._pack(values))
+        self.height += 1
+
+    def addcol(self, i, values=None):
+        values = list(values) if values else [False] * self.height
+        if len(values) != self.height:
+            raise ValueError('Expected {} values, got {}.'.format(self.height, len(values)))
+        i = self._insertion_point(i, self.width)
+        low = (1 << i) - 1
+        self._words = [(word & low) | (bool(value) << i) | ((word >> i) << (i + 1))
+                       for word, value in zip(self._words, values)]
+        self.width += 1
+
+    def removerow(self, i):
+        self._words.pop(i)
+        self.height -= 1
+
+    def removecol(self, i):
+        i = self._position(0, i)[1] if self.height else i
+        low = (1 << i) - 1
+        self._words = [(word & low) | ((word >> (i + 1)) << i) for word in self._words]
+        self.width -= 1
+
+    def view(self, start=None, stop=None):
+        raise TypeError('BitMatrix does not support views, use slicing instead.')
+
+    def copy(self):
+        return self.from_words(self._words, self.width)
+
+    def map(self, fn, *others, workers=None):
+        return self._adopt(Matrix.map(self, fn, *others, workers=workers))
+
+    neighbors = Matrix._cell_neighbors
+
+    def neighbor_planes(self, include_diagonals=True, boundary='clip'):
         """
-        Returns (start, stop) from the given slice, filling with expected
-        values when not present and supporting negative indices.
+        Counts the True neighbors of every item, one whole row at a time.
+        Returns a list with a tuple of four words (ones, twos, fours, eights)
+        per row, where bit `col` of each word is the corresponding bit of the
+        count at (row, col). See `convolve` for `boundary`; 'constant' is not
+        supported.
+
+        count == 3 for all cells of a row: ones & twos & ~fours & ~eights
         """
-        start = list(index.start or (0, 0))
-        stop = list(index.stop or (self.height, self.width))
+        if boundary not in ('clip', 'wrap'):
+            raise ValueError('Unknown boundary {!r}.'.format(boundary))
+        height, width, mask = self.height, self.width, self._mask
+        wrap = boundary == 'wrap'
 
-        if start[0] < 0: start[0] += self.height
-        if start[1] < 0: start[1] += self.width
-        if stop[0] < 0: stop[0] += self.height
-        if stop[1] < 0: stop[1] += self.width
+        def shifted(word):
+            """ Words with the left and right neighbor of each bit. """
+            if wrap:
+                return (((word << 1) | (word >> (width - 1))) & mask,
+                        (word >> 1) | ((word & 1) << (width - 1)))
+            return (word << 1) & mask, word >> 1
 
-        return (start[0], start[1]), (stop[0], stop[1])
+        words = self._words
+        shifts = [shifted(word) for word in words]
+        result = []
+        for row in range(height):
+            planes = [0, 0, 0, 0]
+            for i in (row - 1, row + 1):
+                if wrap:
+                    i %= height
+                elif not 0 <= i < height:
+                    continue
+                _add_bits(planes, words[i])
+                if include_diagonals:
+                    _add_bits(planes, shifts[i][0])
+                    _add_bits(planes, shifts[i][1])
+            _add_bits(planes, shifts[row][0])
+            _add_bits(planes, shifts[row][1])
+            result.append(tuple(planes))
+        return result
 
-    def row_col_to_index(self, row, col):
-        return row * self.width + col
+    def neighbor_counts(self, include_diagonals=True, boundary='clip', workers=None, fn=None):
+        if boundary == 'constant':
+            return Matrix.neighbor_counts(self, include_diagonals, boundary, workers, fn)
+        values = []
+        for planes in self.neighbor_planes(include_diagonals, boundary):
+            bits = [reversed(format(plane, '0{}b'.format(self.width))) for plane in planes]
+            values.extend(int(a) + 2 * int(b) + 4 * int(c) + 8 * int(d) for a, b, c, d in zip(*bits))
+        result = Matrix._wrap(values, self.height, self.width)
+        return result if fn is None else self.map(fn, result)
 
-    def index_to_row_col(self, index):
-        return index // self.width, index % self.width
+    def _bitwise(self, other, operation):
+        if not isinstance(other, BitMatrix):
+            return self._elementwise(other, operation)
+        self._check_shape(other)
+        return self.from_words(list(map(operation, self._words, other._words)), self.width)
 
-    def getdefault(self, row, col, default):
-        if row < 0 or col < 0 or row >= self.width or col >= self.height:
-            return default
-        return self[row, col]
+    def __and__(self, other):
+        return self._bitwise(other, operator.and_)
+
+    def __or__(self, other):
+        return self._bitwise(other, operator.or_)
+
+    def __xor__(self, other):
+        return self._bitwise(other, operator.xor)
+
+    def __invert__(self):
+        return self.from_words([~word for word in self._words], self.width)
+
+    def __iter__(self):
+        for row in range(self.height):
+            for value in self.row(row):
+                yield value
 
     def __getitem__(self, index):
-        """
-        Reads values from the matrix. Index can be a int (returning the i'th
-        item), a (row, col) tuple or a slice object of the those. Thus it may
-        return a single value or a new matrix.
-        """
-        if isinstance(index, tuple):
-            if len(index) == 2:
-                row, col = index
-                return self.m[row][col]
-            elif len(index) == 3:
-                raise TypeError("You probably typed m[0,0:2,2] instead of m[(0,0):(2,2)].")
+        if isinstance(index, tuple) and len(index) == 2:
+            return self._get(*self._position(*index))
         elif isinstance(index, int):
-            row, col = self.index_to_row_col(index)
-            return self.m[row][col]
+            return self._get(*self._unflatten(index))
         elif isinstance(index, slice):
-            t = index.start or index.stop
-            if isinstance(t, int):
+            if isinstance(index.start or index.stop, int):
                 return list(self)[index]
-            else:
-                (row0, col0), (row1, col1) = self._expand_slice(index)
+            (row0, col0), (row1, col1) = self._expand_slice(index)
+            width = max(0, col1 - col0)
+            return self.from_words([word >> col0 for word in self._words[row0:row1]], width)
+        return Matrix.__getitem__(self, index)
 
-                height = row1 - row0
-                width = col1 - col0
+    def __setitem__(self, index, values):
+        if isinstance(index, tuple) and len(index) == 2:
+            row, col = self._position(*index)
+            self._set(row, col, values)
+        elif isinstance(index, int):
+            self._set_flat(index, values)
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                self._set_flat(index, values)
+                return
+            (row0, col0), (row1, col1) = self._write_slice(index)
+            width = col1 - col0
+            region = ((1 << width) - 1) << col0
+            for row in range(row1 - row0):
+                if isinstance(values, BitMatrix):
+                    word = values._words[row]
+                else:
+                    line = values.row(row) if isinstance(values, Matrix) else values[row]
+                    if len(line) < width:
+                        raise ValueError('Expected {} values, got {}.'.format(width, len(line)))
+                    word = self._pack(line[:width])
+                current = self._words[row0 + row]
+                self._words[row0 + row] = ((current & ~region) | ((word << col0) & region)) & self._mask
+        else:
+            Matrix.__setitem__(self, index, values)
 
-                result = Matrix(height, width)
-                for row in range(height):
-                    for col in range(width):
-                        result[row,col] = self.m[row0 + row][col0 + col]
-                return result
+    def __eq__(self, other):
+        if isinstance(other, BitMatrix):
+            return (self.height, self.width) == (other.height, other.width) and self._words == other._words
+        return Matrix.__eq__(self, other)
+
+class SparseMatrix(Matrix):
+    """
+    Matrix that only stores the items different from its `default`, in one
+    dict per non-empty row mapping columns to items. Memory, and the time of
+    slicing, `map` and `neighbor_counts`/`convolve` with a zero default,
+    grow with the number of stored items instead of the area. Reading whole
+    rows, columns or every item still takes time proportional to their
+    length.
+
+    Created with `backend='sparse'`. `Matrix(height, width, ...)` without
+    data creates no items at all.
+
+    Usage:
+    m = Matrix(10**6, 10**6, default=0, backend='sparse')
+    m[5, 5] = 1
+    m.items() # [((5, 5), 1)]
+    """
+    def __init__(self, height=0, width=0, data=None, default=None, dtype=None, backend='sparse', indexed=False):
+        self._data = None
+        self.dtype = None
+        self.default = default
+        self._rows = {}
+        if not data and isinstance(height, int) and isinstance(width, int):
+            self.height, self.width = height, width
         else:
-            raise TypeError("Invalid index type " + str(index))
+            dense = Matrix(height, width, data, default)
+            self.height, self.width = dense.height, dense.width
+            for index, value in enumerate(dense):
+                if value != default:
+                    self._set(*divmod(index, self.width), value=value)
+        self.indexed = indexed
 
-    def __setitem__(self, index, values):
+    @classmethod
+    def from_items(cls, height, width, items, default=None):
         """
-        Writes values to the the matrix. Index can be a int (returning the i'th
-        item), a (row, col) tuple or a slice object of the those. `values` must
-        be a single value or a matrix depending on the type of index used.
+        Returns a matrix with the given ((row, col), value) pairs, e.g. from
+        `items()` or a dict's `items()`, and `default` everywhere else.
         """
-        if isinstance(index, tuple):
-            if len(index) == 2:
-                row, col = index
-                self.m[row][col] = values
-            elif len(index) == 3:
-                raise TypeError("You probably typed m[0,0:2,2] instead of m[(0,0):(2,2)].")
+        result = cls(height, width, default=default)
+        for (row, col), value in items:
+            result[row, col] = value
+        return result
+
+    def items(self):
+        """ Returns the ((row, col), value) of stored items, in row-major order. """
+        return [((row, col), items[col])
+                for row, items in sorted(self._rows.items())
+                for col in sorted(items)]
+
+    @property
+    def stored(self):
+        """ Number of stored items, i.e. those different from `default`. """
+        return sum(len(items) for items in self._rows.values())
+
+    def _get(self, row, col):
+        items = self._rows.get(row)
+        return self.default if items is None else items.get(col, self.default)
+
+    _line = Matrix._cell_line
+
+    def _set(self, row, col, value):
+        if value != self.default:
+            self._rows.setdefault(row, {})[col] = value
+        elif row in self._rows:
+            items = self._rows[row]
+            items.pop(col, None)
+            if not items:
+                del self._rows[row]
+
+    def index(self, value):
+        if value == self.default:
+            return Matrix.index(self, value)
+        for (row, col), item in self.items():
+            if item == value:
+                return (row, col)
+        raise KeyError('Value {} not found in matrix.'.format(value))
+
+    def row(self, n):
+        n = self._position(n, 0)[0] if self.width else n
+        values = [self.default] * self.width
+        for col, value in self._rows.get(n, {}).items():
+            values[col] = value
+        return values
+
+    def col(self, n):
+        n = self._position(0, n)[1] if self.height else n
+        return [self._get(row, n) for row in range(self.height)]
+
+    diagonal = Matrix._cell_diagonal
+
+    def _check_length(self, values, length):
+        values = list(values) if values else []
+        if values and len(values) != length:
+            raise ValueError('Expected {} values, got {}.'.format(length, len(values)))
+        return values
+
+    def addrow(self, i, values=None):
+        values = self._check_length(values, self.width)
+        i = self._insertion_point(i, self.height)
+        self._rows = {row + (row >= i): items for row, items in self._rows.items()}
+        self.height += 1
+        for col, value in enumerate(values):
+            self._set(i, col, value)
+
+    def addcol(self, i, values=None):
+        values = self._check_length(values, self.height)
+        i = self._insertion_point(i, self.width)
+        self._rows = {row: {col + (col >= i): value for col, value in items.items()}
+                      for row, items in self._rows.items()}
+        self.width += 1
+        for row, value in enumerate(values):
+            self._set(row, i, value)
+
+    def removerow(self, i):
+        i = self._position(i, 0)[0] if self.width else i
+        self._rows.pop(i, None)
+        self._rows = {row - (row > i): items for row, items in self._rows.items()}
+        self.height -= 1
+
+    def removecol(self, i):
+        i = self._position(0, i)[1] if self.height else i
+        rows = {}
+        for row, items in self._rows.items():
+            items = {col - (col > i): value for col, value in items.items() if col != i}
+            if items:
+                rows[row] = items
+        self._rows = rows
+        self.width -= 1
+
+    def view(self, start=None, stop=None):
+        raise TypeError('SparseMatrix does not support views, use slicing instead.')
+
+    def copy(self):
+        result = SparseMatrix(self.height, self.width, default=self.default)
+        result._rows = {row: dict(items) for row, items in self._rows.items()}
+        return result
+
+    def map(self, fn, *others, workers=None):
+        """
+        Like `Matrix.map`, but if `fn(default)` equals the default and has
+        the same type, only the stored items are mapped, and the result is a
+        SparseMatrix with the same default. Otherwise, or with other
+        matrices, the result is dense.
+        """
+        try:
+            result = fn(self.default) if not others else None
+            keeps_default = not others and type(result) is type(self.default) and result == self.default
+        except Exception:
+            keeps_default = False
+        if not keeps_default:
+            return Matrix.map(self, fn, *others, workers=workers)
+        result = SparseMatrix(self.height, self.width, default=self.default)
+        for row, items in self._rows.items():
+            for col, value in items.items():
+                result._set(row, col, fn(value))
+        return result
+
+    def _scalar(self, operation, value, reflected):
+        """
+        Like `Matrix._scalar`, but if the operation keeps `default` as it is
+        only the stored items are computed, and the result is a SparseMatrix.
+        """
+        try:
+            result = operation(value, self.default) if reflected else operation(self.default, value)
+            keeps_default = type(result) is type(self.default) and result == self.default
+        except Exception:
+            keeps_default = False
+        if not keeps_default:
+            return Matrix._scalar(self, operation, value, reflected)
+        result = SparseMatrix(self.height, self.width, default=self.default)
+        for row, items in self._rows.items():
+            for col, item in items.items():
+                result._set(row, col, operation(value, item) if reflected else operation(item, value))
+        return result
+
+    def sum(self, axis=None):
+        if axis is not None:
+            return Matrix.sum(self, axis)
+        total = sum(sum(items.values()) for items in self._rows.values())
+        missing = len(self) - self.stored
+        return total + self.default * missing if missing else total
+
+    neighbors = Matrix._cell_neighbors
+
+    def convolve(self, kernel, boundary='clip', fill=0, workers=None, fn=None):
+        """
+        Like `Matrix.convolve`, but when the default is 0 (or False) and so
+        is `fill` for the 'constant' boundary, each stored item is added to
+        the positions it weighs on, and the result is a SparseMatrix of sums
+        with default 0. `workers` is then ignored, and `fn` is applied as in
+        `map`.
+        """
+        if self.default is None or self.default != 0 or (boundary == 'constant' and fill != 0):
+            return Matrix.convolve(self, kernel, boundary, fill, workers, fn)
+        if boundary not in ('clip', 'wrap', 'constant'):
+            raise ValueError('Unknown boundary {!r}.'.format(boundary))
+        kernel = _check_kernel(kernel)
+        center_row, center_col = len(kernel) // 2, len(kernel[0]) // 2
+        weights = [(center_row - i, center_col - j, weight)
+                   for i, line in enumerate(kernel) for j, weight in enumerate(line) if weight]
+        sums = {}
+        for row, items in self._rows.items():
+            for col, value in items.items():
+                for drow, dcol, weight in weights:
+                    i, j = row + drow, col + dcol
+                    if boundary == 'wrap':
+                        i, j = i % self.height, j % self.width
+                    elif not (0 <= i < self.height and 0 <= j < self.width):
+                        continue
+                    sums[i, j] = sums.get((i, j), 0) + weight * value
+        result = SparseMatrix.from_items(self.height, self.width, sums.items(), default=0)
+        return result if fn is None else self.map(fn, result)
+
+    def __iter__(self):
+        for row in range(self.height):
+            for value in self.row(row):
+                yield value
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple) and len(index) == 2:
+            return self._get(*self._position(*index))
         elif isinstance(index, int):
-            row, col = self.index_to_row_col(index)
-            self.m[row][col] = values
+            return self._get(*self._unflatten(index))
         elif isinstance(index, slice):
-            t = index.start or index.stop
-            if isinstance(t, int):
-                start, stop, stride = index.indices(len(self))
-                for i, j in enumerate(range(start, stop, stride)):
-                    self[i] = values[i]
-            else:
-                (row0, col0), (row1, col1) = self._expand_slice(index)
-                if isinstance(values, Matrix):
-                    values = values.m
-                for row in range(row1 - row0):
-                    for col in range(col1 - col0):
-                        self.m[row0 + row][col0 + col] = values[row][col]
+            if isinstance(index.start or index.stop, int):
+                return list(self)[index]
+            (row0, col0), (row1, col1) = self._expand_slice(index)
+            result = SparseMatrix(max(0, row1 - row0), max(0, col1 - col0), default=self.default)
+            for row, items in self._rows.items():
+                if row0 <= row < row1:
+                    for col, value in items.items():
+                        if col0 <= col < col1:
+                            result._set(row - row0, col - col0, value)
+            return result
+        return Matrix.__getitem__(self, index)
+
+    def __setitem__(self, index, values):
+        if isinstance(index, tuple) and len(index) == 2:
+            row, col = self._position(*index)
+            self._set(row, col, values)
+        elif isinstance(index, int):
+            self._set_flat(index, values)
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                self._set_flat(index, values)
+                return
+            (row0, col0), (row1, col1) = self._write_slice(index)
+            width = col1 - col0
+            if isinstance(values, SparseMatrix) and values.default == self.default:
+                if values.height < row1 - row0:
+                    raise ValueError('Expected {} rows, got {}.'.format(row1 - row0, values.height))
+                if values.width < width:
+                    raise ValueError('Expected {} values, got {}.'.format(width, values.width))
+                # Clear the rectangle, then copy only the stored items.
+                for row in range(row0, row1):
+                    for col in [col for col in self._rows.get(row, ()) if col0 <= col < col1]:
+                        self._set(row, col, self.default)
+                for row, items in values._rows.items():
+                    for col, value in items.items():
+                        if row < row1 - row0 and col < width:
+                            self._set(row0 + row, col0 + col, value)
+                return
+            for row in range(row1 - row0):
+                line = values.row(row) if isinstance(values, Matrix) else values[row]
+                if len(line) < width:
+                    raise ValueError('Expected {} values, got {}.'.format(width, len(line)))
+                for col in range(width):
+                    self._set(row0 + row, col0 + col, line[col])
         else:
-            raise TypeError("Invalid index type " + str(index))
+            Matrix.__setitem__(self, index, values)
 
-    def __repr__(self):
+    def __eq__(self, other):
+        if isinstance(other, SparseMatrix) and other.default == self.default:
+            return (self.height, self.width) == (other.height, other.width) and self._rows == other._rows
+        return Matrix.__eq__(self, other)
+
+class PermutedMatrix(Matrix):
+    """
+    Matrix kept as a list of physical rows, reached through two lists mapping
+    logical to physical row and column indices. Inserting, removing,
+    swapping and reordering rows or columns only edits those maps (and adds
+    a physical row, or one item per physical row), costing O(height + width)
+    instead of moving every item.
+
+    Removed rows and columns stay in storage until `compact`, which runs
+    automatically once they outnumber the live ones. Created with
+    `backend='permuted'`.
+
+    Usage:
+    m = Matrix(1000, 1000, backend='permuted')
+    m.addcol(0) # Appends one item to each row, nothing is shifted.
+    m.swaprows(0, -1)
+    m.compact() # Optional, makes storage match the logical order again.
+    """
+    def __init__(self, height=0, width=0, data=None, default=None, dtype=None, backend='permuted', indexed=False):
+        Matrix.__init__(self, height, width, data, default, dtype, None)
+        self._rows = [self._data[i:i + self.width] for i in range(0, len(self._data), self.width or 1)]
+        self._row_map = list(range(self.height))
+        self._col_map = list(range(self.width))
+        self._physical_width = self.width
+        self._data = None
+        self.indexed = indexed
+
+    def _get(self, row, col):
+        return self._rows[self._row_map[row]][self._col_map[col]]
+
+    def _set(self, row, col, value):
+        self._rows[self._row_map[row]][self._col_map[col]] = value
+
+    _line = Matrix._cell_line
+
+    def row(self, n):
+        return _tolist(list(map(self._rows[self._row_map[n]].__getitem__, self._col_map)))
+
+    def col(self, n):
+        col = self._col_map[n]
+        return [self._rows[row][col] for row in self._row_map]
+
+    diagonal = Matrix._cell_diagonal
+
+    def addrow(self, i, values=None):
+        values = self._values(values, self.width, fill=True)
+        physical = self._storage([self._blank] * self._physical_width, self.dtype)
+        for col, value in zip(self._col_map, values):
+            physical[col] = value
+        self._rows.append(physical)
+        self._row_map.insert(self._insertion_point(i, self.height), len(self._rows) - 1)
+        self.height += 1
+
+    def addcol(self, i, values=None):
+        values = self._values(values, self.height, fill=True)
+        col = self._physical_width
+        for physical in self._rows:
+            physical.append(self._blank)
+        for row, value in zip(self._row_map, values):
+            self._rows[row][col] = value
+        self._physical_width += 1
+        self._col_map.insert(self._insertion_point(i, self.width), col)
+        self.width += 1
+
+    def removerow(self, i):
+        del self._row_map[i]
+        self.height -= 1
+        self._compact_if_sparse()
+
+    def removecol(self, i):
+        del self._col_map[i]
+        self.width -= 1
+        self._compact_if_sparse()
+
+    def _compact_if_sparse(self):
+        if len(self._rows) > 2 * self.height + 16 or self._physical_width > 2 * self.width + 16:
+            self.compact()
+
+    def swaprows(self, i, j):
+        if self._observers:
+            # Observers are told about writes, so write.
+            return Matrix.swaprows(self, i, j)
+        self._row_map[i], self._row_map[j] = self._row_map[j], self._row_map[i]
+
+    def swapcols(self, i, j):
+        if self._observers:
+            return Matrix.swapcols(self, i, j)
+        self._col_map[i], self._col_map[j] = self._col_map[j], self._col_map[i]
+
+    def permute_rows(self, order):
+        if self._observers:
+            return Matrix.permute_rows(self, order)
+        self._row_map = [self._row_map[k] for k in self._check_permutation(order, self.height)]
+
+    def permute_cols(self, order):
+        if self._observers:
+            return Matrix.permute_cols(self, order)
+        self._col_map = [self._col_map[k] for k in self._check_permutation(order, self.width)]
+
+    def compact(self):
         """
-        Returns a multi-line string representation of the matrix. Columns are
-        aligned based on the largest item.
+        Rebuilds the physical rows in logical order, dropping removed rows
+        and columns.
+        """
+        self._rows = [self._storage(self.row(row), self.dtype) for row in range(self.height)]
+        self._row_map = list(range(self.height))
+        self._col_map = list(range(self.width))
+        self._physical_width = self.width
 
-         1  2  3  4
-         5  6  7  8
-         9 10 11 12
-        13 14 15 16
+    def view(self, start=None, stop=None):
+        raise TypeError('PermutedMatrix does not support views, use slicing instead.')
+
+    def copy(self):
+        return PermutedMatrix._from_rows([self.row(row) for row in range(self.height)], self.width, self.dtype)
+
+    @classmethod
+    def from_rows(cls, rows, dtype=None, copy=True):
+        """
+        Returns a matrix with the given rows. With `copy` False, rows that are
+        lists (or arrays of typecode `dtype`) become its physical rows as they
+        are, and must not be modified elsewhere.
         """
-        max_length = max(len(str(i)) for i in self)
-        template = '{: >' + str(max_length) + '}'
-        lines = (' '.join(map(template.format, line)) for line in self.m)
-        return '\n'.join(lines) + '\n'
+        width = len(rows[0]) if rows else 0
+        if any(len(row) != width for row in rows):
+            raise ValueError('All rows must have the same length.')
+        return cls._from_rows(rows, width, dtype, copy)
 
-    def __eq__(self, other):
-        """ Equality testing allows comparing to list of lists. """
-        if isinstance(other, Matrix):
-            return self.m == other.m
+    @classmethod
+    def _from_rows(cls, rows, width, dtype=None, copy=True):
+        result = cls.__new__(cls)
+        result._data = None
+        result.dtype = dtype
+        result.height = len(rows)
+        result.width = width
+        result._rows = [row if not copy and cls._is_storage(row, dtype) else cls._storage(row, dtype)
+                        for row in rows]
+        result._row_map = list(range(len(rows)))
+        result._col_map = list(range(width))
+        result._physical_width = width
+        return result
+
+    def neighbors(self, row, col, include_diagonals=True):
+        for i in range(max(0, row - 1), min(row + 2, self.height)):
+            physical = self._rows[self._row_map[i]]
+            for j in range(max(0, col - 1), min(col + 2, self.width)):
+                is_diagonal = (row - i != 0) and (col - j != 0)
+                if (i != row or j != col) and (include_diagonals or not is_diagonal):
+                    yield physical[self._col_map[j]]
+
+    def __iter__(self):
+        for row in range(self.height):
+            for value in self.row(row):
+                yield value
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple) and len(index) == 2:
+            return self._get(*self._position(*index))
+        elif isinstance(index, int):
+            return self._get(*self._unflatten(index))
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                return list(self)[index]
+            (row0, col0), (row1, col1) = self._expand_slice(index)
+            cols = self._col_map[col0:col1]
+            rows = [list(map(self._rows[row].__getitem__, cols)) for row in self._row_map[row0:row1]]
+            return PermutedMatrix._from_rows(rows, len(cols) if rows else 0, self.dtype)
+        return Matrix.__getitem__(self, index)
+
+    def __setitem__(self, index, values):
+        if isinstance(index, tuple) and len(index) == 2:
+            row, col = self._position(*index)
+            self._set(row, col, values)
+        elif isinstance(index, int):
+            self._set_flat(index, values)
+        elif isinstance(index, slice):
+            if isinstance(index.start or index.stop, int):
+                self._set_flat(index, values)
+                return
+            (row0, col0), (row1, col1) = self._write_slice(index)
+            width = col1 - col0
+            for row in range(row1 - row0):
+                line = values.row(row) if isinstance(values, Matrix) else values[row]
+                if len(line) < width:
+                    raise ValueError('Expected {} values, got {}.'.format(width, len(line)))
+                physical = self._rows[self._row_map[row0 + row]]
+                for col, value in zip(self._col_map[col0:col1], line[:width]):
+                    physical[col] = value
         else:
-            return self.m == other or list(self) == other
+            Matrix.__setitem__(self, index, values)
+
+class MatrixWriter(object):
+    """
+    Writes a matrix to a binary file object one row at a time, in the format
+    of `Matrix.dumps`, so it can be saved without being built in memory. Must
+    be closed, or used in a `with` block, after the last row. Compressed
+    output updates the header at the end, so the file must be seekable.
+
+    Usage:
+    with open('board.bin', 'wb') as f, MatrixWriter(f, 1000, 1000, 'B') as writer:
+        for row in rows:
+            writer.write_row(row)
+    """
+    def __init__(self, file, height, width, dtype='q', compress=False):
+        self.file = file
+        self.height = height
+        self.width = width
+        self.dtype = dtype
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(6 if compress is True else compress) if compress else None
+        self._size = 0
+        self._start = file.tell() if compress else None
+        self._write_header()
+
+    def _write_header(self):
+        flags = _COMPRESSED if self._compressor else 0
+        size = self._size if self._compressor else None
+        self.file.write(_pack_header(self.height, self.width, self.dtype, flags, size))
+
+    def _write(self, data):
+        if self._compressor:
+            data = self._compressor.compress(data)
+            self._size += len(data)
+        self.file.write(data)
+
+    def write_row(self, row):
+        """ Appends a row of `width` numbers. """
+        if self.rows_written == self.height:
+            raise ValueError('All {} rows were already written.'.format(self.height))
+        values = array(self.dtype, row)
+        if len(values) != self.width:
+            raise ValueError('Expected {} values, got {}.'.format(self.width, len(values)))
+        self._write(values.tobytes())
+        self.rows_written += 1
+
+    def close(self):
+        """ Checks all rows were written and completes the file. """
+        if self.rows_written != self.height:
+            raise ValueError('Expected {} rows, got {}.'.format(self.height, self.rows_written))
+        if self._compressor:
+            data = self._compressor.flush()
+            self._size += len(data)
+            self.file.write(data)
+            self._compressor = None
+            end = self.file.tell()
+            self.file.seek(self._start)
+            self.file.write(_pack_header(self.height, self.width, self.dtype, _COMPRESSED, self._size))
+            self.file.seek(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+
+class MatrixReader(object):
+    """
+    Reads a matrix saved by `Matrix.save` or MatrixWriter from a binary file
+    object one row at a time. After the last row, the file is positioned
+    after the matrix.
+
+    Usage:
+    with open('board.bin', 'rb') as f:
+        reader = MatrixReader(f)
+        for row in reader:
+            print(sum(row))
+    """
+    # Bytes of compressed data read at a time.
+    CHUNK_SIZE = 2**16
+
+    def __init__(self, file):
+        self.file = file
+        self.height, self.width, self.dtype, self.flags, self.size = _unpack_header(file.read(_HEADER.size))
+
+    def _chunks(self):
+        """ Yields the decompressed payload in pieces of any size. """
+        remaining = self.size
+        decompressor = zlib.decompressobj() if self.flags & _COMPRESSED else None
+        while remaining:
+            data = self.file.read(min(remaining, self.CHUNK_SIZE))
+            if not data:
+                raise ValueError('Truncated matrix data.')
+            remaining -= len(data)
+            yield decompressor.decompress(data) if decompressor else data
+        if decompressor:
+            yield decompressor.flush()
+
+    def __iter__(self):
+        row_size = self.width * array(self.dtype).itemsize
+        buffer = b''
+        rows = 0
+        for chunk in self._chunks():
+            buffer += chunk
+            whole = len(buffer) - len(buffer) % row_size if row_size else 0
+            for start in range(0, whole, row_size):
+                yield _tolist(_unpack_values(buffer[start:start + row_size], self.dtype, self.flags, self.width)[0])
+                rows += 1
+            buffer = buffer[whole:]
+        if row_size and (buffer or rows != self.height):
+            raise ValueError('Expected {} rows, got {}.'.format(self.height, rows))
 
 class _AbstractCursor(object):
     def __init__(self, board, row=None, col=None):
@@ -375,11 +3625,16 @@ class _AbstractCursor(object):
 
     @property
     def display(self):
-        old = self.board[self.row, self.col]
-        self.board[self.row, self.col] = self.symbol
-        text = str(self.board)
-        self.board[self.row, self.col] = old
-        return text
+        """
+        Returns the board as text with the cursor symbol in place of the item
+        under it. The board isn't modified, so with `board.render_cached`
+        only the cursor's row is formatted again.
+        """
+        return '\n'.join(self.board._render_lines({(self.row, self.col): self.symbol})) + '\n'
+
+    def write_to(self, file):
+        """ Writes `display` to a text file object one line at a time. """
+        self.board.write_to(file, {(self.row, self.col): self.symbol})
 
     def __repr__(self):
         return '{}(row={}, col={}, board={}x{})'.format(self.__class__.__name__, self.row, self.col, self.board.height, self.board.width)
@@ -439,3 +3694,165 @@ class BoundedCursor(_AbstractCursor):
     def right(self):
         if self.col < self.board.width - 1:
             self.col += 1
+
+def _index_kind(index):
+    """ Classifies an index the way `Matrix.__getitem__` does. """
+    if isinstance(index, tuple):
+        return 'tuple'
+    elif isinstance(index, slice):
+        return 'int-slice' if isinstance(index.start or index.stop, int) else '2d-slice'
+    return type(index).__name__
+
+def _slice_area(matrix, index):
+    """ Number of items covered by a 2D slice of `matrix`. """
+    (row0, col0), (row1, col1) = matrix._expand_slice(index)
+    return max(0, min(row1, matrix.height) - row0) * max(0, min(col1, matrix.width) - col0)
+
+def _setitem_touched(matrix, args, result):
+    index, values = args
+    if not isinstance(index, slice):
+        return 1
+    elif _index_kind(index) == 'int-slice':
+        return len(range(*index.indices(len(matrix))))
+    return _slice_area(matrix, index)
+
+# Name, item index kind and items touched by each instrumented method, as
+# functions of (matrix, args) and (matrix, args, result). Methods returning
+# generators are timed while iterated, touching one item per value yielded.
+_INSTRUMENTED = {
+    '__getitem__': (lambda m, args: _index_kind(args[0]),
+                    lambda m, args, result: len(result) if isinstance(args[0], slice) else 1),
+    '__setitem__': (lambda m, args: _index_kind(args[0]), _setitem_touched),
+    'map': (None, lambda m, args, result: len(m)),
+    'indexmap': (None, lambda m, args, result: len(m)),
+    'convolve': (None, lambda m, args, result: len(m)),
+    'neighbors': (None, None),
+    'addrow': (None, lambda m, args, result: m.width),
+    'removerow': (None, lambda m, args, result: m.width),
+    'addcol': (None, lambda m, args, result: m.height),
+    'removecol': (None, lambda m, args, result: m.height),
+    '__repr__': (None, lambda m, args, result: len(m)),
+    'write_to': (None, lambda m, args, result: len(m)),
+}
+
+# [calls, seconds, items touched] by operation name, see `enable_stats`.
+_stats = {}
+# (class, name, original function) of each method currently wrapped.
+_wrapped = []
+# Number of instrumented calls in progress, so only the outermost is counted.
+_stats_depth = 0
+
+def _instrument(name, method, kind, touched):
+    """ Returns `method` wrapped to record its calls into `_stats`. """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        global _stats_depth
+        if _stats_depth:
+            return method(self, *args, **kwargs)
+        _stats_depth += 1
+        try:
+            start = perf_counter()
+            result = method(self, *args, **kwargs)
+            elapsed = perf_counter() - start
+        finally:
+            _stats_depth -= 1
+        key = name if kind is None else '{}[{}]'.format(name, kind(self, args))
+        entry = _stats.setdefault(key, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += elapsed
+        if isinstance(result, GeneratorType):
+            return _instrument_generator(result, entry)
+        entry[2] += touched(self, args, result)
+        return result
+    return wrapper
+
+def _instrument_generator(generator, entry):
+    """ Yields from `generator`, adding its time and values to `entry`. """
+    global _stats_depth
+    while True:
+        _stats_depth += 1
+        try:
+            start = perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration:
+                return
+            finally:
+                entry[1] += perf_counter() - start
+        finally:
+            _stats_depth -= 1
+        entry[2] += 1
+        yield value
+
+def _matrix_classes():
+    """ Matrix and all its subclasses defined so far, plus `_Observed`. """
+    classes, pending = [_Observed], [Matrix]
+    while pending:
+        cls = pending.pop()
+        classes.append(cls)
+        pending.extend(cls.__subclasses__())
+    return classes
+
+def enable_stats():
+    """
+    Starts recording the number of calls, time spent and items touched by
+    indexing (by kind of index: int, tuple, int-slice or 2d-slice), `map`,
+    `indexmap`, `convolve`, `neighbors`, row and column insertion and
+    removal, `repr` and `write_to`, on all matrices. Only outermost calls are
+    recorded, so the items `map` reads are not also counted as indexing.
+
+    The methods of Matrix and its subclasses are replaced with recording
+    wrappers, which `disable_stats` removes again. Nothing is recorded or
+    slowed down otherwise. Subclasses defined after enabling are covered only
+    by the methods they inherit.
+    """
+    if _wrapped:
+        return
+    for cls in _matrix_classes():
+        for name, (kind, touched) in _INSTRUMENTED.items():
+            method = cls.__dict__.get(name)
+            if method is not None:
+                _wrapped.append((cls, name, method))
+                setattr(cls, name, _instrument(name, method, kind, touched))
+
+def disable_stats():
+    """ Stops recording, restoring the original methods. Keeps the stats. """
+    while _wrapped:
+        cls, name, method = _wrapped.pop()
+        setattr(cls, name, method)
+
+def reset_stats():
+    """ Forgets all stats recorded so far. """
+    _stats.clear()
+
+def get_stats():
+    """
+    Returns the stats recorded so far as a dict of operation name to dicts
+    with 'calls', 'seconds' and 'items', ready for `json.dump`.
+    """
+    return {name: {'calls': calls, 'seconds': seconds, 'items': items}
+            for name, (calls, seconds, items) in _stats.items()}
+
+def stats_report():
+    """ Returns the stats recorded so far as a table, slowest operation first. """
+    lines = ['{:<24} {:>10} {:>12} {:>12}'.format('operation', 'calls', 'seconds', 'items')]
+    for name, (calls, seconds, items) in sorted(_stats.items(), key=lambda item: -item[1][1]):
+        lines.append('{:<24} {:>10} {:>12.6f} {:>12}'.format(name, calls, seconds, items))
+    return '\n'.join(lines) + '\n'
+
+@contextmanager
+def collecting_stats():
+    """
+    Records fresh stats while the block runs.
+
+    Usage:
+    with collecting_stats():
+        life.step()
+    print(stats_report())
+    """
+    reset_stats()
+    enable_stats()
+    try:
+        yield
+    finally:
+        disable_stats()
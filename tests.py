@@ -1,5 +1,13 @@
 import unittest
+import io
+import operator
+import os
+import pickle
+import tempfile
+from array import array
 from matrix import *
+from life import Life, HashLife
+from tic_tac_toe import LineTracker, Game, Searcher, self_play
 
 class Test(unittest.TestCase):
     def m(self):
@@ -43,6 +51,14 @@ class Test(unittest.TestCase):
         
         self.assertEqual([2, 3, 4, 5, 6, 7, 8], m[1:-1])
 
+        # Rectangles past the right edge don't wrap into the next row.
+        self.assertRaises(IndexError, m.__getitem__, slice((0, 0), (2, 5)))
+        self.assertRaises(IndexError, m.__setitem__, slice((1, 1), (3, 4)), [[10, 11, 12], [13, 14, 15]])
+        self.assertRaises(ValueError, m.__setitem__, slice(0, 3), [])
+        self.assertRaises(ValueError, m.__setitem__, slice((0, 0), (2, 2)), [[], []])
+        self.assertEqual(self.m(), m)
+        self.assertEqual(9, len(list(m)))
+
     def test_assignment(self):
         m = self.m()
         m[0,0] = 0
@@ -77,11 +93,23 @@ class Test(unittest.TestCase):
         m.removerow(1)
         self.assertEqual(self.m(), m)
 
+        empty = Matrix([[1, 2, 3]])
+        empty.removerow(0)
+        empty.removecol(-1)
+        self.assertEqual((0, 2), (empty.height, empty.width))
+        self.assertRaises(IndexError, empty.removecol, 2)
+
     def test_map(self):
         m = self.m()
         self.assertEqual([1, 4, 9], m.map(lambda v: v**2).row(0))
         self.assertEqual([0, 1, 2], m.indexmap(lambda i, v: sum(i)).row(0))
 
+        # Like `map`, results don't keep the source dtype.
+        typed = Matrix(2, 2, dtype='i')
+        self.assertEqual([['0', '0'], ['0', '0']], typed.indexmap(lambda i, v: str(v)))
+        self.assertEqual([[0.5, 0.5]] * 2, typed.indexmap(lambda i, v: v + 0.5))
+        self.assertEqual(typed.map(str), typed.indexmap(lambda i, v: str(v)))
+
     def test_diagonals(self):
         m = self.m()
         self.assertEqual(m.diagonal(0, 0), [1, 5, 9])
@@ -108,6 +136,777 @@ class Test(unittest.TestCase):
         m = Matrix(2, 3) .map(lambda i: next(count))
         self.assertEqual(m.diagonals, [[0, 4], [1, 5], [2], [3], [0], [1, 3], [2, 4], [5]])
 
+        # Taller than wide, one diagonal per family for each of the 4 starts.
+        m = Matrix(3, 2, range(6))
+        self.assertEqual(m.diagonals, [[0, 3], [1], [2, 5], [4], [0], [1, 2], [3, 4], [5]])
+        self.assertEqual(m.diagonals, Matrix(m, backend='permuted').diagonals)
+
+    def test_lines(self):
+        m = Matrix(3, 4, range(12))
+        self.assertEqual([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]], list(m.iter_rows()))
+        self.assertEqual(m.cols, list(m.iter_cols()))
+        self.assertEqual([[3, 6, 9], [7, 10], [11]], list(m.iter_diagonals(-1))[3:])
+
+        self.assertEqual([5, 6, 7], m.line((1, 1), (0, 1), 3))
+        self.assertEqual([11, 6, 1], m.line((-1, -1), (-1, -1), 3))
+        self.assertEqual([3, 6, 9], m.line((0, 3), (1, -1), 3))
+        self.assertEqual([], m.line((0, 0), (1, 0), 0))
+        self.assertRaises(IndexError, m.line, (0, 0), (1, 1), 4)
+        self.assertRaises(ValueError, m.line, (0, 0), (0, 0), 2)
+
+        lines = list(m.lines(3))
+        self.assertEqual(6 + 4 + 2 + 2, len(lines))
+        self.assertEqual(((0, 0), (0, 1), [0, 1, 2]), lines[0])
+        self.assertEqual(((0, 3), (1, 0), [3, 7, 11]), lines[9])
+        self.assertIn(((0, 2), (1, -1), [2, 5, 8]), lines)
+        for start, direction, items in lines:
+            self.assertEqual(m.line(start, direction, 3), items)
+        self.assertEqual(lines, list(Matrix(m, backend='sparse').lines(3)))
+
+    def test_lazy(self):
+        m = Matrix(3, 4, range(12))
+        fn = lambda index, value: index[0] * 100 + value
+        chain = m.lazy().map(operator.neg).map(operator.add, m).indexmap(fn)
+        self.assertEqual(m.map(operator.neg).map(operator.add, m).indexmap(fn), chain.collect())
+        self.assertEqual([200] * 4, chain.row(-1))
+        self.assertEqual([[0] * 4, [100] * 4, [200] * 4], list(chain.iter_rows()))
+        self.assertEqual(12, len(list(chain)))
+        self.assertEqual('d', chain.collect(dtype='d').dtype)
+
+        evaluated = []
+        def record(index, value):
+            evaluated.append(index)
+            return value
+        self.assertEqual((1, 2), m.lazy().indexmap(record).index(6))
+        self.assertEqual(8, len(evaluated))
+        with self.assertRaises(KeyError):
+            m.lazy().index(99)
+        with self.assertRaises(ValueError):
+            m.lazy().map(operator.add, Matrix(2, 2))
+
+    def test_render(self):
+        m = Matrix(2, 3, [1, 2, 3, 4, 5, 6])
+        cached = Matrix(m)
+        cached.render_cached = True
+        cached[0, 1] = m[0, 1] = 200
+        repr(cached)
+        cached[1, 2] = m[1, 2] = True
+        cached.addrow(1, [7, 8, 9])
+        m.addrow(1, [7, 8, 9])
+        self.assertEqual('   1  200    3\n   7    8    9\n   4    5 True\n', repr(cached))
+        self.assertEqual(repr(m), repr(cached))
+        self.assertEqual('\n', repr(Matrix()))
+
+        for board in (m, cached):
+            f = io.StringIO()
+            board.write_to(f)
+            self.assertEqual(repr(m), f.getvalue())
+            cursor = BoundedCursor(board, 1, 1)
+            self.assertEqual('   1  200    3\n   7    @    9\n   4    5 True\n', cursor.display)
+            self.assertEqual(8, board[1, 1])
+
+    def test_changes(self):
+        m = Matrix(4, 5, range(20))
+        self.assertRaises(ValueError, m.changes)
+        m.track_changes = True
+        m[0, 0] = 0
+        self.assertEqual(set(), m.changes())
+        m[1, 1] = m[1, 2] = m[2, 1] = m[2, 2] = -1
+        m[(3, 4)] = -1
+        m[3] = m[4] = -1
+        self.assertEqual({(0, 3), (0, 4), (1, 1), (1, 2), (2, 1), (2, 2), (3, 4)}, m.changes())
+        self.assertEqual([((0, 3), (1, 5)), ((1, 1), (3, 3)), ((3, 4), (4, 5))], m.changes(rectangles=True))
+
+        m.clear_changes()
+        m[(0, 0):(2, 2)] = [[0, -1], [5, -1]]
+        self.assertEqual({(0, 1)}, m.changes())
+
+        m.clear_changes()
+        m.addrow(3)
+        m.removecol(-1)
+        self.assertEqual([((3, 0), (5, 4))], m.changes(rectangles=True))
+        m.clear_changes()
+        m.addcol(1)
+        self.assertEqual([((0, 1), (5, 5))], m.changes(rectangles=True))
+
+        m.track_changes = False
+        self.assertEqual(Matrix, type(m))
+        self.assertRaises(ValueError, m.clear_changes)
+
+    def test_stats(self):
+        getitem = Matrix.__getitem__
+        m = Matrix(3, 3, range(9), backend='sparse')
+        with collecting_stats():
+            m[0], m[1, 1], m[0:4], m[(0, 0):(2, 2)]
+            m[(1, 1):] = [[0, 0], [0, 0]]
+            m.map(abs)
+            self.assertEqual(3, len(list(m.neighbors(0, 0))))
+            m.addcol(0)
+        stats = get_stats()
+        self.assertIs(getitem, Matrix.__getitem__)
+        self.assertEqual({'__getitem__[int]', '__getitem__[tuple]', '__getitem__[int-slice]',
+                          '__getitem__[2d-slice]', '__setitem__[2d-slice]', 'map', 'neighbors', 'addcol'},
+                         set(stats))
+        self.assertEqual(1, stats['map']['calls'])
+        self.assertEqual(9, stats['map']['items'])
+        self.assertEqual(4, stats['__getitem__[int-slice]']['items'])
+        self.assertEqual(3, stats['neighbors']['items'])
+        self.assertIn('__setitem__[2d-slice]', stats_report())
+
+        m[0, 0]
+        self.assertEqual(1, get_stats()['__getitem__[tuple]']['calls'])
+        reset_stats()
+        self.assertEqual({}, get_stats())
+
+    def test_constructors(self):
+        self.assertEqual(self.m(), Matrix.from_rows([[1, 2, 3], [4, 5, 6], [7, 8, 9]]))
+        self.assertEqual(self.m(), Matrix.from_flat(range(1, 10), 3))
+        self.assertEqual(self.m(), Matrix.fromfunction(lambda row, col: row * 3 + col + 1, 3, 3))
+        self.assertEqual(self.m(), Matrix.from_buffer(array('h', range(1, 10)).tobytes(), 'h', 3))
+        self.assertEqual([[0.5] * 3] * 2, Matrix.full(2, 3, 0.5, dtype='d'))
+        self.assertEqual('d', Matrix.full(2, 3, 0.5, dtype='d').dtype)
+        self.assertRaises(ValueError, Matrix.from_flat, range(5), 3)
+        self.assertRaises(ValueError, Matrix.from_rows, [[1, 2], [3]])
+        self.assertRaises(ValueError, Matrix, 2, 2, backend='nmupy')
+
+        values = list(range(6))
+        m = Matrix.from_flat(values, 2, copy=False)
+        values[0] = -1
+        self.assertEqual(-1, m[0, 0])
+        self.assertEqual(0, Matrix.from_flat(list(range(6)), 2)[0, 0])
+        copy = m.copy()
+        m[0, 0] = 0
+        self.assertEqual(-1, copy[0, 0])
+
+        rows = [[True, False], [False, True]]
+        for cls in (SparseMatrix, BitMatrix, PermutedMatrix):
+            self.assertEqual(cls, type(cls.from_rows(rows)))
+            self.assertEqual(rows, cls.fromfunction(operator.eq, 2, 2))
+        m = PermutedMatrix.from_rows(rows, copy=False)
+        rows[0][0] = False
+        self.assertEqual(False, m[0, 0])
+
+    def test_rect(self):
+        m = Matrix(3, 4, range(12))
+        self.assertEqual([0, 0, 1, 3, 6], m.integral().row(1))
+        self.assertEqual(66, m.integral()[-1, -1])
+        for mode in (None, 'table', 'fenwick'):
+            m = Matrix(3, 4, range(12))
+            m.rect_index = mode
+            self.assertEqual(mode, m.rect_index)
+            self.assertEqual(66, m.rect_sum())
+            self.assertEqual(5 + 6 + 9 + 10, m.rect_sum(1, 1, 3, 3))
+            self.assertEqual(9 + 10 + 11, m.rect_sum(-1, 1))
+            self.assertEqual(0, m.rect_sum(2, 2, 1, 1))
+            self.assertEqual(7.5, m.rect_mean(1, 1, 3, 3))
+            self.assertRaises(ValueError, m.rect_mean, 1, 1, 1, 1)
+
+            m[1, 1] = m[2, 2] = 0
+            self.assertEqual(6 + 9, m.rect_sum(1, 1, 3, 3))
+            self.assertEqual(3, m.rect_count(0))
+            self.assertEqual(2, m.rect_count(0, 1, 1))
+            m.addrow(0, [0, 0, 0, 0])
+            self.assertEqual(7, m.rect_count(0))
+            self.assertEqual(51, m.integral()[-1, -1])
+        m.rect_index = None
+        self.assertEqual(Matrix, type(m))
+        self.assertRaises(ValueError, setattr, m, 'rect_index', 'tree')
+
+    def test_windows(self):
+        m = Matrix(3, 4, range(12))
+        self.assertEqual([[[0, 1, 2, 3], [4, 5, 6, 7]], [[8, 9, 10, 11]]], list(m.iter_rows(chunk=2)))
+        self.assertEqual([m.rows], list(m.lazy().iter_rows(chunk=5)))
+
+        tiles = list(m.iter_tiles(2, 3))
+        self.assertEqual([(0, 0), (0, 3), (2, 0), (2, 3)], [position for position, tile in tiles])
+        self.assertEqual([[0, 1, 2], [4, 5, 6]], tiles[0][1])
+        self.assertEqual([[11]], tiles[-1][1])
+        tiles = list(m.iter_tiles(2, 2, overlap=1))
+        self.assertEqual(((0, 1), [[1, 2, 3], [5, 6, 7], [9, 10, 11]]), (tiles[1][0], tiles[1][1].rows))
+        self.assertEqual(((1, 1), [[5, 6, 7], [9, 10, 11]]), (tiles[3][0], tiles[3][1].rows))
+
+        windows = list(m.windows(3, 3, fill=0))
+        self.assertEqual(12, len(windows))
+        self.assertEqual(((0, 0), [[0, 0, 0], [0, 0, 1], [0, 4, 5]]), windows[0])
+        self.assertEqual(((1, 2), [[1, 2, 3], [5, 6, 7], [9, 10, 11]]), windows[6])
+        self.assertEqual(((2, 3), [[6, 7, 0], [10, 11, 0], [0, 0, 0]]), windows[-1])
+        for position, window in windows:
+            self.assertEqual(sum(m.neighbors(*position)), sum(map(sum, window)) - m[position])
+        self.assertRaises(ValueError, list, m.windows(2, 3))
+
+    def test_arithmetic(self):
+        m = self.m()
+        self.assertEqual([[2, 3, 4], [5, 6, 7], [8, 9, 10]], m + 1)
+        self.assertEqual([[0, -1, -2], [-3, -4, -5], [-6, -7, -8]], 1 - m)
+        self.assertEqual([[1, 4, 9], [16, 25, 36], [49, 64, 81]], m * m)
+        self.assertEqual([0.5, 1.0, 1.5], (m / 2).row(0))
+        self.assertEqual(self.m(), abs(-m))
+        self.assertEqual([[0, 0, 0], [0, 0, 1], [1, 1, 1]], (m > 5).map(int))
+        self.assertEqual([False] * 4 + [True] + [False] * 4, list(m.eq(5)))
+        self.assertRaises(ValueError, operator.add, m, Matrix(2, 2))
+        self.assertTrue(m == self.m())
+
+        self.assertEqual([6, 8], m[(m > 5) & (m.eq(6) | m.eq(8))])
+        m[m > 5] = 0
+        self.assertEqual([[1, 2, 3], [4, 5, 0], [0, 0, 0]], m)
+        m[m.eq(0)] = [6, 7, 8, 9]
+        self.assertEqual(self.m(), m)
+        self.assertRaises(ValueError, m.__setitem__, m > 5, [1])
+
+        typed = Matrix(self.m(), dtype='i', indexed=True)
+        typed += 10
+        typed -= [[1, 1, 1], [1, 1, 1], [1, 1, 1]]
+        self.assertEqual(self.m() + 9, typed)
+        self.assertEqual('i', typed.dtype)
+        self.assertEqual((1, 1), typed.index(14))
+
+        self.assertEqual(45, m.sum())
+        self.assertEqual([12, 15, 18], m.sum(axis=0))
+        self.assertEqual([6, 15, 24], m.sum(axis=1))
+        self.assertEqual(1, m.min())
+        self.assertEqual([7, 8, 9], m.max(axis=0))
+        self.assertEqual((2, 2), m.argmax())
+        self.assertEqual([2, 2, 2], m.argmax(axis=0))
+        self.assertEqual([0, 0, 0], m.argmin(axis=1))
+        self.assertRaises(ValueError, m.sum, 2)
+
+        sparse = Matrix(100, 100, backend='sparse', default=0)
+        sparse[3, 4] = 5
+        self.assertEqual(SparseMatrix, type(sparse * 2))
+        self.assertEqual(10, (sparse * 2).sum())
+        self.assertEqual(1, (sparse * 2).stored)
+        bits = Matrix([[True, False], [True, True]], backend='bits')
+        self.assertEqual(BitMatrix, type(bits & bits))
+        self.assertEqual([[False, False], [True, True]], bits & Matrix([[False, True], [True, True]]))
+
+    def test_typed_storage(self):
+        m = Matrix(3, 3, range(1, 10), dtype='i')
+        self.assertEqual(self.m(), m)
+        self.assertEqual('i', m.dtype)
+        self.assertEqual(0, Matrix(2, 2, dtype='d')[1, 1])
+        self.assertEqual('i', m[(1,1):].dtype)
+        self.assertEqual([5, 6], m[(1,1):(2,3)].row(0))
+
+        m.addcol(0)
+        m.addrow(3, [1, 2, 3, 4])
+        self.assertEqual([[0, 1, 2, 3], [0, 4, 5, 6], [0, 7, 8, 9], [1, 2, 3, 4]], m)
+        m.removerow(-1)
+        m.removecol(0)
+        self.assertEqual(self.m(), m)
+
+        self.assertRaises(ValueError, m.addrow, 0, [1, 2])
+        self.assertRaises(IndexError, m.__getitem__, (0, 3))
+
+    def test_view(self):
+        m = self.m()
+        v = m.view((1,1), (3,3))
+        self.assertIsInstance(v, MatrixView)
+        self.assertEqual([[5, 6], [8, 9]], v)
+        self.assertEqual([6, 9], v.col(1))
+        self.assertEqual(8, v[2])
+        self.assertEqual([6, 8], v[1:3])
+
+        v[0,0] = 0
+        v[3] = -1
+        self.assertEqual([[1, 2, 3], [4, 0, 6], [7, 8, -1]], m)
+
+        nested = v.view((1,0))
+        self.assertEqual([[8, -1]], nested)
+        nested[0,0] = 10
+        self.assertEqual(10, m[2,1])
+
+        copy = v.copy()
+        self.assertNotIsInstance(copy, MatrixView)
+        copy[0,0] = 100
+        self.assertEqual(0, m[1,1])
+        self.assertRaises(TypeError, v.addrow, 0)
+
+        # Overlapping assignment from a view of the same matrix.
+        m = self.m()
+        m[(1,0):] = m.view(stop=(2,3))
+        self.assertEqual([[1, 2, 3], [1, 2, 3], [4, 5, 6]], m)
+
+        # Slices stay inside the view's window.
+        m = Matrix(4, 4, range(16))
+        v = m.view((0, 0), (2, 2))
+        self.assertRaises(IndexError, v.__setitem__, slice((0, 0), (2, 3)), [[-1] * 3] * 2)
+        self.assertRaises(IndexError, v.__getitem__, slice((0, 0), (2, 3)))
+        self.assertRaises(IndexError, v.__getitem__, slice((1, 0), (3, 2)))
+        self.assertEqual(Matrix(4, 4, range(16)), m)
+
+    def test_mmap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'matrix.bin')
+        with Matrix.open_mmap(path, 3, 4, 'h') as m:
+            self.assertEqual([0] * 12, list(m))
+            m[0, 1] = 5
+            m[11] = 7
+            m[(1, 1):(3, 3)] = [[1, 2], [3, 4]]
+            self.assertEqual([5, 1, 3], m.col(1))
+            self.assertEqual(Matrix([[0, 5], [0, 1]]), m[(0, 0):(2, 2)])
+            m.view((2, 0), (3, 2))[0, 0] = 9
+            self.assertEqual(9, m[2, 0])
+            self.assertEqual('h', m.copy().dtype)
+            with self.assertRaises(TypeError):
+                m.addrow(0)
+            m.flush()
+
+        with Matrix.open_mmap(path) as m:
+            self.assertEqual((3, 4, 'h'), (m.height, m.width, m.dtype))
+            self.assertEqual([[0, 5, 0, 0], [0, 1, 2, 0], [9, 3, 4, 7]], m.rows)
+            out = Matrix.open_mmap(path + '.out', 3, 4)
+            self.assertIs(out, m.lazy().map(operator.neg).collect(out=out))
+            self.assertEqual(m.map(operator.neg), out)
+            out.close()
+
+        with self.assertRaises(ValueError):
+            Matrix.open_mmap(path, 4, 4)
+        with self.assertRaises(ValueError):
+            Matrix.open_mmap(path + '.missing')
+
+        m = Matrix.open_mmap(path)
+        m.close()
+        m.close()
+        for operation in (lambda: m[0, 0], lambda: m.row(0), lambda: list(m), lambda: m.copy(), m.flush):
+            self.assertRaises(ValueError, operation)
+        with self.assertRaises(ValueError):
+            m[0, 0] = 1
+
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        with self.assertRaises(ValueError):
+            Matrix.open_mmap(path)
+
+    def test_serialization(self):
+        for m in [Matrix(3, 4, range(12)), Matrix(2, 2, [True, False, False, True]),
+                  Matrix(2, 2, [0.5, 1.5, 2.5, 3.5]), Matrix(3, 4, range(12), dtype='h').view((1, 1), (3, 3)),
+                  Matrix([[-2 ** 63, 2 ** 63 - 1]]), Matrix()]:
+            for compress in (False, True):
+                loaded = Matrix.loads(m.dumps(compress))
+                self.assertEqual(m, loaded)
+                self.assertEqual([type(item) for item in m], [type(item) for item in loaded])
+        self.assertEqual('h', Matrix.loads(Matrix(1, 2, dtype='h').dumps()).dtype)
+        for items in (['a'], [True, 2], [2 ** 64], [2 ** 53 + 1, 0.5]):
+            with self.assertRaises(TypeError):
+                Matrix([items]).dumps()
+        with self.assertRaises(ValueError):
+            Matrix.loads(Matrix(2, 2, range(4)).dumps()[:-1])
+
+        f = io.BytesIO()
+        Matrix(2, 2, range(4)).save(f, compress=True)
+        with MatrixWriter(f, 3, 2, 'B', compress=True) as writer:
+            for row in [[1, 2], [3, 4], [5, 6]]:
+                writer.write_row(row)
+        with self.assertRaises(ValueError):
+            MatrixWriter(io.BytesIO(), 1, 2).write_row([1, 2, 3])
+        f.seek(0)
+        self.assertEqual(Matrix(2, 2, range(4)), Matrix.load(f))
+        self.assertEqual([[1, 2], [3, 4], [5, 6]], list(MatrixReader(f)))
+        self.assertEqual(b'', f.read())
+
+    def test_numpy_fallback(self):
+        self.assertEqual([[0, 0], [0, 0]], Matrix(2, 2, backend='numpy'))
+        m = Matrix([['a', 'b']], backend='numpy')
+        self.assertIs(Matrix, type(m))
+        self.assertEqual((0, 1), m.index('b'))
+
+    @unittest.skipIf(numpy is None, 'NumPy not installed')
+    def test_numpy(self):
+        m = Matrix(3, 3, range(1, 10), backend='numpy')
+        self.assertIsInstance(m, NumpyMatrix)
+        self.assertEqual(self.m(), m)
+        self.assertEqual(5, m[1,1])
+        self.assertIs(int, type(m[-1]))
+        self.assertEqual([2, 3, 4, 5, 6, 7, 8], m[1:-1])
+        self.assertEqual([[5, 6], [8, 9]], m[(1,1):])
+        self.assertEqual([3, 6, 9], m.col(-1))
+        self.assertEqual([3, 5, 7], m.diagonal(1, 1, -1))
+        self.assertEqual(self.m().diagonals, m.diagonals)
+        self.assertEqual((2, 0), m.index(7))
+        self.assertEqual([2, 4, 5], sorted(m.neighbors(0, 0)))
+
+        self.assertEqual([1, 4, 9], m.map(lambda v: v**2).row(0))
+        self.assertEqual([0, 1, 2], m.indexmap(lambda i, v: sum(i)).row(0))
+        self.assertEqual(['x', '.', 'x'], m.map(lambda v: 'x' if v % 2 else '.').col(0))
+
+        # Vectorized results must match the list backend's.
+        plain = Matrix(m)
+        for fn in (lambda v: v ** 40, lambda v: v * 2 + 1, lambda v: v / 2, lambda v: v > 4, numpy.sqrt):
+            self.assertEqual(plain.map(fn), m.map(fn))
+        self.assertEqual(plain.indexmap(lambda i, v: i[0] ** 50 + v), m.indexmap(lambda i, v: i[0] ** 50 + v))
+        self.assertRaises(ZeroDivisionError, m.map, lambda v: v // 0)
+        self.assertRaises(ZeroDivisionError, Matrix(m, dtype='d', backend='numpy').map, lambda v: v / 0)
+        self.assertEqual([[2, 0]], Matrix([[True, False]], backend='numpy').map(lambda v: v + v))
+        b = Matrix([[True, False]], backend='numpy')
+        self.assertEqual([[2, 0]], b + b)
+        self.assertEqual([[2, 1]], b + True)
+        self.assertEqual([[0, 1]], 1 - b)
+        self.assertEqual([[2 ** 64]], Matrix([[2 ** 62]], backend='numpy') * 4)
+
+        v = m.view((1,1))
+        v[0,0] = 0
+        self.assertEqual(0, m[1,1])
+        m.addrow(0, [0, 0, 0])
+        m.removecol(0)
+        self.assertEqual([[0, 0], [2, 3], [0, 6], [8, 9]], m)
+
+        # Writes behave like on the list backend.
+        for backend in (None, 'numpy'):
+            w = Matrix(2, 3, range(6), backend=backend)
+            self.assertRaises(ValueError, w.__setitem__, slice((0, 0), (2, 3)), [[9]])
+            self.assertRaises(IndexError, w.__setitem__, slice((0, 0), (2, 4)), [[9] * 4] * 2)
+            w[(0, 0):(0, 0)] = []
+            w[0, 0] = 2.7
+            w[1] = 2 ** 70
+            w[0, 2] = 'x'
+            self.assertEqual([[2.7, 2 ** 70, 'x'], [3, 4, 5]], w)
+        self.assertRaises(TypeError, Matrix(2, 2, backend='numpy').view().__setitem__, (0, 0), 0.5)
+
+        a = numpy.arange(6).reshape(2, 3)
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], Matrix.from_numpy(a))
+        self.assertEqual([[1, 2, 3]], Matrix([[1, 2, 3]]).to_numpy().tolist())
+
+    def test_bits(self):
+        m = BitMatrix([[True, False, True], [False, False, True]])
+        self.assertIsInstance(Matrix(2, 2, backend='bits'), BitMatrix)
+        self.assertEqual([[True, False, True], [False, False, True]], m)
+        self.assertEqual([0b101, 0b100], m.words)
+        self.assertEqual(True, m[1, 2])
+        self.assertEqual(False, m[-2])
+        self.assertEqual([True, True], m.col(-1))
+        self.assertEqual([[False, True], [False, True]], m[(0,1):])
+        self.assertEqual(3, m.popcount())
+        self.assertEqual(' True False  True\nFalse False  True\n', repr(m))
+
+        self.assertEqual([[False, True, False], [True, True, False]], ~m)
+        self.assertEqual(0, (m & ~m).popcount())
+        self.assertEqual(6, (m | ~m).popcount())
+        self.assertEqual(m, m ^ BitMatrix(2, 3))
+
+        m.addcol(0, [True, True])
+        m.removecol(-1)
+        m.addrow(1)
+        m[(1,1):(2,3)] = [[True, True]]
+        self.assertEqual([[True, True, False], [False, True, True], [True, False, False]], m)
+        self.assertEqual([[2, 3, 3], [4, 4, 2], [1, 3, 2]], m.neighbor_counts())
+        self.assertEqual(m.neighbor_counts(boundary='wrap'), Matrix(m).neighbor_counts(boundary='wrap'))
+        self.assertIsInstance(m.map(lambda v: not v), BitMatrix)
+
+        b = BitMatrix(2, 3)
+        self.assertRaises(IndexError, b.__setitem__, slice((0, 2), (1, 4)), [[True, True]])
+        self.assertRaises(IndexError, b.__setitem__, slice((1, 0), (3, 1)), [[True], [True]])
+        self.assertEqual([0, 0], b.words)
+        b[(0, 1):(1, 3)] = BitMatrix([[True, True, True]])
+        self.assertEqual([0b110, 0], b.words)
+        self.assertEqual(3, len(b.row(0)))
+
+        life = Life(30)
+        bits = Life(1, backend='bits')
+        bits.board = BitMatrix(life.board)
+        for i in range(5):
+            life.step()
+            bits.step()
+            self.assertEqual(life.board, bits.board)
+
+    def test_indexed(self):
+        m = Matrix(3, 3, [1, 2, 1, 3, 1, 2, 0, 0, 0], indexed=True)
+        self.assertTrue(m.indexed)
+        self.assertEqual((0, 0), m.index(1))
+        self.assertEqual([(0, 0), (0, 2), (1, 1)], m.index_all(1))
+        self.assertEqual(3, m.count(0))
+        m[0, 0] = 5
+        m[(2, 0):(3, 2)] = [[2, 2]]
+        m.addrow(0, [7, 7, 7])
+        m.removecol(1)
+        self.assertEqual([[7, 7], [5, 1], [3, 2], [2, 0]], m.rows)
+        self.assertEqual((2, 1), m.index(2))
+        self.assertEqual(2, m.count(7))
+        self.assertNotIn(4, m)
+        self.assertIn(5, m)
+        with self.assertRaises(KeyError):
+            m.index(4)
+        with self.assertRaises(TypeError):
+            m.view()
+
+        z = Matrix(2, 3, [0] * 6, indexed=True)
+        z[1, 2] = z[0, 1] = z[1, 0] = 5
+        self.assertEqual((0, 1), z.index(5))
+        self.assertEqual([(0, 1), (1, 0), (1, 2)], z.index_all(5))
+        z[0, 1] = 0
+        self.assertEqual((1, 0), z.index(5))
+        self.assertEqual([(0, 0), (0, 1), (0, 2), (1, 1)], z.index_all(0))
+
+        for backend in (None, 'bits', 'sparse', 'permuted'):
+            source = Matrix(3, 3, [n % 2 for n in range(9)], backend=backend)
+            source.indexed = source.render_cached = source.track_changes = True
+            source.rect_index = 'fenwick'
+            source[1, 1] = 1
+            copy = pickle.loads(pickle.dumps(source))
+            self.assertIs(type(source), type(copy))
+            self.assertEqual(source, copy)
+            self.assertEqual((True, True, True, 'fenwick'),
+                             (copy.indexed, copy.render_cached, copy.track_changes, copy.rect_index))
+            self.assertEqual({(1, 1)}, copy.changes())
+            copy[0, 0] = 1
+            self.assertEqual((0, 0), copy.index(1))
+            self.assertEqual(6, copy.rect_sum())
+            self.assertEqual(repr(copy), repr(Matrix(copy, backend=backend)))
+        self.assertEqual(m.rows, pickle.loads(pickle.dumps(m)).rows)
+
+        m.indexed = False
+        self.assertIs(Matrix, type(m))
+        self.assertEqual([(2, 1), (3, 0)], m.index_all(2))
+        self.assertIn(5, Matrix(2, 2, range(4, 8)))
+        self.assertEqual(1, Matrix(2, 2, range(4), dtype='i').count(3))
+
+    def test_sparse(self):
+        dense = Matrix(4, 5, [0, 1, 0, 0, 0,
+                              0, 0, 0, 2, 0,
+                              0, 0, 0, 0, 0,
+                              3, 0, 0, 0, 0])
+        m = Matrix(4, 5, list(dense), default=0, backend='sparse')
+        self.assertIsInstance(m, SparseMatrix)
+        self.assertEqual(3, m.stored)
+        self.assertEqual(dense, m)
+        self.assertEqual(dense.rows, m.rows)
+        self.assertEqual(dense.col(-2), m.col(-2))
+        self.assertEqual(dense.diagonals, m.diagonals)
+        self.assertEqual(list(dense.neighbors(1, 2)), list(m.neighbors(1, 2)))
+        self.assertEqual(dense[(0, 1):(2, 4)], m[(0, 1):(2, 4)])
+        self.assertEqual((1, 3), m.index(2))
+        for boundary in ('clip', 'wrap'):
+            self.assertEqual(dense.neighbor_counts(boundary=boundary), m.neighbor_counts(boundary=boundary))
+
+        doubled = m.map(lambda value: value * 2)
+        self.assertIsInstance(doubled, SparseMatrix)
+        self.assertEqual(dense.map(lambda value: value * 2), doubled)
+        self.assertNotIsInstance(m.map(lambda value: value + 1), SparseMatrix)
+        halved = m.map(lambda value: value / 2)
+        self.assertNotIsInstance(halved, SparseMatrix)
+        self.assertIs(float, type(halved[0, 0]))
+
+        m.addrow(1, [0, 0, 5, 0, 0])
+        m.addcol(0)
+        self.assertEqual([[0, 0, 1, 0, 0, 0], [0, 0, 0, 5, 0, 0], [0, 0, 0, 0, 2, 0],
+                          [0, 0, 0, 0, 0, 0], [0, 3, 0, 0, 0, 0]], m.rows)
+        m.removerow(0)
+        m.removecol(-2)
+        m[-1, -1] = 4
+        m[1, 4] = 0
+        self.assertEqual([((0, 3), 5), ((3, 1), 3), ((3, 4), 4)], m.items())
+        for source in (Matrix(2, 2, default=0, backend='sparse'), [[7, 7], [7, 7]]):
+            self.assertRaises(IndexError, m.__setitem__, slice((3, 4), (5, 6)), source)
+            self.assertRaises(IndexError, m.__setitem__, slice((0, 4), (2, 6)), source)
+            self.assertRaises(ValueError, m.__setitem__, slice((0, 0), (2, 3)), source)
+        self.assertRaises(ValueError, m.__setitem__, slice((0, 0), (3, 2)), Matrix(2, 2, default=0, backend='sparse'))
+        self.assertEqual([((0, 3), 5), ((3, 1), 3), ((3, 4), 4)], m.items())
+
+        big = Matrix(10**9, 10**9, default=False, backend='sparse')
+        big[123, 456] = True
+        self.assertEqual(8, big.neighbor_counts().stored)
+        self.assertEqual(1, big[(100, 400):(200, 500)].stored)
+
+    def test_permuted(self):
+        for backend in (None, 'permuted'):
+            m = Matrix(3, 4, range(12), backend=backend)
+            m.swaprows(0, -1)
+            m.swapcols(1, 2)
+            self.assertEqual([[8, 10, 9, 11], [4, 6, 5, 7], [0, 2, 1, 3]], m.rows)
+            m.permute_rows([2, 0, 1])
+            m.permute_cols([3, 2, 1, 0])
+            self.assertEqual([[3, 1, 2, 0], [11, 9, 10, 8], [7, 5, 6, 4]], m.rows)
+            with self.assertRaises(ValueError):
+                m.permute_rows([0, 0, 1])
+            m.compact()
+            self.assertEqual(7, m[-1, 0])
+            self.assertRaises(ValueError, m.__setitem__, slice((0, 0), (2, 3)), [[9]])
+            self.assertRaises(IndexError, m.__setitem__, slice((0, 0), (2, 5)), [[9] * 5] * 2)
+            m[(1, 1):(3, 3)] = [[-1, -2], [-3, -4]]
+            self.assertEqual([[3, 1, 2, 0], [11, -1, -2, 8], [7, -3, -4, 4]], m.rows)
+
+        m = Matrix(3, 3, range(9), backend='permuted')
+        self.assertIsInstance(m, PermutedMatrix)
+        m.addcol(1, [-1, -2, -3])
+        m.addrow(0)
+        m.removerow(2)
+        m.removecol(-1)
+        self.assertEqual([[None, None, None], [0, -1, 1], [6, -3, 7]], m.rows)
+        self.assertEqual([None, -1, -3], m.col(1))
+        self.assertEqual(Matrix([[0, -1], [6, -3]]), m[(1, 0):(3, 2)])
+        self.assertEqual([None, -1, 6], m.diagonal(2, 0, -1))
+        m[1, 1] = 5
+        m.compact()
+        self.assertEqual([[None, None, None], [0, 5, 1], [6, -3, 7]], m.rows)
+        self.assertEqual(3, len(m._rows))
+
+    def test_convolve(self):
+        m = self.m()
+        self.assertEqual([[11, 19, 13], [23, 40, 27], [17, 31, 19]], m.neighbor_counts())
+        self.assertEqual([[6, 9, 8], [13, 20, 17], [12, 21, 14]], m.neighbor_counts(False))
+        self.assertEqual([[44, 43, 42], [41, 40, 39], [38, 37, 36]], m.neighbor_counts(boundary='wrap'))
+        self.assertEqual([[1, 1, 2], [1, 4, 5], [1, 7, 8]], m.convolve([[0, 0, 0], [1, 0, 0], [0, 0, 0]], 'constant', 1))
+        self.assertEqual([[2, 4, 6]], Matrix([[1, 2, 3]]).convolve([[2]]))
+        self.assertEqual([[5, 7, 9]], Matrix([[1, 2, 3]]).map(lambda a, b: a + b, Matrix([[4, 5, 6]])))
+        self.assertRaises(ValueError, m.convolve, [[1, 1]])
+        self.assertRaises(ValueError, m.convolve, [[1]], 'mirror')
+
+    def test_parallel(self):
+        m = Matrix(10, 7, range(70))
+        self.assertEqual(m.map(operator.neg), m.map(operator.neg, workers=3))
+        self.assertEqual(m.map(operator.add, m), m.map(operator.add, m, workers=2))
+        self.assertEqual(m.indexmap(operator.contains), m.indexmap(operator.contains, workers=2))
+        kernel = [[1, 2, 1], [0, 1, 3], [1, 1, 1]]
+        for boundary in ('clip', 'wrap', 'constant'):
+            self.assertEqual(m.convolve(kernel, boundary, 5), m.convolve(kernel, boundary, 5, workers=3))
+        self.assertEqual(m.neighbor_counts(), Matrix(m, dtype='i').neighbor_counts(workers=2))
+        for source, kernel in ((m, [[0.5]]), (m, [[0, 1, 0]]), (Matrix(1, 1, [2], dtype='d'), [[1, 0, 1]]),
+                               (Matrix(2, 2, [2**70, 1, 0, 0]), kernel), (Matrix(2, 2, [0.5, 1, 0, 0]), kernel)):
+            serial, parallel = source.convolve(kernel), source.convolve(kernel, workers=2)
+            self.assertEqual(serial, parallel)
+            self.assertEqual(list(map(type, serial)), list(map(type, parallel)))
+        board = m.map(lambda value: value % 3 == 0)
+        self.assertEqual(board.neighbor_counts(), board.neighbor_counts(workers=2))
+        serial = board.neighbor_counts(fn=Life.rule)
+        self.assertEqual(board.map(Life.rule, board.neighbor_counts()), serial)
+        self.assertEqual(serial, board.neighbor_counts(workers=2, fn=Life.rule))
+        self.assertIs(bool, type(board.neighbor_counts(workers=2, fn=Life.rule)[0]))
+
+        life = Life(20)
+        with Life(1, workers=2) as parallel:
+            pool = parallel.workers
+            parallel.board = life.board
+            life.step()
+            parallel.step()
+            self.assertEqual(life.board, parallel.board)
+        self.assertIsNone(parallel.workers)
+        self.assertRaises(RuntimeError, pool.submit, abs, -1)
+
+    def test_life(self):
+        life = Life(30)
+        for i in range(5):
+            expected = life.board.indexmap(life.step_cell)
+            life.step()
+            self.assertEqual(expected, life.board)
+        self.assertEqual(5, life.generation)
+
+        # Blinker on a 3x3 torus: every cell has the whole row as neighbors.
+        life.board = Matrix([[False, False, False], [True, True, True], [False, False, False]])
+        life.boundary = 'wrap'
+        life.step()
+        self.assertEqual([[True] * 3] * 3, life.board)
+
+    def test_life_sparse(self):
+        for boundary in ('clip', 'wrap'):
+            dense = Life(20, boundary=boundary)
+            sparse = Life(1, boundary=boundary, sparse=True)
+            sparse.board = Matrix(dense.board)
+            for i in range(10):
+                dense.step()
+                sparse.step()
+                self.assertEqual(dense.board, sparse.board)
+            self.assertEqual(400, sparse.active_counts[0])
+
+        # A block is stable, so after the first step nothing is evaluated.
+        life = Life(1, sparse=True)
+        life.board = Matrix(6, 6, default=False)
+        life.board[(2,2):(4,4)] = [[True, True], [True, True]]
+        life.step()
+        life.step()
+        self.assertEqual([36, 0], life.active_counts)
+
+        # Edits between steps are picked up, matching a dense board.
+        dense = Life(1)
+        dense.board = Matrix(life.board)
+        life.board[0, 0] = life.board[0, 1] = life.board[1, 0] = True
+        dense.board[0, 0] = dense.board[0, 1] = dense.board[1, 0] = True
+        for i in range(3):
+            life.step()
+            dense.step()
+            self.assertEqual(dense.board, life.board)
+        self.assertEqual(set(), life.board.changes())
+
+        life.boundary = dense.boundary = 'wrap'
+        life.invalidate()
+        life.step()
+        dense.step()
+        self.assertEqual(dense.board, life.board)
+        self.assertEqual(36, life.active_counts[-1])
+
+    def test_hashlife(self):
+        life = Life(40, probability_alive=0.5)
+        board = Matrix(40, 40, default=False)
+        board[(15,15):(25,25)] = life.board[(15,15):(25,25)]
+        life.board = board
+        hashlife = HashLife(board)
+        for generations in (1, 2, 4, 3):
+            for i in range(generations):
+                life.step()
+            hashlife.step(generations)
+            self.assertEqual(life.board, hashlife.to_matrix())
+        self.assertEqual(10, hashlife.generation)
+
+        # A glider moves one cell diagonally every 4 generations.
+        glider = Matrix([[False, True, False], [False, False, True], [True, True, True]])
+        hashlife = HashLife(glider, cache_size=1000)
+        hashlife.advance(10)
+        self.assertEqual(glider, hashlife.to_matrix(256, 256))
+        self.assertEqual(5, hashlife.population)
+        stats = hashlife.stats
+        self.assertGreater(stats['hits'], 0)
+        self.assertLessEqual(stats['cached'], 1000)
+
+    def test_line_tracker(self):
+        tracker = LineTracker(Matrix(5, 5, default=''), win_size=3)
+        self.assertFalse(tracker.play(0, 0, 'x'))
+        self.assertFalse(tracker.play(2, 2, 'o'))
+        self.assertFalse(tracker.play(0, 1, 'x'))
+        self.assertFalse(tracker.play(1, 3, 'o'))
+        self.assertTrue(tracker.play(3, 1, 'o'))
+        self.assertEqual('o', tracker.winner)
+        tracker.undo()
+        self.assertIsNone(tracker.winner)
+        self.assertEqual('', tracker.board[3, 1])
+        self.assertTrue(tracker.play(0, 2, 'x'))
+        self.assertEqual(3, tracker.run_length(0, 1))
+
+        tracker = LineTracker(Matrix(2, 2, default=''), win_size=3)
+        for (row, col), symbol in zip(tracker.board.indices(), 'xoox'):
+            self.assertFalse(tracker.play(row, col, symbol))
+        self.assertTrue(tracker.is_draw)
+
+    def test_search(self):
+        game = Game(3)
+        empty_hash = game.hash
+        game.make(0, 0)
+        game.make(1, 1)
+        game.make(2, 2)
+        position_hash = game.hash
+        for i in range(3):
+            game.unmake()
+        self.assertEqual(empty_hash, game.hash)
+        self.assertEqual(9, len(game.moves()))
+        game.make(2, 2)
+        game.make(1, 1)
+        game.make(0, 0)
+        self.assertEqual(position_hash, game.hash)
+        with self.assertRaises(ValueError):
+            game.make(1, 1)
+
+        # Perfect play from an empty board is a draw.
+        searcher = Searcher()
+        self.assertEqual(0, searcher.best_move(Game(3))[1])
+        self.assertGreater(searcher.hits, 0)
+
+        # 'x' to move wins at (0, 2) right away.
+        game = Game(3)
+        for move in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            game.make(*move)
+        self.assertEqual(((0, 2), 5), Searcher(table_size=10).best_move(game))
+        self.assertEqual(4, len(game.tracker.history))
+
+        self.assertEqual({None: 4}, self_play(4, workers=2))
+
 if __name__ == '__main__':
     m = Matrix(2, 3) # 2 rows, 3 columns, filled with None.
     m = Matrix([[1, 2, 3], [4, 5, 6]]) # Exactly what you expect.
@@ -116,6 +915,7 @@ if __name__ == '__main__':
     m[0,1] # Element at row 0, column 1.
     m[-1,-1] # Element at last row, last column.
     m[(0,1):(2,3)] # Two dimensional slice returns a new Matrix.
+    m.view((0,1), (2,3)) # Same rectangle, but sharing storage with m.
 
     # Or by absolute elements, like a list.
     m[5] # Element at index 5, regardless of rows and columns.
@@ -2,57 +2,305 @@
 Generalized Tic Tac Toe game for any board size, as example for Matrix usage.
 """
 from matrix import Matrix
-from collections import defaultdict
+from collections import Counter, OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import repeat
+from random import Random
 
-size = int(input('Board size (default 3): ') or 3)
-win_size = int(input('Sequence size to win (default 3): ') or 3)
+class LineTracker(object):
+    """
+    Plays moves on a board and detects wins and draws incrementally. Only the
+    lines through the last move can have changed, so a win is found by
+    walking at most `win_size - 1` cells each way along the row, column and
+    both diagonals of that move, and a draw by counting occupied cells.
 
-# The Matrix method `map` calls fn(cell_value) for every cell and builds a new
-# matrix with the results. Here we fill the matrix with numbers from 1 to
-# N^2+1.
-count = (str(i) for i in range(1, size * size + 1))
-board = Matrix(size, size, data=count, default='')
+    Usage:
+    tracker = LineTracker(Matrix(200, 200), win_size=5)
+    tracker.play(0, 0, 'x') # True if 'x' now has 5 in a line.
+    """
+    # (drow, dcol) for row, column, diagonal and anti-diagonal.
+    DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
 
-turn = 'x'
+    def __init__(self, board, win_size=3):
+        self.board = board
+        self.win_size = win_size
+        self.occupied = 0
+        self.winner = None
+        # (row, col, previous value) of each move, for `undo`.
+        self.history = []
 
-while True:
-    # When converted to string, the board prints itself as a NxM matrix with
-    # aligned columns, such as this:
-    #
-    #  1  2  3  4
-    #  5  6  7  8
-    #  9 10 11 12
-    print('\n{} turn:\n{}'.format(turn, board))
+    def _count(self, row, col, drow, dcol, symbol):
+        """
+        Counts cells equal to `symbol` from (row, col) in the given direction,
+        excluding (row, col) itself, up to win_size - 1.
+        """
+        board, count = self.board, 0
+        row, col = row + drow, col + dcol
+        while (count < self.win_size - 1 and 0 <= row < board.height and
+               0 <= col < board.width and board[row, col] == symbol):
+            count += 1
+            row, col = row + drow, col + dcol
+        return count
+
+    def run_length(self, row, col):
+        """
+        Returns the longest line of equal symbols through (row, col), capped
+        at `win_size`.
+        """
+        symbol = self.board[row, col]
+        return max(1 + self._count(row, col, drow, dcol, symbol) + self._count(row, col, -drow, -dcol, symbol)
+                   for drow, dcol in self.DIRECTIONS)
+
+    def play(self, row, col, symbol):
+        """
+        Places `symbol` at (row, col) and returns True if it completed a line
+        of `win_size` equal symbols.
+        """
+        self.history.append((row, col, self.board[row, col]))
+        self.board[row, col] = symbol
+        self.occupied += 1
+        if self.run_length(row, col) >= self.win_size:
+            self.winner = symbol
+        return self.winner == symbol
+
+    def undo(self):
+        """ Takes back the last move, restoring the previous cell value. """
+        row, col, previous = self.history.pop()
+        self.board[row, col] = previous
+        self.occupied -= 1
+        # Games stop at the first win, so it can only have been the last move.
+        self.winner = None
+
+    @property
+    def is_draw(self):
+        """ True if the board is full and nobody won. """
+        return self.winner is None and self.occupied == len(self.board)
+
+class Game(object):
+    """
+    Generalized tic-tac-toe position for programmatic play. Moves are made and
+    taken back on a single board, which also keeps a Zobrist hash: a xor of
+    one random number per (symbol, cell), updated with each move, so equal
+    positions reached by different move orders have the same hash.
+
+    Usage:
+    game = Game(4, win_size=3)
+    game.make(1, 1)
+    game.moves() # Free cells, center first.
+    game.unmake()
+    """
+    EMPTY = ''
+
+    def __init__(self, size=3, win_size=3, seed=0):
+        self.board = Matrix(size, size, default=self.EMPTY)
+        self.tracker = LineTracker(self.board, win_size)
+        self.turn = 'x'
+        self.hash = 0
+        random = Random(seed)
+        self._keys = {symbol: Matrix(size, size, (random.getrandbits(64) for i in range(size * size)))
+                      for symbol in 'xo'}
+        # Central cells take part in more lines, so trying them first makes
+        # alpha-beta cut off sooner.
+        center = (size - 1) / 2.0
+        self._order = sorted(self.board.indices(), key=lambda p: abs(p[0] - center) + abs(p[1] - center))
+
+    @property
+    def winner(self):
+        return self.tracker.winner
+
+    @property
+    def is_over(self):
+        return self.winner is not None or self.tracker.is_draw
+
+    @property
+    def empty_count(self):
+        return len(self.board) - self.tracker.occupied
+
+    def moves(self):
+        """ Returns the free cells, central ones first. """
+        board = self.board
+        return [(row, col) for row, col in self._order if board[row, col] == self.EMPTY]
+
+    def make(self, row, col):
+        """ Plays at (row, col) for the current player. Returns True on a win. """
+        if self.board[row, col] != self.EMPTY:
+            raise ValueError('Cell {} is already taken.'.format((row, col)))
+        self.hash ^= self._keys[self.turn][row, col]
+        won = self.tracker.play(row, col, self.turn)
+        self.turn = 'o' if self.turn == 'x' else 'x'
+        return won
+
+    def unmake(self):
+        """ Takes back the last move. """
+        row, col, previous = self.tracker.history[-1]
+        self.turn = 'o' if self.turn == 'x' else 'x'
+        self.hash ^= self._keys[self.turn][row, col]
+        self.tracker.undo()
+
+class Searcher(object):
+    """
+    Alpha-beta (negamax) search with a transposition table of at most
+    `table_size` positions, keyed by Zobrist hash and evicting the least
+    recently used. Scores are from the point of view of the player to move:
+    positive for a win, larger for quicker wins, 0 for a draw or unknown.
+
+    Usage:
+    move, score = Searcher().best_move(Game(3))
+    """
+    EXACT, LOWER, UPPER = range(3)
+
+    def __init__(self, table_size=2**20):
+        self.table_size = table_size
+        self.table = OrderedDict()
+        self.nodes = self.hits = 0
+
+    def best_move(self, game, depth=None):
+        """
+        Returns (move, score) for the player to move, searching `depth` plies
+        or until the end of the game.
+        """
+        depth = game.empty_count if depth is None else depth
+        best, best_score = None, None
+        alpha = -float('inf')
+        for move in self._ordered_moves(game):
+            game.make(*move)
+            score = -self.search(game, depth - 1, -float('inf'), -alpha)
+            game.unmake()
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+                alpha = max(alpha, score)
+        return best, best_score
+
+    def _ordered_moves(self, game):
+        """ Free cells, with the best move from the table first if known. """
+        moves = game.moves()
+        entry = self.table.get(game.hash)
+        if entry is not None and entry[3] in moves:
+            moves.remove(entry[3])
+            moves.insert(0, entry[3])
+        return moves
+
+    def search(self, game, depth, alpha, beta):
+        """ Returns the negamax score of `game`, within (alpha, beta). """
+        self.nodes += 1
+        if game.winner is not None:
+            # The previous player just won.
+            return -(1 + game.empty_count)
+        if depth <= 0 or game.tracker.is_draw:
+            return 0
+
+        original_alpha = alpha
+        entry = self.table.get(game.hash)
+        if entry is not None:
+            self.hits += 1
+            self.table.move_to_end(game.hash)
+            entry_depth, score, flag, move = entry
+            if entry_depth >= depth:
+                if flag == self.EXACT:
+                    return score
+                elif flag == self.LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        best, best_score = None, -float('inf')
+        for move in self._ordered_moves(game):
+            game.make(*move)
+            score = -self.search(game, depth - 1, -beta, -alpha)
+            game.unmake()
+            if score > best_score:
+                best, best_score = move, score
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = self.UPPER
+        elif best_score >= beta:
+            flag = self.LOWER
+        else:
+            flag = self.EXACT
+        self.table[game.hash] = (depth, best_score, flag, best)
+        self.table.move_to_end(game.hash)
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return best_score
+
+def play_game(size=3, win_size=3, depth=None, seed=0, random_moves=1, table_size=2**16):
+    """
+    Plays a full game between two searchers, after `random_moves` random
+    opening moves chosen with `seed`. Returns the winner symbol, or None for
+    a draw.
+    """
+    random = Random(seed)
+    game = Game(size, win_size)
+    searcher = Searcher(table_size)
+    while not game.is_over:
+        if len(game.tracker.history) < random_moves:
+            move = random.choice(game.moves())
+        else:
+            move, score = searcher.best_move(game, depth)
+        game.make(*move)
+    return game.winner
+
+def self_play(games, size=3, win_size=3, depth=None, random_moves=1, workers=None):
+    """
+    Plays `games` games with seeds 0 to games-1, using `workers` processes or
+    an existing Executor. Returns a Counter of winners (None for draws).
+    """
+    args = (repeat(size, games), repeat(win_size, games), repeat(depth, games),
+            range(games), repeat(random_moves, games))
+    if isinstance(workers, Executor):
+        return Counter(workers.map(play_game, *args))
+    with ProcessPoolExecutor(workers) as executor:
+        return Counter(executor.map(play_game, *args))
+
+def main():
+    size = int(input('Board size (default 3): ') or 3)
+    win_size = int(input('Sequence size to win (default 3): ') or 3)
+
+    # The Matrix constructor takes the values to fill the matrix with. Here we
+    # fill the matrix with numbers from 1 to N^2+1. Indexed, so finding the
+    # cell of a number doesn't scan the board.
+    count = (str(i) for i in range(1, size * size + 1))
+    board = Matrix(size, size, data=count, default='', indexed=True)
+    tracker = LineTracker(board, win_size)
+
+    turn = 'x'
 
     while True:
-        try:
-            play = input(turn + ': ')
-            # Player entered a number, now search for this number in our board.
-            row, col = board.index(play)
-            assert board[row, col] not in ('x', 'o')
-            board[row, col] = turn
+        # When converted to string, the board prints itself as a NxM matrix with
+        # aligned columns, such as this:
+        #
+        #  1  2  3  4
+        #  5  6  7  8
+        #  9 10 11 12
+        print('\n{} turn:\n{}'.format(turn, board))
+
+        while True:
+            try:
+                play = input(turn + ': ')
+                # Player entered a number, now search for this number in our board.
+                row, col = board.index(play)
+                assert board[row, col] not in ('x', 'o')
+                break
+            except Exception as e:
+                print(e)
+
+        # Only the lines through the cell played can have a new winner.
+        if tracker.play(row, col, turn):
+            # Maps every cell removing the ones that are still numbers.
+            clean_board = board.map(lambda i: i if i in 'xo' else '')
+            print('\n{} wins!\n{}'.format(turn, clean_board))
             break
-        except Exception as e:
-            print(e)
-
-    # Make a list of all lines that pass through the cell played.
-    directions = [board.row(row),
-                  board.col(col),
-                  board.diagonal(row, col, +1),
-                  board.diagonal(row, col, -1)]
-
-    # Convert lines to a single space separated string.
-    str_directions = ' '.join(''.join(line) for line in directions)
-
-    # Verify if there are three of the player symbols in a row.
-    if turn * 3 in str_directions:
-        # Maps every cell removing the ones that are still numbers.
-        clean_board = board.map(lambda i: i if i in 'xo' else '')
-        print('\n{} wins!\n{}'.format(turn, clean_board))
-        break()
-
-    if all(i in ('x', 'o') for i in board):
-        print('\nDraw!\n{}'.format(board))
-        break
-
-    turn = {'x': 'o', 'o': 'x'}[turn]
+
+        if tracker.is_draw:
+            print('\nDraw!\n{}'.format(board))
+            break
+
+        turn = {'x': 'o', 'o': 'x'}[turn]
+
+if __name__ == '__main__':
+    main()